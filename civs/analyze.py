@@ -9,49 +9,47 @@ import pathlib
 import random
 import sys
 
-import matplotlib.pyplot as plt
 import numpy as np
-import requests
-from scipy import stats
-from statsmodels.stats.proportion import proportion_confint
 
 ROOT_DIR = str(pathlib.Path(__file__).parent.parent.absolute())
 
-from utils.models import Match, Rating, User, MatchReport, Player, PlayerRating
+from utils.models import Match, Rating, User, MatchReport, Player
+import utils.buckets
+import utils.dominance
 import utils.download
-import utils.lookup
+import utils.lazy
+import utils.models
+import utils.report_columns
+import utils.solo_models
+import utils.windows
+
+plt = utils.lazy.module('matplotlib.pyplot')
+proportion_confint = utils.lazy.function('statsmodels.stats.proportion', 'proportion_confint')
 
 def pct_win_by_code():
-    constants = utils.lookup.constants()
-    civs = constants['civ']
-    maps = constants['map_type']
-    civ_ctr = Counter()
-    codes = defaultdict(lambda: {'total': 0, 'wins': 0})
-    for report in MatchReport.all('model'):
-        if report.mirror:
-            continue
-        civ_ctr[report.code] += 1
-        codes[report.code]['total'] += 1
-        if report.winner == 1:
-            codes[report.code]['wins'] += 1
-    x = []
-    y = []
-    yerr = []
+    names = utils.models.lookup().data
+    civs = names['civ']
+    maps = names['map_type']
+    columns = utils.solo_models.MatchReport.columns('model')
+    played = ~columns['mirror']
+    unique_codes, code_idx, totals = np.unique(columns['code'][played], return_inverse=True, return_counts=True)
+    code_wins = np.bincount(code_idx, weights=columns['winner'][played] == 1, minlength=len(unique_codes))
     to_print = {}
-    for code, _ in civ_ctr.most_common(100):
-        wins = codes[code]['wins']
-        total = codes[code]['total']
+    for idx in np.argsort(-totals, kind='stable')[:100]:
+        code = int(unique_codes[idx])
+        wins = int(code_wins[idx])
+        total = int(totals[idx])
         if total < 10:
             continue
         cl, cu = proportion_confint(wins, total)
         if cl < .5 and cu > .5:
             continue
         if cl >= .5:
-            c1, c2, m = [int(c) for c in code.split('-')]
+            c1, c2, m = utils.report_columns.unpack_code(code)
             low = cl*100
             high = cu*100
         if cu <= .5:
-            c2, c1, m = [int(c) for c in code.split('-')]
+            c2, c1, m = utils.report_columns.unpack_code(code)
             low = (1 - cu)*100
             high = (1 - cl)*100
         to_print[low] = '{:>10} beat {:<12} on {:15} between {:.2f}% and {:.2f}%'.format(civs[c1], civs[c2], maps[m], low, high)
@@ -91,6 +89,16 @@ class CivInfo():
         self.points = 0
         self.csv_mean = '{:.1f}'.format(self.mean * 100)
 
+    def from_interval(name, n, cl, cu):
+        """ CivInfo from an already calculated confidence interval. """
+        info = CivInfo(name, [])
+        info.n = n
+        if n:
+            info.cl, info.cu = cl, cu
+            info.mean = (cl + cu)/2
+            info.csv_mean = '{:.1f}'.format(info.mean * 100)
+        return info
+
     def __str__(self):
         return '{:12} {:.2f} ({:>5})'.format(self.name, self.mean, self.n)
 
@@ -102,8 +110,7 @@ def mean_quantiles(civs, split):
     return [np.quantile(means, pct + pct*i) for i in range(split - 1)]
 
 def graph_civ_by_map(data_set_type, map_type, split):
-    constants = utils.lookup.constants()
-    civ_names = constants['civ']
+    civ_names = utils.models.lookup().data['civ']
     civ_qs, edges = civ_by_quantiles(data_set_type, map_type, split)
     fig, axs = plt.subplots(nrows=len(civ_qs), ncols=1, sharex=True)
     hold = 0
@@ -155,30 +162,31 @@ def civs_by_snapshots(data_set_type, map_type, snapshot_count):
         experiences_raw.append(MatchExperience(match.rating_1, match.civ_1, match.civ_2, match.score, match.winner == 1))
         experiences_raw.append(MatchExperience(match.rating_2, match.civ_2, match.civ_1, match.score, match.winner == 2))
     experiences = sorted(experiences_raw, key=lambda x: x.rating)
+    ratings = np.array([experience.rating for experience in experiences])
+    civ_names = sorted(set(experience.civ for experience in experiences))
+    civ_codes = {name: idx for idx, name in enumerate(civ_names)}
+    civ_keys = np.array([civ_codes[experience.civ] for experience in experiences], dtype=np.int64)
+    values = np.array([experience.value for experience in experiences])
 
     # Each match has two players, each of which will be counted somewhere
     total_records = len(experiences)
     # we want to advance a third of a snapshot for each record set, so...
     offset = int(total_records/(snapshot_count + 2))
-    hold = 0
-    civs = defaultdict(lambda: [])
-    snapshots = []
-    civ_names = set()
+    windows = utils.windows.stepped_windows(total_records, offset*3, offset, snapshot_count)
+    sums, counts = utils.windows.sliding_sums(civ_keys, values, len(civ_names), windows)
+    cls = np.zeros(sums.shape)
+    cus = np.zeros(sums.shape)
+    played = counts > 0
+    cls[played], cus[played] = proportion_confint(sums[played], counts[played], .1)
     row_header = ['Civilization']
-    for _ in range(snapshot_count):
-        rating_max = 0
-        rating_min = 30000
-        for experience in experiences[hold: offset*3 + hold]:
-            rating_max = max(rating_max, experience.rating)
-            rating_min = min(rating_min, experience.rating)
-            civs[experience.civ].append(experience.value)
-        hold += offset
-        row_header.append('{} - {}'.format(rating_min, rating_max))
-        civ_infos = defaultdict(lambda:CivInfo('', []))
-        for name, results in civs.items():
-            civ_names.add(name)
-            civ_infos[name] = CivInfo(name, results)
-        snapshots.append(civ_infos)
+    snapshots = []
+    for idx, (start, end) in enumerate(windows):
+        if end > start:
+            row_header.append('{} - {}'.format(ratings[start], ratings[end - 1]))
+        else:
+            row_header.append('{} - {}'.format(30000, 0))
+        snapshots.append({name: CivInfo.from_interval(name, counts[idx, code], cls[idx, code], cus[idx, code])
+                          for name, code in civ_codes.items()})
     rows = [row_header]
     for name in sorted(civ_names):
         row = [name]
@@ -254,57 +262,57 @@ def civ_ranks(reports, lower, upper):
 
     return sorted(civs, key=lambda x: x.name, reverse=False)
 
-class CivChain():
-    def __init__(self, name):
-        self.name = name
-        self.code = int(name)
-        self.superiors = set()
+def dominance_graph(reports, alpha=0.05):
+    """ Civ codes and the dominance adjacency matrix (see utils.dominance) for non-mirror 1v1 reports. """
+    civs_1 = []
+    civs_2 = []
+    winners = []
+    weights = []
+    for report in reports:
+        if report.code is None or report.mirror:
+            continue
+        c1, c2, _ = utils.report_columns.unpack_code(report.code)
+        civs_1.append(c1)
+        civs_2.append(c2)
+        winners.append(report.winner)
+        weights.append(max(1 - 0.0011*report.score, 0))
+    codes = sorted(set(civs_1) | set(civs_2))
+    code_idx = {code: idx for idx, code in enumerate(codes)}
+    wins, totals = utils.dominance.matchups([code_idx[c] for c in civs_1], [code_idx[c] for c in civs_2],
+                                            winners, weights, len(codes))
+    return codes, utils.dominance.adjacency(wins, totals, alpha)
 
-def reciprocal_check(init, to_check, chain, chains, ccs):
-    for superior in ccs[to_check].superiors:
-        if superior == init:
-            chains.append(chain)
-        if superior not in chain:
-            chain.append(superior)
-            return reciprocal_check(init, superior, chain[:], chains, ccs)
-    return chains
+def victory_chains(reports, max_length=6, limit=1000):
+    """ Prints cycles of civs each superior to the next, and the civs ranked by dominance. """
+    civ_names = utils.models.lookup().data['civ']
+    codes, adj = dominance_graph(reports)
+    for cycle in utils.dominance.cycles(adj, max_length, limit):
+        print(' > '.join([civ_names[codes[idx]] for idx in cycle + cycle[:1]]))
+    for idx, score in utils.dominance.ranking(adj):
+        print('{:12} {:>3}'.format(civ_names[codes[idx]], score))
 
-def victory_chains(reports):
-    check_code = '5'
-    constants = utils.lookup.constants()
-    civ_names = constants['civ']
-    civ_ctr = Counter()
-    codes = defaultdict(lambda: {'total': 0, 'wins': 0.0})
-    for report in reports:
-        if report.mirror:
+def dominance_batch(data_set_type, max_length=6, limit=1000):
+    """ Dominance ranking and cycles for every map and rating band of a data set (reports loaded once).
+    Returns dict of (map name, rating key) to (ranked civ names with scores, cycles of civ names). """
+    civ_names = utils.models.lookup().data['civ']
+    buckets = utils.buckets.RATINGS
+    rating_keys = buckets.keys()
+    grouped = defaultdict(lambda: [])
+    for report in utils.solo_models.MatchReport.all(data_set_type):
+        # Team matches have no 1v1 code
+        if report.code is None:
             continue
-        civ_ctr[report.code] += 1
-        codes[report.code]['total'] += 1
-        if report.winner == 1:
-            codes[report.code]['wins'] += max((1 - 0.0011*report.score), 0)
-    ccs = {}
-    for code, d in codes.items():
-        c1, c2, _ = code.split('-')
-        if not c1 in ccs:
-            ccs[c1] = CivChain(c1)
-        if not c2 in ccs:
-            ccs[c2] = CivChain(c2)
-        civ1 = ccs[c1]
-        civ2 = ccs[c2]
-        cl, cu = proportion_confint(min(d['wins'], d['total']), d['total'], 0.05)
-        if cl > .5:
-            civ2.superiors.add(c1)
-            if c2 == check_code:
-                print('Vs {:12} - cl: {:.2f}, cu: {:.2f} ({:>4})'.format(civ_names[civ1.code], 1 - cu, 1 - cl, d['total']))
-        elif cu < .5:
-            civ1.superiors.add(c2)
-            if c1 == check_code:
-                print('Vs {:12} - cl: {:.2f}, cu: {:.2f} ({:>4})'.format(civ_names[civ2.code], cl, cu, d['total']))
-    for civ in ccs.values():
-        try:
-            print(reciprocal_check(civ.name, civ.name, [], [], ccs))
-        except RuntimeError as e:
-            print(e)
+        rating = (report.rating_1 + report.rating_2)/2
+        for idx in np.flatnonzero((buckets.starts < rating) & (rating <= buckets.edges)):
+            grouped[(report.map, rating_keys[idx])].append(report)
+            grouped[('all', rating_keys[idx])].append(report)
+    results = {}
+    for key, reports in grouped.items():
+        codes, adj = dominance_graph(reports)
+        ranked = [(civ_names[codes[idx]], score) for idx, score in utils.dominance.ranking(adj)]
+        chains = [[civ_names[codes[idx]] for idx in cycle] for cycle in utils.dominance.cycles(adj, max_length, limit)]
+        results[key] = (ranked, chains)
+    return results
 
 def map_popularity(data_set_type):
     matches = MatchReport.all(data_set_type)
@@ -371,7 +379,7 @@ def winning_clusters(data_set_type, map_type):
     plt.xticks(x, rotation="vertical")
     plt.show()
 def wtvr():
-    reports = MatchReport.by_map_and_rating('all', 29, 1200, 100000)
+    reports = utils.solo_models.MatchReport.by_map_and_rating('all', 29, 1200, 100000)
     victory_chains(reports)
 
 def maps_per_player(matches):
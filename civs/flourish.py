@@ -4,12 +4,17 @@
 import argparse
 from collections import defaultdict, Counter
 import csv
+import importlib
+import os
 import pathlib
 
 import numpy as np
-from statsmodels.stats.proportion import proportion_confint
 
 from utils.lookup import CIVILIZATIONS
+import utils.buckets
+import utils.models
+import utils.pipeline
+import utils.popularity
 import utils.solo_models
 import utils.team_models
 
@@ -55,28 +60,14 @@ def map_popularity(players):
             m[map_type] += 1
     return m
 
-def civ_popularity_by_rating(players, map_name, module):
+def popularity_file(module, map_name):
+    return '{}/flourish_{}_popularity.csv'.format(module.GRAPH_DIR, map_name.lower())
+
+def civ_popularity_by_rating(player_matches, map_name, module):
     print('Civ popularity by rating for {}'.format(map_name))
-    edges = [i for i in range(650, 1701, 50)]
-    edges.append(10000)
-    start = 0
-    counters = []
-    headers = []
-    edge_totals = []
-    for edge in edges:
-        total = 0.0
-        if edge == edges[-1]:
-            headers.append('{}+'.format(start + 1))
-        else:
-            headers.append('{} - {}'.format(start + 1, edge))
-        civ_ctr = Counter()
-        counters.append(civ_ctr)
-        snapshot_players = [p for p in players if start < p.best_rating() <= edge]
-        for player in snapshot_players:
-            if player.add_civ_percentages(civ_ctr, map_name, start, edge):
-                total += 1
-        edge_totals.append(total)
-        start = edge - 50
+    buckets = utils.buckets.RATINGS
+    headers = buckets.keys(' - ')
+    counters, edge_totals = utils.popularity.civ_popularity(player_matches, map_name, buckets)
     row_header = ['Civilization', 'Category', 'Image'] + headers
     rows = [row_header]
     for civ_name, civ_info in CIVILIZATIONS.items():
@@ -84,37 +75,24 @@ def civ_popularity_by_rating(players, map_name, module):
         for idx, civ_ctr in enumerate(counters):
             row.append(civ_ctr[civ_name])
         rows.append(row)
-    with open('{}/flourish_{}_popularity.csv'.format(module.GRAPH_DIR, map_name.lower()), 'w') as f:
+    with open(popularity_file(module, map_name), 'w') as f:
         writer = csv.writer(f)
         writer.writerows(rows)
 
-def civ_popularity_by_map(players, module):
+def civ_popularity_by_map(player_matches, module):
     print('civ_popularity_by_map')
     """ Writes csv for civ popularities by ratings snapshot for every map type."""
-    civ_popularity_by_rating(players, 'all', module)
-    for map_name, count in map_popularity(players).most_common():
+    civ_popularity_by_rating(player_matches, 'all', module)
+    for map_name, count in map_popularity(player_matches.players).most_common():
         if count < 1100:
             continue
-        civ_popularity_by_rating(players, map_name, module)
+        civ_popularity_by_rating(player_matches, map_name, module)
 
-def map_popularity_by_rating(players, module):
+def map_popularity_by_rating(player_matches, module):
     print('map_popularity_by_rating')
-    edges = [i for i in range(650, 1701, 50)]
-    edges.append(10000)
-    start = 0
-    counters = []
-    headers = []
-    for edge in edges:
-        if edge == edges[-1]:
-            headers.append('{}+'.format(start + 1))
-        else:
-            headers.append('{} - {}'.format(start + 1, edge))
-        map_ctr = Counter()
-        counters.append(map_ctr)
-        snapshot_players = [p for p in players if start < p.best_rating() <= edge]
-        for player in snapshot_players:
-            player.add_map_percentages(map_ctr, start, edge)
-        start = edge - 50
+    buckets = utils.buckets.RATINGS
+    headers = buckets.keys(' - ')
+    counters, _ = utils.popularity.map_popularity(player_matches, buckets)
     row_header = ['Map', 'Category', 'Image'] + headers
     rows = [row_header]
     for map_name, map_info in MAPS.items():
@@ -126,11 +104,10 @@ def map_popularity_by_rating(players, module):
         writer = csv.writer(f)
         writer.writerows(rows)
 
-def map_popularity_by_number_of_matches(players, module):
+def map_popularity_by_number_of_matches(player_matches, module):
     print('map_popularity_by_number_of_matches')
-    map_counters = defaultdict(lambda: Counter())
-    for player in players:
-        player.add_map_percentages(map_counters[len(player.matches)], 0, 10000)
+    players = player_matches.players
+    map_counters = utils.popularity.map_popularity_by_group(player_matches, player_matches.match_counts)
     rt = 0
     hold_counter = Counter()
     start_key = None
@@ -171,19 +148,66 @@ def map_popularity_by_number_of_matches(players, module):
         writer = csv.writer(f)
         writer.writerows(rows)
 
+# Fingerprints of the inputs of the last export of each report (see utils.pipeline)
+EXPORT_STATE = '{}/flourish_state.json'.format(utils.solo_models.GRAPH_DIR)
+
+# Fewest players that must have played a map for its civ popularity to be written
+MIN_MAP_PLAYERS = 1100
+
+# Modules whose code writes the csvs, so editing them exports the csvs again
+EXPORT_SOURCES = ('utils.buckets', 'utils.popularity',)
+
+def loaded_players(module, data_set_type):
+    """ Data shared by the export jobs: the rated players' matches and the number of players per map. """
+    players = [p for p in module.Player.player_values(module.MatchReport.all(data_set_type), data_set_type) if p.best_rating()]
+    return utils.popularity.PlayerMatches(players), map_popularity(players)
+
+def export_report(shared, report, module_name, map_name=None):
+    """ Pipeline job writing one flourish csv. """
+    module = importlib.import_module(module_name)
+    player_matches, map_counts = shared
+    if report == 'number_of_matches':
+        map_popularity_by_number_of_matches(player_matches, module)
+    elif report == 'map_popularity':
+        map_popularity_by_rating(player_matches, module)
+    elif map_name == 'all' or map_counts[map_name] >= MIN_MAP_PLAYERS:
+        civ_popularity_by_rating(player_matches, map_name, module)
+    elif os.path.exists(popularity_file(module, map_name)):
+        # Too few players now, so the file written when there were enough is out of date
+        os.remove(popularity_file(module, map_name))
+
+def export_pipeline(module, data_set_type, workers=None):
+    """ A job per flourish csv, each depending on the match data and rating cache. """
+    pipeline = utils.pipeline.Pipeline(EXPORT_STATE, workers)
+    inputs = [module.MatchReport.data_file(data_set_type), module.Player.rating_cache_file(data_set_type)]
+    prefix = '{}-{}'.format(module.__name__, data_set_type)
+    pipeline.add(utils.pipeline.Job('{}-number_of_matches'.format(prefix), export_report, ('number_of_matches', module.__name__,),
+                                    inputs, ['{}/flourish_map_popularity_by_num_matches.csv'.format(module.GRAPH_DIR)],
+                                    sources=EXPORT_SOURCES))
+    pipeline.add(utils.pipeline.Job('{}-map_popularity'.format(prefix), export_report, ('map_popularity', module.__name__,),
+                                    inputs, ['{}/flourish_map_popularity.csv'.format(module.GRAPH_DIR)], sources=EXPORT_SOURCES))
+    pipeline.add(utils.pipeline.Job('{}-civ_popularity-all'.format(prefix), export_report, ('civ_popularity', module.__name__, 'all',),
+                                    inputs, [popularity_file(module, 'all')], sources=EXPORT_SOURCES))
+    # Which maps have enough players is only known once the data is loaded, so there is a job for
+    # every map a report can name, and none has a required output
+    for map_name in sorted(set(utils.models.lookup().data['map_type'].values())):
+        pipeline.add(utils.pipeline.Job('{}-civ_popularity-{}'.format(prefix, map_name), export_report,
+                                        ('civ_popularity', module.__name__, map_name,), inputs, sources=EXPORT_SOURCES))
+    return pipeline
+
 def run():
     parser = argparse.ArgumentParser()
     parser.add_argument('klass', choices=('team', 'solo',), help="team or solo")
     parser.add_argument('--source', default='model', choices=('test', 'model', 'verification',), help="which data set type to use (default model)")
+    parser.add_argument('--force', action='store_true', help="write every file, even if its data has not changed")
+    parser.add_argument('--workers', type=int, help="number of processes to write files with (default one per cpu)")
     args = parser.parse_args()
     if args.klass == 'team':
         module = utils.team_models
     else:
         module = utils.solo_models
-    players = [p for p in module.Player.player_values(module.MatchReport.all(args.source), args.source) if p.best_rating()]
-    map_popularity_by_number_of_matches(players, module)
-    map_popularity_by_rating(players, module)
-    civ_popularity_by_map(players, module)
+    pipeline = export_pipeline(module, args.source, args.workers)
+    pipeline.run(lambda: loaded_players(module, args.source), args.force)
 
 if __name__ == '__main__':
     run()
@@ -4,17 +4,25 @@
 import argparse
 from collections import defaultdict, Counter
 import csv
+import importlib
+import io
 from math import sqrt
 import pathlib
 import pickle
 import os
 
-import matplotlib.pyplot as plt
+import numpy as np
 
 from utils.lookup import CIVILIZATIONS
 
 CACHED_TEMPLATE = '{}/cached_civ_popularity_map_for_{}.pickle'
 
+import utils.buckets
+import utils.heatmap
+import utils.pipeline
+import utils.popularity
+import utils.rankings
+import utils.similarity
 import utils.solo_models
 import utils.team_models
 
@@ -53,30 +61,9 @@ def default_ranking():
 def default_popularity():
     return 0
 
-def to_heatmap_table(data, xlabels, ylabels, row_label_header, normalize):
-    """ Formats data into an html table with heatmap colors. Returns a string
-    data: 2-dimensional array of heatmap number (0.0-1.0) and text
-    xlabels: labels for headers
-    ylabels: labels for rows. """
-
-    html_rows = ['<table>',]
-    # Add header
-    html_rows.append(''.join(['<tr><th>{}</th>'.format(row_label_header)] + ['<th class="xlabel">{}</th>'.format(l) for l in xlabels] + ['</tr>']))
-    # Rows
-    for idx, row in enumerate(data):
-        html_rows.append(to_heatmap_row(row, ylabels[idx], normalize))
-    html_rows.append('</table>')
-    return '\n'.join(html_rows)
-
-def to_heatmap_row(row, ylabel, normalize):
-    row_info = ['<tr><td class="ylabel">{}</td>'.format(ylabel),]
-    for heatmap, value in row:
-        row_info.append('<td class="data" style="background-color: hsl({}, 100%, 60%)">{}</td>'.format((1 - normalize(heatmap))*240, value))
-    row_info.append('</tr>')
-    return ''.join(row_info)
-
 class CachedCiv:
-    """ To avoid serialization problems, same as civ but no functions. """
+    """ To avoid serialization problems, same as civ but no functions. (Caches are now written as a
+    utils.rankings.RankingStore; kept so older caches can be read.) """
     def __init__(self, civ):
         self.name = civ.name
         self.rankings = civ.rankings
@@ -84,12 +71,19 @@ class CachedCiv:
         self.totals = civ.totals
 
 class Rankable:
-    """ Derived supercalss from Civ so get similar functionality for Map."""
-    def __init__(self, name):
+    """ Derived supercalss from Civ so get similar functionality for Map.
+    If given a utils.rankings.RankingStore, values are kept in it rather than in dicts. """
+    def __init__(self, name, store=None):
         self.name = name
-        self.rankings = defaultdict(default_ranking)
-        self.popularity = defaultdict(default_popularity)
-        self.totals = defaultdict(default_popularity)
+        self.store = store
+        if store is None:
+            self.rankings = defaultdict(default_ranking)
+            self.popularity = defaultdict(default_popularity)
+            self.totals = defaultdict(default_popularity)
+        else:
+            self.rankings = store.view('rankings', name)
+            self.popularity = store.view('popularity', name)
+            self.totals = store.view('totals', name)
 
 class Rating(Rankable):
     """ Simple object for holding rankable data for ratings."""
@@ -100,11 +94,13 @@ class Map(Rankable):
 
 class Civ(Rankable):
     """ Holds rankable data for a civ. """
-    def from_cache(cached_civ):
-        civ = Civ(cached_civ.name)
-        civ.rankings = cached_civ.rankings
-        civ.popularity = cached_civ.popularity
-        civ.totals = cached_civ.totals
+    def from_cache(cached_civ, store):
+        """ Civ from a CachedCiv, with its values moved into store. """
+        civ = Civ(cached_civ.name, store)
+        for attr in utils.rankings.DEFAULTS:
+            view = getattr(civ, attr)
+            for key, value in getattr(cached_civ, attr).items():
+                view[key] = value
         return civ
 
     def print_info(self, maps_with_data, rating_keys):
@@ -120,171 +116,131 @@ class Civ(Rankable):
         for map_name in sorted(maps_with_data):
             print(map_template.format(map_name, str(round(self.rankings[map_name], 3)), *[str(round(self.rankings['{}-{}'.format(map_name,rk)], 3)) for rk in rating_keys]))
             print(map_template.format(map_name, str(round(self.popularity[map_name], 3)), *[str(round(self.popularity['{}-{}'.format(map_name,rk)], 3)) for rk in rating_keys]))
-    def map_x_rating_heatmap_table(self, maps, rating_keys, normalize):
-        html = ['\n<h3>{}</h3>'.format(self.name)]
-        map_dict = {}
-
-        xlabels = rating_keys
-        ylabels = []
-        data = []
-        for map_name in sorted(set(maps), key=lambda x: MAP_ORDER.index(x)):
-            ylabels.append(map_name)
-            data.append([(self.popularity['{}-{}'.format(map_name, rk)], self.rankings['{}-{}'.format(map_name, rk)],) for rk in rating_keys])
-        html.append(to_heatmap_table(data, xlabels, ylabels, 'Map Name', normalize))
-        return '\n'.join(html)
-
-    def heatmap_rating_data(self, map_name, rating_keys):
-        if map_name == 'all':
-            row = [(self.popularity[rk],
-                    self.rankings[rk]) for rk in rating_keys]
-        else:
-            row = [(self.popularity['{}-{}'.format(map_name, rk)],
-                    self.rankings['{}-{}'.format(map_name, rk)]) for rk in rating_keys]
-        return row
 
-def civ_popularity_counters_for_map_bucketed_by_rating(players, map_name, edges):
+def civ_popularity_counters_for_map_bucketed_by_rating(player_matches, map_name, buckets):
     """ Returns an array of counters, each of which represents the cumulative proportional popularity of a civilization
     for every rated player for matches played when holding a rating between the edges. Note, a player is only checked
     if the player's "best rating" falls within the edges.
-    players: the list of players to evaluate
+    player_matches: utils.popularity.PlayerMatches of the players to evaluate
     map_name: which map to build the counters for. 'all' will ignore map as a filter
-    edges: an array of edges in which to delineate ratings. First edge should be greater than zero, so first "bucket"
-    will be from 1 to edges[0], second edge from edges[0] to edges[1], finishing at edges[-2] to edges[-1]."""
-    print('calculating civ_popularity_counters_for_map_bucketed_by_rating for map {} for {} edges'.format(map_name, len(edges)))
-    start = 0
-    counters = []
-    for edge in edges:
-        civ_ctr = Counter()
-        counters.append(civ_ctr)
-        snapshot_players = [p for p in players if start < p.best_rating() <= edge]
-        for player in snapshot_players:
-            player.add_civ_percentages(civ_ctr, map_name, start, edge)
-        start = edge - 50
+    buckets: utils.buckets.Buckets of the rating ranges to delineate."""
+    print('calculating civ_popularity_counters_for_map_bucketed_by_rating for map {} for {} buckets'.format(map_name, len(buckets)))
+    counters, _ = utils.popularity.civ_popularity(player_matches, map_name, buckets)
     return counters
 
 def loaded_civs(data_set_type, module, players=None):
-    """ Calculates civ popularities overall, by map, by rating bucket, and by map-rating combination.
-    returns civs, the maps that have data, and the rating keys available in the civs."""
+    """ Calculates civ popularities overall, by map, by rating bucket, and by map-rating combination,
+    and map popularities by rating bucket. returns civs, the maps that have data, the rating keys
+    available in the civs, and a Map of each of the module's maps."""
     print('loading civs for', data_set_type)
     # Setup
+    buckets = utils.buckets.RATINGS
+    rating_keys = buckets.keys()
+    store = utils.rankings.RankingStore(CIVILIZATIONS, module.MAPS, rating_keys)
     civs = {}
     for k in CIVILIZATIONS:
-        civs[k] = Civ(k)
-    edges = [i for i in range(650, 1701, 50)]
-    start = 0
-    rating_keys = []
-    for edge in edges:
-        rating_keys.append('{}-{}'.format(start + 1, edge))
-        start = edge - 50
-    rating_keys.append('{}+'.format(edges[-1] - 49))
-    edges.append(10000)
+        civs[k] = Civ(k, store)
     if not players:
         print('building players')
         players = [p for p in module.Player.player_values(module.MatchReport.all(data_set_type), data_set_type) if p.best_rating()]
+    player_matches = utils.popularity.PlayerMatches(players)
 
     # Calculate overall popularity
-    for ctr in civ_popularity_counters_for_map_bucketed_by_rating(players, 'all', [10000]):
-        total = sum(ctr.values())
-        for idx, civ in enumerate(sorted(ctr, key=lambda x: ctr[x], reverse=True)):
-            civs[civ].rankings['Overall'] = idx + 1
-            civs[civ].popularity['Overall'] = ctr[civ]/total
-            civs[civ].totals['Overall'] = total
+    for ctr in civ_popularity_counters_for_map_bucketed_by_rating(player_matches, 'all', utils.buckets.everything()):
+        store.assign('Overall', ctr)
     # # Calculate overall popularity per rating bucket
-    for ctr_idx, ctr in enumerate(civ_popularity_counters_for_map_bucketed_by_rating(players, 'all', edges)):
-        total = sum(ctr.values())
-        for idx, civ in enumerate(sorted(ctr, key=lambda x: ctr[x], reverse=True)):
-            civs[civ].rankings[rating_keys[ctr_idx]] = idx + 1
-            civs[civ].popularity[rating_keys[ctr_idx]] = ctr[civ]/total
-            civs[civ].totals[rating_keys[ctr_idx]] = total
+    for ctr_idx, ctr in enumerate(civ_popularity_counters_for_map_bucketed_by_rating(player_matches, 'all', buckets)):
+        store.assign(rating_keys[ctr_idx], ctr)
 
     # Calculate overall popularity by map
     maps_with_data = []
     for map_name in module.MAPS:
-        for ctr in civ_popularity_counters_for_map_bucketed_by_rating(players, map_name, [10000]):
+        for ctr in civ_popularity_counters_for_map_bucketed_by_rating(player_matches, map_name, utils.buckets.everything()):
             if ctr:
                 maps_with_data.append(map_name)
-                total = sum(ctr.values())
-            for idx, civ in enumerate(sorted(ctr, key=lambda x: ctr[x], reverse=True)):
-                civs[civ].rankings[map_name] = idx + 1
-                civs[civ].popularity[map_name] = ctr[civ]/total
-                civs[civ].totals[map_name] = total
+            store.assign(map_name, ctr)
 
     # Calculate overall popularity by map by rating bucket
     for map_name in maps_with_data:
-        for ctr_idx, ctr in enumerate(civ_popularity_counters_for_map_bucketed_by_rating(players, map_name, edges)):
-            total = sum(ctr.values())
-            for idx, civ in enumerate(sorted(ctr, key=lambda x: ctr[x], reverse=True)):
-                civs[civ].rankings['{}-{}'.format(map_name, rating_keys[ctr_idx])] = idx + 1
-                civs[civ].popularity['{}-{}'.format(map_name, rating_keys[ctr_idx])] = ctr[civ]/total
-                civs[civ].totals['{}-{}'.format(map_name, rating_keys[ctr_idx])] = total
-    return civs, maps_with_data, rating_keys
+        for ctr_idx, ctr in enumerate(civ_popularity_counters_for_map_bucketed_by_rating(player_matches, map_name, buckets)):
+            store.assign('{}-{}'.format(map_name, rating_keys[ctr_idx]), ctr)
+
+    # Calculate map popularity by rating bucket
+    map_store = utils.rankings.RankingStore(module.MAPS, (), rating_keys)
+    for ctr_idx, ctr in enumerate(map_popularity_counters_bucketed_by_rating(player_matches, buckets)):
+        map_store.assign(rating_keys[ctr_idx], ctr)
+    maps = {map_name: Map(map_name, map_store) for map_name in module.MAPS}
+    return civs, maps_with_data, rating_keys, maps
+
+class HeatmapData:
+    """ Popularity and rankings of civs (ordered by overall ranking) x ['all'] + maps x ['Overall'] + rating_keys,
+    read from the store once and shared by all the heatmap pages. """
+    def __init__(self, civs, maps, rating_keys, module_maps=None):
+        """ module_maps (dict of name to Map, see cached_maps) adds the popularity and rankings of
+        every map x rating_keys. """
+        store = next(iter(civs.values())).store
+        self.civ_names = [civ.name for civ in sorted(civs.values(), key=lambda x: x.rankings['Overall'])]
+        self.maps = list(maps)
+        self.rating_keys = list(rating_keys)
+        columns = ['all'] + self.maps
+        rks = ['Overall'] + self.rating_keys
+        self.popularity = store.values('popularity', columns, rks, self.civ_names)
+        self.rankings = store.values('rankings', columns, rks, self.civ_names).astype(int)
+        # Totals are the same for every civ; take them from the first civ, as before
+        self.totals = store.values('totals', columns, rks, [next(iter(civs))])[0]
+        if module_maps:
+            map_store = next(iter(module_maps.values())).store
+            self.map_names = sorted(module_maps, key=lambda x: MAP_ORDER.index(x))
+            self.map_popularity = map_store.values('popularity', rating_keys=self.rating_keys, names=self.map_names)[:, 0]
+            self.map_rankings = map_store.values('rankings', rating_keys=self.rating_keys, names=self.map_names)[:, 0].astype(int)
+            # Shaded against the most popular map in any rating bucket
+            self.map_max = map_store.values('popularity', rating_keys=map_store.rating_keys, names=list(module_maps)).max()
+
+    def map_idx(self, map_name):
+        """ Index of map_name ('all' for all maps) in the map axis. """
+        if map_name == 'all':
+            return 0
+        return self.maps.index(map_name) + 1
 
-def civs_x_maps_heatmap_table(civs, maps):
-    """ Returns a single heatmap html table of civs x maps """
-    # Build data arrays
-    civ_names = [civ.name for civ in sorted(civs.values(), key=lambda x: x.rankings['Overall'])]
-    map_dict = {}
-    header_row = civ_names
-    civ_popularities = []
-    for map_name in maps:
-        row = []
-        map_dict[map_name] = row
-        for civ_name in civ_names:
-            civ = civs[civ_name]
-            row.append((civ.popularity[map_name], civ.rankings[map_name],))
-            civ_popularities.append(civ.popularity[map_name])
-    max_value = sorted(civ_popularities, reverse=True)[len(maps)-1]
-    def normalize(x):
-        if x == 0: return x
-        if x > max_value: return 1
-        return x/max_value
-
-    # Format data as rows of html in proper order
-    html_rows = ['<h2>Overall Popularity of Civs per Map</h2>',]
-    xlabels = civ_names
-    ylabels = []
-    data = []
-    for map_name in sorted(map_dict, key=lambda x: MAP_ORDER.index(x)):
-        ylabels.append(map_name)
-        data.append(map_dict[map_name])
-    html_rows.append(to_heatmap_table(data, xlabels, ylabels, 'Map Name', normalize))
-    return '\n'.join(html_rows)
-
-def civs_x_maps_heatmap_tables_per_rating_bucket(civs, maps, rating_keys):
-    """ Returns a set of heatmap html tables of civs x maps, one table for every rating bucket."""
-    html_rows = ['<h2>Popularity of Civs on Maps by Rating</h2>',]
-    civ_names = [civ.name for civ in sorted(civs.values(), key=lambda x: x.rankings['Overall'])]
+    def rk_idx(self, rk):
+        """ Index of rating key rk ('Overall' for all ratings) in the rating key axis. """
+        if rk == 'Overall':
+            return 0
+        return self.rating_keys.index(rk) + 1
+
+    def ordered_maps(self):
+        return sorted(self.maps, key=lambda x: MAP_ORDER.index(x))
+
+def write_maps_x_ratings_heatmap_table(f, data):
+    """ Writes a single heatmap html table of maps x ratings """
+    f.write('<h3>Overall Popularity of Maps per Rating</h3>\n')
+    utils.heatmap.write_table(f, utils.heatmap.normalize(data.map_popularity, data.map_max), data.map_rankings,
+                              data.rating_keys, data.map_names, 'Map Name')
+
+def write_civs_x_maps_heatmap_table(f, data):
+    """ Writes a single heatmap html table of civs x maps """
+    map_order = [data.map_idx(m) for m in data.ordered_maps()]
+    popularity = data.popularity[:, map_order, 0].T
+    max_value = utils.heatmap.nth_largest(popularity, len(data.maps))
+    f.write('<h2>Overall Popularity of Civs per Map</h2>\n')
+    utils.heatmap.write_table(f, utils.heatmap.normalize(popularity, max_value), data.rankings[:, map_order, 0].T,
+                              data.civ_names, data.ordered_maps(), 'Map Name')
+
+def write_civs_x_maps_heatmap_tables_per_rating_bucket(f, data, rating_keys):
+    """ Writes a heatmap html table of civs x maps for every rating bucket."""
+    f.write('<h2>Popularity of Civs on Maps by Rating</h2>')
+    map_order = [data.map_idx(m) for m in data.ordered_maps()]
     for rk in rating_keys:
-        map_dict = {}
-        header_row = civ_names
-        civ_popularities = []
-        for map_name in maps:
-            row = []
-            map_dict[map_name] = row
-            for civ_name in civ_names:
-                civ = civs[civ_name]
-                row.append((civ.popularity['{}-{}'.format(map_name, rk)], civ.rankings['{}-{}'.format(map_name, rk)],))
-                civ_popularities.append(civ.popularity['{}-{}'.format(map_name, rk)])
-        max_value = sorted(civ_popularities, reverse=True)[len(civs) - 1]
-        def normalize(x):
-            if x == 0: return x
-            if x > max_value:
-                return 1
-            return x/max_value
-
-        # Format data as rows of html in proper order
-        html_rows.append('<h3>Popularity of Civs per Map for {}</h3>'.format(rk))
-        xlabels = civ_names
-        ylabels = []
-        data = []
-        for map_name in sorted(map_dict, key=lambda x: MAP_ORDER.index(x)):
-            ylabels.append(map_name)
-            data.append(map_dict[map_name])
-        html_rows.append(to_heatmap_table(data, xlabels, ylabels, 'Map Name', normalize))
-    return '\n'.join(html_rows)
-
-def write_civs_x_maps_heatmaps_to_html(civs, maps, rating_keys, module):
+        popularity = data.popularity[:, map_order, data.rk_idx(rk)].T
+        max_value = utils.heatmap.nth_largest(popularity, len(data.civ_names))
+        f.write('\n<h3>Popularity of Civs per Map for {}</h3>\n'.format(rk))
+        utils.heatmap.write_table(f, utils.heatmap.normalize(popularity, max_value),
+                                  data.rankings[:, map_order, data.rk_idx(rk)].T, data.civ_names, data.ordered_maps(), 'Map Name')
+
+def write_civs_x_maps_heatmaps_to_html(civs, maps, rating_keys, module, data=None):
     """ Generates html representation of each rating's popularity by map and civ. """
+    if data is None:
+        data = HeatmapData(civs, maps, rating_keys)
     with open('{}/rating_popularity_data.html'.format(module.GRAPH_DIR), 'w') as f:
         f.write("""<!doctype html>
 
@@ -304,11 +260,14 @@ def write_civs_x_maps_heatmaps_to_html(civs, maps, rating_keys, module):
 </head>
 <body>
 """)
-        f.write(civs_x_maps_heatmap_table(civs, maps))
-        f.write(civs_x_maps_heatmap_tables_per_rating_bucket(civs, maps, rating_keys))
+        write_civs_x_maps_heatmap_table(f, data)
+        f.write('\n')
+        write_civs_x_maps_heatmap_tables_per_rating_bucket(f, data, rating_keys)
 
-def write_maps_x_ratings_heatmaps_to_html(civs, maps, rating_keys, data_set_type, module):
+def write_maps_x_ratings_heatmaps_to_html(civs, maps, rating_keys, data_set_type, module, data=None):
     """ Generates html representation of each civ's popularity by map and rating. """
+    if data is None:
+        data = HeatmapData(civs, maps, rating_keys, cached_maps(data_set_type, module))
     with open('{}/civ_popularity_data.html'.format(module.GRAPH_DIR), 'w') as f:
         f.write("""<!doctype html>
 
@@ -329,50 +288,32 @@ def write_maps_x_ratings_heatmaps_to_html(civs, maps, rating_keys, data_set_type
 </head>
 <body>
 """)
-        f.write(all_civs_map_x_rating_heatmap_table(module, data_set_type, rating_keys))
-        civ_popularities = [civ.popularity['{}-{}'.format(map_name, rk)] for rk in rating_keys for civ in civs.values() for map_name in maps]
-        max_value = sorted(civ_popularities, reverse=True)[len(rating_keys)*len(civs)-1]
-        def normalize(x):
-            if max_value == 0:
-                return 0
-            if x > max_value:
-                return 1
-            return x/max_value
+        write_maps_x_ratings_heatmap_table(f, data)
+        map_order = [data.map_idx(m) for m in data.ordered_maps()]
+        rk_order = [data.rk_idx(rk) for rk in rating_keys]
+        # civ x map x rating key
+        popularity = data.popularity[:, map_order][:, :, rk_order]
+        rankings = data.rankings[:, map_order][:, :, rk_order]
+        max_value = utils.heatmap.nth_largest(popularity, len(rating_keys)*len(data.civ_names))
+        heat = utils.heatmap.normalize(popularity, max_value)
 
         f.write('<h2>Popularity of Each Civ Segmented by Map and Ranking</h2>')
-        for civ in sorted(civs.values(), key=lambda x: x.rankings['Overall']):
-            f.write(civ.map_x_rating_heatmap_table(maps, rating_keys, normalize))
-
-def civs_x_ratings_heatmap_table(civs, rating_keys, civ_names):
-    civ_popularities = [civ.popularity[rk] for rk in rating_keys for civ in civs.values()]
-    max_value = sorted(civ_popularities, reverse=True)[len(rating_keys)-1]
-    def normalize(x):
-        if max_value == 0:
-            return 0
-        if x > max_value:
-            return 1
-        return x/max_value
-    data = []
-    for civ_name in civ_names:
-        data.append(civs[civ_name].heatmap_rating_data('all', rating_keys))
-    return to_heatmap_table(data, rating_keys, civ_names, 'Civilization', normalize)
-
-def civs_x_ratings_heatmap_tables_per_map(civs, map_name, rating_keys, civ_names):
-    civ_popularities = [civ.popularity['{}-{}'.format(map_name, rk)] for rk in rating_keys for civ in civs.values()]
-    max_value = sorted(civ_popularities, reverse=True)[len(rating_keys)-1]
-    def normalize(x):
-        if max_value == 0:
-            return 0
-        if x > max_value:
-            return 1
-        return x/max_value
-    data = []
-    for civ_name in civ_names:
-        data.append(civs[civ_name].heatmap_rating_data(map_name, rating_keys))
-    return to_heatmap_table(data, rating_keys, civ_names, 'Civilization', normalize)
-
-def write_civs_x_ratings_heatmaps_to_html(civs, maps, rating_keys, module):
+        for civ_idx, civ_name in enumerate(data.civ_names):
+            f.write('\n<h3>{}</h3>\n'.format(civ_name))
+            utils.heatmap.write_table(f, heat[civ_idx], rankings[civ_idx], rating_keys, data.ordered_maps(), 'Map Name')
+
+def write_civs_x_ratings_heatmap_table(f, data, map_name, rating_keys):
+    """ Writes a heatmap html table of civs x ratings for map_name ('all' for all maps). """
+    rk_order = [data.rk_idx(rk) for rk in rating_keys]
+    popularity = data.popularity[:, data.map_idx(map_name), rk_order]
+    max_value = utils.heatmap.nth_largest(popularity, len(rating_keys))
+    utils.heatmap.write_table(f, utils.heatmap.normalize(popularity, max_value), data.rankings[:, data.map_idx(map_name), rk_order],
+                              rating_keys, data.civ_names, 'Civilization')
+
+def write_civs_x_ratings_heatmaps_to_html(civs, maps, rating_keys, module, data=None):
     """ Generates html representation of each map's civ popularity by rating. """
+    if data is None:
+        data = HeatmapData(civs, maps, rating_keys)
     with open('{}/map_popularity_data.html'.format(module.GRAPH_DIR), 'w') as f:
         f.write("""<!doctype html>
 
@@ -393,70 +334,39 @@ def write_civs_x_ratings_heatmaps_to_html(civs, maps, rating_keys, module):
 <body>
 """)
         f.write('<h2>Popularity of Each Civ by Rating per Map</h2>\n')
-        civ_names = [civ.name for civ in sorted(civs.values(), key=lambda x: x.rankings['Overall'])]
-        total_civ = list(civs.values())[0]
-        total = int(sum([total_civ.totals[rk] for rk in rating_keys]))
+        rk_order = [data.rk_idx(rk) for rk in rating_keys]
+        total = int(data.totals[0, rk_order].sum())
         f.write('<h3>All Maps (n={:,})</h3>\n'.format(total))
-        f.write(civs_x_ratings_heatmap_table(civs, rating_keys, civ_names))
-        for map_name in sorted(maps, key=lambda x: total_civ.totals[x], reverse=True):
-            total = int(sum([total_civ.totals['{}-{}'.format(map_name, rk)] for rk in rating_keys]))
+        write_civs_x_ratings_heatmap_table(f, data, 'all', rating_keys)
+        for map_name in sorted(data.maps, key=lambda x: data.totals[data.map_idx(x), 0], reverse=True):
+            total = int(data.totals[data.map_idx(map_name), rk_order].sum())
             f.write('\n<h3>{} (n={:,})</h3>\n'.format(map_name, total))
-            f.write(civs_x_ratings_heatmap_tables_per_map(civs, map_name, rating_keys, civ_names))
-
-class Similarity:
-    def __init__(self, map_name, similarity_rating):
-        self.map_name = map_name
-        self.similarity_rating = similarity_rating
-def map_similarity(civs, maps_with_data, rating_keys):
-    """ Determines per civ which maps are similar to each other in terms of relative popularity. """
-    def minus(l):
-        return abs(l[0] - l[1])
-    max_similarity = 0
-    civ_similars = {}
-    for civ_name, civ in civs.items():
-        most_similars = {}
-        civ_similars[civ_name] = most_similars
-        map_data_lookup = {'All Maps': [civ.popularity[rk] for rk in rating_keys]}
-        for map_name in maps_with_data:
-            most_similar = None
-            similarity_rating = 10000
-            try:
-                map_data = map_data_lookup[map_name]
-            except KeyError:
-                map_data = [civ.popularity['{}-{}'.format(map_name, rk)] for rk in rating_keys]
-                map_data_lookup[map_name] = map_data
-            for map_to_check in maps_with_data:
-                if map_name == map_to_check:
-                    continue
-                try:
-                    check_map_data = map_data_lookup[map_to_check]
-                except KeyError:
-                    check_map_data = [civ.popularity['{}-{}'.format(map_to_check, rk)] for rk in rating_keys]
-                    map_data_lookup[map_to_check] = check_map_data
-
-                map_diff = sum(map(minus, zip(map_data, check_map_data)))
-
-                if map_diff < similarity_rating:
-                    similarity_rating = map_diff
-                    most_similar = Similarity(map_to_check, similarity_rating)
-            most_similars[map_name] = most_similar
-            max_similarity = max(max_similarity, most_similar.similarity_rating)
-    best_match = {}
-    for map_name in maps_with_data:
-        similarity_ctr = Counter()
-        for similars in civ_similars.values():
-            similar = similars[map_name]
-            similarity_ctr[similar.map_name] += (max_similarity - similar.similarity_rating)
-        best_match[map_name] = similarity_ctr.most_common(2)
+            write_civs_x_ratings_heatmap_table(f, data, map_name, rating_keys)
+
+def popularity_cube(civs, maps, rating_keys):
+    """ civ x map x rating key array of popularity, in civs and maps order. 'All Maps' is the
+    civ's popularity over all maps. """
+    store = next(iter(civs.values())).store
+    columns = ['all' if map_name == 'All Maps' else map_name for map_name in maps]
+    return store.values('popularity', columns, rating_keys, list(civs))
+
+def map_similarity(civs, maps_with_data, rating_keys, metric='l1'):
+    """ Determines per civ which maps are similar to each other in terms of relative popularity.
+    metric is one of utils.similarity.METRICS. """
+    maps = list(maps_with_data)
+    cube = popularity_cube(civs, maps, rating_keys)
+    scores = utils.similarity.best_match_scores(utils.similarity.distances(cube, metric))
     print('{:15}  {:7} {:15}  {:7}  {}'.format('Best Match', 'Score', 'Next Best', 'Score', 'Map'))
-    for map_name, match in best_match.items():
+    for map_idx, map_name in enumerate(maps):
+        order = np.argsort(-scores[map_idx], kind='stable')[:2]
+        match = [(maps[idx], scores[map_idx, idx]) for idx in order]
         print('{1[0][0]:15} ({1[0][1]:6.2f})  {1[1][0]:15} ({1[1][1]:5.2f}) - {0:15}'.format(map_name, match))
 
 def cache_results(data_set_type, module):
     """ Pickles results so can do analysis without rerunning everything."""
-    civs, maps_with_data, rating_keys = loaded_civs(data_set_type, module)
+    civs, maps_with_data, rating_keys, maps = loaded_civs(data_set_type, module)
     with open(CACHED_TEMPLATE.format(module.DATA_DIR, data_set_type), 'wb') as f:
-        pickle.dump([[CachedCiv(civ) for civ in civs.values()], maps_with_data, rating_keys], f)
+        pickle.dump([next(iter(civs.values())).store, maps_with_data, rating_keys, next(iter(maps.values())).store], f)
 
 def cached_results(data_set_type, module):
     """ Returns pickled results. Will generate pickle if not present. """
@@ -464,16 +374,33 @@ def cached_results(data_set_type, module):
     if not os.path.exists(cache_file):
         cache_results(data_set_type, module)
     with open(cache_file, 'rb') as f:
-        cached_civs, maps_with_data, rating_keys = pickle.load(f)
+        cached, maps_with_data, rating_keys = pickle.load(f)[:3]
+    if isinstance(cached, utils.rankings.RankingStore):
+        civs = {name: Civ(name, cached) for name in cached.names}
+    else:
+        store = utils.rankings.RankingStore(rating_keys=rating_keys)
         civs = {}
-        for cc in cached_civs:
-            civs[cc.name] = Civ.from_cache(cc)
+        for cc in cached:
+            civs[cc.name] = Civ.from_cache(cc, store)
     return civs, maps_with_data, rating_keys
 
+def cached_maps(data_set_type, module):
+    """ dict of each of the module's maps to its Map, from the pickled results. Generates the
+    pickle if it is not present or predates map popularity. """
+    cache_file = CACHED_TEMPLATE.format(module.DATA_DIR, data_set_type)
+    if not os.path.exists(cache_file):
+        cache_results(data_set_type, module)
+    with open(cache_file, 'rb') as f:
+        cached = pickle.load(f)
+    if len(cached) < 4:
+        cache_results(data_set_type, module)
+        with open(cache_file, 'rb') as f:
+            cached = pickle.load(f)
+    return {map_name: Map(map_name, cached[3]) for map_name in module.MAPS}
+
 def heatmap_key_table(mapping):
     """ html table of color grades of a given mapping. Assumes keys of map are .3f """
-    data = []
-    xlabels = ('Color',)
+    heat = []
     ylabels = []
     for i in range(0, 241, 30):
         top = -1
@@ -481,65 +408,23 @@ def heatmap_key_table(mapping):
             hue = (1 - mapping[k]) * 240
             if hue > i - 1 and top < 0:
                 top = k
-                data.append(((mapping[top], '',),))
+                heat.append([mapping[top]])
                 ylabels.append('{:.3f}'.format(top))
             if hue > i + 30:
                 break
-    return to_heatmap_table(data, xlabels, ylabels, 'Popularity')
+    f = io.StringIO()
+    utils.heatmap.write_table(f, heat, [['']]*len(heat), ('Color',), ylabels, 'Popularity')
+    return f.getvalue()
 
-def map_popularity_counters_bucketed_by_rating(players, edges):
+def map_popularity_counters_bucketed_by_rating(player_matches, buckets):
     """ Returns an array of counters, each of which represents the cumulative proportional popularity of a map
     for every rated player for matches played when holding a rating between the edges. Note, a player is only checked
     if the player's "best rating" falls within the edges.
-    players: the list of players to evaluate
-    edges: an array of edges in which to delineate ratings. First edge should be greater than zero, so first "bucket"
-    will be from 1 to edges[0], second edge from edges[0] to edges[1], finishing at edges[-2] to edges[-1]."""
-    start = 0
-    counters = []
-    for edge in edges:
-        map_ctr = Counter()
-        counters.append(map_ctr)
-        snapshot_players = [p for p in players if start < p.best_rating() <= edge]
-        for player in snapshot_players:
-            player.add_map_percentages(map_ctr, start, edge)
-        start = edge - 50
+    player_matches: utils.popularity.PlayerMatches of the players to evaluate
+    buckets: utils.buckets.Buckets of the rating ranges to delineate."""
+    counters, _ = utils.popularity.map_popularity(player_matches, buckets)
     return counters
 
-def all_civs_map_x_rating_heatmap_table(module, data_set_type, viz_rating_keys=None):
-    """ Returns a single heatmap html table of maps x ratings """
-    maps = {}
-    for k in module.MAPS:
-        maps[k] = Map(k)
-    edges = [i for i in range(650, 1701, 50)]
-    start = 0
-    rating_keys = []
-    for edge in edges:
-        rating_keys.append('{}-{}'.format(start + 1, edge))
-        start = edge - 50
-    rating_keys.append('{}+'.format(edges[-1] - 49))
-    if not viz_rating_keys:
-        viz_rating_keys = rating_keys
-    edges.append(10000)
-    players = [p for p in module.Player.player_values(module.MatchReport.all(data_set_type), data_set_type) if p.best_rating()]
-    for ctr_idx, ctr in enumerate(map_popularity_counters_bucketed_by_rating(players, edges)):
-        total = sum(ctr.values())
-        for idx, map_name in enumerate(sorted(ctr, key=lambda x: ctr[x], reverse=True)):
-            if not map_name in maps:
-                continue
-            maps[map_name].rankings[rating_keys[ctr_idx]] = idx + 1
-            maps[map_name].popularity[rating_keys[ctr_idx]] = ctr[map_name]/total
-    modifier = max([v for m in maps.values() for v in m.popularity.values()])
-    html = ['<h3>Overall Popularity of Maps per Rating</h3>',]
-    xlabels = viz_rating_keys
-    ylabels = []
-    data = []
-    for map_name in sorted(maps, key=lambda x: MAP_ORDER.index(x)):
-        ylabels.append(map_name)
-        map_data = maps[map_name]
-        data.append([(map_data.popularity[rk]/modifier, map_data.rankings[rk],) for rk in viz_rating_keys])
-    html.append(to_heatmap_table(data, xlabels, ylabels, 'Map Name', lambda x: x))
-    return '\n'.join(html)
-
 def rebuild_cache(module):
     """ For use after resampling data (elo.sample). """
     for data_set_type in ('test', 'model', 'verification',):
@@ -570,68 +455,87 @@ def runner(fun):
         civs, maps_with_data, rating_keys = cached_results(data_set_type, module)
         fun(module, data_set_type, civs, maps_with_data, rating_keys)
 
-def write_all(module, data_set_type, civs, maps_with_data, rating_keys):
-    """ Write out all the tables to all the files. """
+# Fingerprints of the inputs of the last export of each page (see utils.pipeline)
+EXPORT_STATE = '{}/export_state.json'.format(utils.solo_models.GRAPH_DIR)
+
+PAGES = ('civ_popularity', 'rating_popularity', 'map_popularity',)
+
+# Modules whose code writes the pages, so editing them exports the pages again
+EXPORT_SOURCES = ('utils.buckets', 'utils.heatmap', 'utils.popularity', 'utils.rankings', 'utils.similarity',)
+
+def export_page(shared, page, module_name, data_set_type):
+    """ Pipeline job writing one heatmap page from the data shared by all the pages. """
+    module = importlib.import_module(module_name)
+    civs, maps_with_data, half_keys, data = shared[module_name]
+    if page == 'civ_popularity':
+        write_maps_x_ratings_heatmaps_to_html(civs, maps_with_data, half_keys, data_set_type, module, data)
+    elif page == 'rating_popularity':
+        write_civs_x_maps_heatmaps_to_html(civs, maps_with_data, half_keys, module, data)
+    elif page == 'map_popularity':
+        write_civs_x_ratings_heatmaps_to_html(civs, maps_with_data, half_keys, module, data)
+
+def export_pipeline(modules, data_set_type, workers=None):
+    """ A job per heatmap page per module, each depending on the popularity cache and the match data. """
+    pipeline = utils.pipeline.Pipeline(EXPORT_STATE, workers)
+    for module in modules:
+        inputs = [CACHED_TEMPLATE.format(module.DATA_DIR, data_set_type),
+                  module.MatchReport.data_file(data_set_type),
+                  module.Player.rating_cache_file(data_set_type)]
+        for page in PAGES:
+            pipeline.add(utils.pipeline.Job('{}-{}-{}'.format(module.__name__, data_set_type, page), export_page,
+                                            (page, module.__name__, data_set_type,), inputs,
+                                            ['{}/{}_data.html'.format(module.GRAPH_DIR, page)], sources=EXPORT_SOURCES))
+    return pipeline
+
+def shared_heatmap_data(module, civs, maps_with_data, rating_keys, module_maps):
     half_keys = [k for i, k in enumerate(rating_keys) if not i % 2]
-    write_maps_x_ratings_heatmaps_to_html(civs, maps_with_data, half_keys, data_set_type, module)
-    write_civs_x_maps_heatmaps_to_html(civs, maps_with_data, half_keys, module)
-    write_civs_x_ratings_heatmaps_to_html(civs, maps_with_data, half_keys, module)
+    return (civs, maps_with_data, half_keys, HeatmapData(civs, maps_with_data, half_keys, module_maps))
+
+def write_all(module, data_set_type, civs, maps_with_data, rating_keys, force=False):
+    """ Write out all the tables to all the files whose data has changed. """
+    def shared():
+        return {module.__name__: shared_heatmap_data(module, civs, maps_with_data, rating_keys, cached_maps(data_set_type, module))}
+    export_pipeline((module,), data_set_type).run(shared, force)
+
+def export_all(modules, data_set_type, force=False):
+    """ Writes every heatmap page of every module whose data has changed, all pages in parallel. """
+    for module in modules:
+        if not os.path.exists(CACHED_TEMPLATE.format(module.DATA_DIR, data_set_type)):
+            cache_results(data_set_type, module)
+    def shared():
+        data = {}
+        for module in modules:
+            data[module.__name__] = shared_heatmap_data(module, *cached_results(data_set_type, module),
+                                                        cached_maps(data_set_type, module))
+        return data
+    for name in export_pipeline(modules, data_set_type).run(shared, force):
+        print('wrote', name)
 
 def cdfs(module, data_set_type, civs, maps, rating_keys):
     print(module.as_str())
     half_keys = [k for i, k in enumerate(rating_keys) if not i % 2]
-    kt = '{}-{}'
-    ratings_a = {}
-    ratings_b = {}
-    rating_a_civmap_totals = defaultdict(default_popularity)
-    rating_b_civmap_totals = defaultdict(default_popularity)
-    civmap_keys = set()
-    for rk in half_keys:
-        ratings_a[rk] = Rating(rk)
-        ratings_b[rk] = Rating(rk)
-    for civ_name, civ in civs.items():
-        for rk in half_keys:
-            rating = ratings_a[rk]
-            rating.rankings[civ_name] = civ.rankings[rk]
-            rating.popularity[civ_name] = civ.popularity[rk]
-            rating.totals[civ_name] = civ.popularity[rk]*civ.totals[rk]
-            for map_name in maps:
-                key = kt.format(map_name, rk)
-                cm_key = kt.format(civ_name, map_name)
-                playcounts = civ.popularity[key]*civ.totals[key]
-                rating.totals[cm_key] = playcounts
-                rating_a_civmap_totals[rk] += playcounts
-
-                ratings_b[rk].popularity[cm_key] = civ.popularity[key]
-                rating_b_civmap_totals[rk] += civ.popularity[key]
-                civmap_keys.add(cm_key)
+    store = next(iter(civs.values())).store
+    names = list(civs)
+    # civ x rating key
+    overall_popularity = store.values('popularity', ('all',), half_keys, names)[:, 0, :]
+    # civ x map x rating key
+    popularity = store.values('popularity', maps, half_keys, names)
+    playcounts = popularity*store.values('totals', maps, half_keys, names)
+    civmap_count = len(names)*len(maps)
 
     print('Overall Civs ({})'.format(len(civs)))
-    for rk, rating in ratings_a.items():
-        data = []
-        rt = 0
-        for popularity_key in sorted(civs, key=lambda x: rating.popularity[x], reverse=True):
-            rt += rating.popularity[popularity_key]
-            data.append(rt)
-        print_cdf(rk, data, len(civs))
-        
-    print('Weighted Maps ({})'.format(len(civmap_keys)))
-    for rk, rating in ratings_a.items():
-        data = []
-        rt = 0
-        for popularity_key in sorted(civmap_keys, key=lambda x: rating.totals[x], reverse=True):
-            rt += rating.totals[popularity_key]/rating_a_civmap_totals[rk]
-            data.append(rt)
-        print_cdf(rk, data, len(civmap_keys))
-
-    print('Equal Maps ({})'.format(len(civmap_keys)))
-    for rk, rating in ratings_b.items():
-        data = []
-        rt = 0
-        for popularity_key in sorted(civmap_keys, key=lambda x: rating.popularity[x], reverse=True):
-            rt += rating.popularity[popularity_key]/rating_b_civmap_totals[rk]
-            data.append(rt)
-        print_cdf(rk, data, len(civmap_keys))
+    for rk_idx, rk in enumerate(half_keys):
+        print_cdf(rk, np.cumsum(np.sort(overall_popularity[:, rk_idx])[::-1]), len(civs))
+
+    print('Weighted Maps ({})'.format(civmap_count))
+    for rk_idx, rk in enumerate(half_keys):
+        counts = playcounts[:, :, rk_idx].ravel()
+        print_cdf(rk, np.cumsum(np.sort(counts)[::-1])/counts.sum(), civmap_count)
+
+    print('Equal Maps ({})'.format(civmap_count))
+    for rk_idx, rk in enumerate(half_keys):
+        values = popularity[:, :, rk_idx].ravel()
+        print_cdf(rk, np.cumsum(np.sort(values)[::-1])/values.sum(), civmap_count)
 
 def print_cdf(rk, data, t):
     for idx, d in enumerate(data):
@@ -8,23 +8,26 @@ import os
 import pathlib
 import random
 import re
-from statistics import stdev
 import sys
 import time
 
-import matplotlib.pyplot as plt
-import requests
 import numpy as np
-from scipy import stats
-from statsmodels.stats.proportion import proportion_confint
 
 ROOT_DIR = str(pathlib.Path(__file__).parent.parent.absolute())
 
 from utils.filters import unique_player_reports
 from utils.models import Match, Rating, User, MatchReport
-from utils.models import Player as ModelPlayer
+from utils.player_stats import PlayerStats, histogram
 import utils.download
+import utils.lazy
 import utils.lookup
+import utils.match_index
+import utils.solo_models
+
+plt = utils.lazy.module('matplotlib.pyplot')
+requests = utils.lazy.module('requests')
+stats = utils.lazy.module('scipy.stats')
+proportion_confint = utils.lazy.function('statsmodels.stats.proportion', 'proportion_confint')
 
 class SampleUser(User):
     @property
@@ -109,24 +112,9 @@ def get_some_users(cnt):
     users = get_random_users(cnt)
     download_data(users)
 
-def contradictions():
+def contradictions(module=utils.solo_models):
     """ Go through all the matches and see if there are contradictions in who won """
-    match_info = defaultdict(lambda: [])
-    matches = Match.all(True)
-    for match in matches:
-        if match.winner:
-            match_info[match.match_id].append(match.winner)
-    ctr = Counter()
-    for match_id, winners in match_info.items():
-        if len(winners) < 1:
-            ctr['no info'] += 1
-        elif len(winners) == 1:
-            ctr['solo'] += 1
-        elif len(set(winners)) == 1:
-            ctr['confirmed'] += 1
-        else:
-            ctr['contradictory'] += 1
-        ctr['-'.join([str(x) for x in sorted(winners)])] += 1
+    ctr = utils.match_index.load(module.DATA_DIR).winner_counts()
     for k, cnt in ctr.most_common():
         print(k, cnt)
 
@@ -378,17 +366,6 @@ def duplicate_matches():
     for k in sorted(dup_counter):
         print('{:>3}: {:>7}'.format(k, dup_counter[k]))
 
-def filtered_matches(player_matches, used_players):
-    """ Returns a dictionary of player_matches without any used players """
-    r = defaultdict(lambda: [])
-    for report_list in player_matches.values():
-        for report in report_list:
-            if report.player_1 in used_players or report.player_2 in used_players:
-                continue
-            r[report.player_1].append(report)
-            r[report.player_2].append(report)
-    return r
-
 def counts_per_player(data_set_type):
     match_reports = MatchReport.all(data_set_type)
     matches = unique_player_reports(match_reports)
@@ -398,126 +375,73 @@ def counts_per_player(data_set_type):
         players.add(r.player_2)
     print(len(matches)*2 == len(players))
 
-class Player:
-    def __init__(self, player_id):
-        self.player_id = player_id
-        self.upper_range = 0
-        self.lower_range = 10000
-        self.ratings = []
-        self.valid = False
-
-    def set_bounds(self, max_std, mincount):
-        """ Sets upper and lower bounds of ratings that generate
-a standard deviation within max_std and that contain at least mincount ratings."""
-        if len(self.ratings) < mincount:
-            return
-        sorted_ratings = sorted(self.ratings)
-        srstd = stdev(self.ratings)
-        while srstd > max_std and len(sorted_ratings) >= mincount:
-            if sorted_ratings[-1] - sorted_ratings[-2] > sorted_ratings[1] - sorted_ratings[0]:
-                del(sorted_ratings[-1])
-            else:
-                del(sorted_ratings[0])
-            srstd = stdev(sorted_ratings)
-        if srstd <= max_std:
-            self.upper_range = max(self.ratings)
-            self.lower_range = min(self.ratings)
-            self.valid = True
-
-def player_rating_stdevs(data_set_type):
-    match_reports = sorted(MatchReport.all(data_set_type), key=lambda x: x.timestamp)
-    players = {}
-    for report in match_reports:
-        if not report.player_1 in players:
-            players[report.player_1] = Player(report.player_1)
-        if not report.player_2 in players:
-            players[report.player_2] = Player(report.player_2)
-        players[report.player_1].ratings.append(report.rating_1)
-        players[report.player_2].ratings.append(report.rating_2)
-    stdevs = Counter()
-
-    for player in players.values():
-        l = player.ratings
-        if len(l) < 10:
-            continue
-        sorted_ratings = sorted(l)
-        best_group = sorted_ratings[:10]
-        best_std = stdev(best_group)
-        for i in range(len(l) - 10):
-            test_group = sorted_ratings[i:i+10]
-            test_std = stdev(test_group)
-            if test_std < best_std:
-                best_group = test_group
-                best_std = test_std
-        stdevs[int(best_std)] += 1
+# (data_set_type, min_rating) to PlayerStats, so reports on the same data set share one pass
+_player_stats = {}
+
+def solo_reports(data_set_type):
+    """ The 1v1 reports of a data set. """
+    return [report for report in utils.solo_models.MatchReport.all(data_set_type) if report.player_1 is not None]
+
+def player_stats(data_set_type, min_rating=100):
+    """ PlayerStats of the 1v1 reports of a data set, calculated once. min_rating None includes every rating. """
+    key = (data_set_type, min_rating,)
+    if key not in _player_stats:
+        _player_stats[key] = PlayerStats(solo_reports(data_set_type), min_rating)
+    return _player_stats[key]
+
+def player_rating_stdevs(data_set_type, last_window=False):
+    """ Histogram of each player's lowest standard deviation of 10 sorted ratings. The highest 10
+    are only tried with last_window (or if they are all of a player's ratings). """
+    stats = player_stats(data_set_type, None)
+    best_stdevs, _ = stats.best_window(10, ties='first', last=last_window)
+    stdevs = histogram(best_stdevs)
     rolling_sum = 0
     for sd in sorted(stdevs):
         rolling_sum += stdevs[sd]
         print('{:>5}: {:>5} : {:>7}'.format(sd, stdevs[sd], rolling_sum))
 
-def players_with_decent_ratings(data_set_type, max_std, mincount):
-    match_reports = sorted(MatchReport.all(data_set_type), key=lambda x: x.timestamp)
-    players = {}
-    player_counter = Counter()
-    for report in match_reports:
-        if not report.player_1 in players:
-            players[report.player_1] = Player(report.player_1)
-        if not report.player_2 in players:
-            players[report.player_2] = Player(report.player_2)
-        players[report.player_1].ratings.append(report.rating_1)
-        players[report.player_2].ratings.append(report.rating_2)
-    print(len(players))
-    for player in players.values():
-        player.set_bounds(max_std, mincount)
+def players_with_decent_ratings(data_set_type, max_std, mincount, trimmed=False):
+    """ Counts the matches within the rating range of both players, for players whose ratings can
+    be brought within max_std (see PlayerStats.bounds). With trimmed, the range is of the ratings
+    left after dropping outliers rather than of all of them. """
+    stats = player_stats(data_set_type, None)
+    print(len(stats))
+    lower, upper, _ = stats.bounds(max_std, mincount, trimmed)
     good_matches = []
-    for report in match_reports:
-        p1 = players[report.player_1]
-        p2 = players[report.player_2]
-        if p1.lower_range < report.rating_1 < p1.upper_range and p2.lower_range < report.rating_2 < p2.upper_range:
+    for report in solo_reports(data_set_type):
+        p1 = stats.player_index[report.player_1]
+        p2 = stats.player_index[report.player_2]
+        if lower[p1] < report.rating_1 < upper[p1] and lower[p2] < report.rating_2 < upper[p2]:
             good_matches.append(report)
     print(len(good_matches))
 
-def stddev_counts(data_set_type):
-    matches = MatchReport.all(data_set_type)
-    stdevs = Counter()
-    players = [p for p in ModelPlayer.player_values(matches) if len(p.ratings) > 4]
-    for player in players:
-        stdevs[int(stdev(player.ratings))] += 1
+def print_cumulative(ctr, total, reverse=False):
     running_total = 0.0
-    for std in sorted(stdevs):
-        running_total += stdevs[std]
-        print('{:>4}:{:>5}: {:>5} ({:.2f})'.format(std, stdevs[std], int(running_total), running_total/len(players)))
+    for key in sorted(ctr, reverse=reverse):
+        running_total += ctr[key]
+        print('{:>4}:{:>5}: {:>5} ({:.2f})'.format(key, ctr[key], int(running_total), running_total/total))
+
+def stddev_counts(data_set_type):
+    stats = player_stats(data_set_type)
+    included = stats.counts > 4
+    print_cumulative(histogram(stats.stdevs()[included]), included.sum())
+
 def best_stddev_counts(data_set_type, mincount):
-    matches = MatchReport.all(data_set_type)
-    stdevs = Counter()
-    players = ModelPlayer.rated_players(matches, mincount)
-    for player in players:
-        stdevs[int(player.best_stdev(mincount))] += 1
-    running_total = 0.0
-    for std in sorted(stdevs):
-        running_total += stdevs[std]
-        print('{:>4}:{:>5}: {:>5} ({:.2f})'.format(std, stdevs[std], int(running_total), running_total/len(players)))
+    stats = player_stats(data_set_type)
+    best_stdevs, _ = stats.best_window(mincount)
+    best_stdevs = best_stdevs[stats.counts >= mincount*1.5]
+    print_cumulative(histogram(best_stdevs), len(best_stdevs))
 
 def ratings_counts(data_set_type):
-    matches = MatchReport.all(data_set_type)
-    ctr = Counter()
-    players = ModelPlayer.player_values(matches)
-    lp = float(len(players))
-    for player in players:
-        ctr[len(player.matches)] += 1
-    rt = 0
-    for c in sorted(ctr, reverse=True):
-        rt += ctr[c]
-        print('{:>4}:{:>5}: {:>5} ({:.2f})'.format(c, ctr[c], int(rt), rt/lp))
+    stats = player_stats(data_set_type)
+    print_cumulative(histogram(stats.match_counts), float(len(stats)), reverse=True)
 
 def minimum_timestamp_match_report(data_set_type):
-    print(min([m.timestamp for m in MatchReport.all(data_set_type)]))
+    print(min([m.timestamp for m in utils.solo_models.MatchReport.all(data_set_type)]))
 
 def minimum_timestamp_rating(data_set_type):
-    timestamps = set()
-    for player in ModelPlayer.player_values(MatchReport.all(data_set_type)):
-        timestamps |= set([r.timestamp for r in Rating.all_for(player.player_id)])
-    print(min(timestamps))
+    players = utils.solo_models.Player.player_values(utils.solo_models.MatchReport.all(data_set_type))
+    print(utils.solo_models.Rating.table([player.player_id for player in players]).timestamp.min())
 
 if __name__ == '__main__':
     file_prefix = 'matches'
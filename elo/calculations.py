@@ -10,29 +10,26 @@ import pathlib
 import random
 import sys
 
-import matplotlib.pyplot as plt
-import requests
-from scipy import stats
-from statsmodels.stats.proportion import proportion_confint
+import numpy as np
 
 ROOT_DIR = str(pathlib.Path(__file__).parent.parent.absolute())
 
 from utils.models import Match, Rating, User, MatchReport
 import utils.download
+import utils.lazy
 import utils.lookup
+import utils.solo_models
+
+stats = utils.lazy.module('scipy.stats')
+proportion_confint = utils.lazy.function('statsmodels.stats.proportion', 'proportion_confint')
 
 def likelihood_of_win_if_higher_rank(data_set_type):
-    matches = MatchReport.all(data_set_type)
-    all_match_count = len(matches)
-    wins = 0
-    total = 0
-    for report in matches:
-        # win defined as victory for higher-rated player
-        if report.score > 0:
-            wins += 1
-        # Do not add if no difference in rating
-        if report.score:
-            total += 1
+    scores = utils.solo_models.MatchReport.columns(data_set_type)['score']
+    all_match_count = len(scores)
+    # win defined as victory for higher-rated player
+    wins = int(np.count_nonzero(scores > 0))
+    # Do not add if no difference in rating
+    total = int(np.count_nonzero(scores))
     cl, _ = proportion_confint(wins, total)
     pct_win = wins/float(total)
     print(data_set_type)
@@ -6,15 +6,16 @@ from math import log
 import pathlib
 from statistics import stdev
 
-import matplotlib.pyplot as plt
-from scipy import stats
-from statsmodels.stats.proportion import proportion_confint
-
 ROOT_DIR = str(pathlib.Path(__file__).parent.parent.absolute())
 GRAPH_DIR = '{}/graphs'.format(ROOT_DIR)
 
 from utils.filters import unique_player_combo_reports
 from utils.models import MatchReport, Player
+import utils.lazy
+
+plt = utils.lazy.module('matplotlib.pyplot')
+stats = utils.lazy.module('scipy.stats')
+proportion_confint = utils.lazy.function('statsmodels.stats.proportion', 'proportion_confint')
 
 def nearest_x(num, x):
     """ Returns the number rounded down to the nearest 'x'.
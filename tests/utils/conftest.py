@@ -0,0 +1,19 @@
+import pathlib
+import shutil
+
+import pytest
+
+import utils.solo_models
+import utils.team_models
+
+TESTS_DIR = pathlib.Path(__file__).parent.parent
+
+@pytest.fixture
+def data_dirs(tmp_path, monkeypatch):
+    """ Copies of the solo and team test data directories, so the files tests build (manifests,
+    samples, packed and cached data) stay out of the tree. """
+    for module, name in ((utils.solo_models, 'data'), (utils.team_models, 'team-data'),):
+        data_dir = tmp_path / name
+        shutil.copytree(str(TESTS_DIR / name), str(data_dir))
+        monkeypatch.setattr(module, 'DATA_DIR', str(data_dir))
+    return tmp_path
@@ -0,0 +1,34 @@
+import pathlib
+import shutil
+
+import pytest
+
+import civs.analyze
+import utils.solo_models
+
+TEST_DATA = pathlib.Path(__file__).parent.parent / 'data' / 'match_for_test_data.csv'
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """ The test and model data sets, with Byzantines (5) beating Tatars (30) on Arabia 40
+    times, in a directory of their own. """
+    for data_set_type in ('test', 'model',):
+        data_file = str(tmp_path / 'match_{}_data.csv'.format(data_set_type))
+        shutil.copy(str(TEST_DATA), data_file)
+        with open(data_file, 'a') as f:
+            for i in range(40):
+                f.write('{},9,5:30,1210:1190,{}:{},1:2,1,0\n'.format(1590000000 + i, 100 + i, 200 + i))
+    monkeypatch.setattr(utils.solo_models, 'DATA_DIR', str(tmp_path))
+    return tmp_path
+
+def test_dominance_batch(data_dir):
+    results = civs.analyze.dominance_batch('test')
+    ranked, chains = results[('Arabia', '1151-1250')]
+    assert ranked == [('Byzantines', 1), ('Tatars', -1)]
+    assert chains == []
+    assert results[('all', '1151-1250')][0] == ranked
+
+def test_pct_win_by_code(data_dir, monkeypatch, capsys):
+    monkeypatch.setattr(civs.analyze, 'proportion_confint', lambda wins, total: (wins/total - .1, wins/total + .1))
+    civs.analyze.pct_win_by_code()
+    assert 'Byzantines beat Tatars       on Arabia          between 90.00% and 110.00%' in capsys.readouterr().out
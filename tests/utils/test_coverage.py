@@ -0,0 +1,22 @@
+import numpy as np
+
+import utils.coverage
+import utils.opponents
+
+def graph():
+    # 1 and 2 have files; 3 played 1 four times and 2 twice, 4 played 1 once
+    return utils.opponents.OpponentGraph.from_lists({'1': {'3': 4, '4': 1}, '2': {'3': 2}})
+
+def test_known_matches():
+    g = graph()
+    assert g.known_matches([3, 4, 5]).tolist() == [6, 1, 0]
+    assert g.known_matches([3, 4, 5], 'max').tolist() == [4, 1, 0]
+
+def test_predicted_new_matches():
+    predicted = utils.coverage.predicted_new_matches(graph(), [3, 4, 5, 6], {3: 6, 4: 10, 5: 2})
+    assert predicted.tolist() == [0, 9, 2, utils.coverage.UNKNOWN]
+
+def test_plan():
+    ordered, skipped = utils.coverage.plan(graph(), [3, 4, 5, 6], {3: 7, 4: 10, 5: 2}, min_new_matches=2)
+    assert ordered.tolist() == [4, 5, 6]
+    assert skipped.tolist() == [3]
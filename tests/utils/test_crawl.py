@@ -0,0 +1,120 @@
+import http.server
+import json
+import os
+import threading
+import urllib.parse
+
+import pytest
+
+import utils.crawl
+import utils.download
+import utils.solo_models
+import utils.writer
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    """ An empty data directory of its own, for the files and indexes the coordinator writes. """
+    path = tmp_path / 'data'
+    path.mkdir()
+    monkeypatch.setattr(utils.solo_models, 'DATA_DIR', str(path))
+    return path
+
+RATINGS = [{"rating":1172,"num_wins":52,"num_losses":48,"streak":1,"drops":1,"timestamp":1582655493},
+           {"rating":1155,"num_wins":52,"num_losses":49,"streak":-1,"drops":1,"timestamp":1582815961}]
+
+class StubApi(http.server.BaseHTTPRequestHandler):
+    """ Serves the same ratings to every profile and no matches, failing once for profile 5550022. """
+    failed = set()
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        profile_id = urllib.parse.parse_qs(url.query)['profile_id'][0]
+        if profile_id == '5550022' and not profile_id in StubApi.failed:
+            StubApi.failed.add(profile_id)
+            self.send_response(500)
+            self.end_headers()
+            return
+        body = json.dumps(RATINGS if 'ratinghistory' in url.path else []).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def stub_api(monkeypatch):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubApi)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    monkeypatch.setattr(utils.download, 'MATCHES_URL', utils.download.MATCHES_URL.replace('https://aoe2.net', base))
+    monkeypatch.setattr(utils.download, 'RATINGS_URL', utils.download.RATINGS_URL.replace('https://aoe2.net', base))
+    yield server
+    server.shutdown()
+
+def test_workers_download_for_coordinator(tmp_path, stub_api):
+    db_file = str(tmp_path / 'crawl.db')
+    profile_ids = ['5550021', '5550022', '5550023', '5550024', '5550025']
+    workers = [utils.crawl.Worker(db_file, utils.solo_models, 'worker-{}'.format(i), heartbeat=0.1) for i in range(3)]
+    for worker in workers:
+        worker.beat()
+    threads = [threading.Thread(target=worker.run, kwargs={'poll': 0.05}) for worker in workers]
+    coordinator = utils.crawl.Coordinator(db_file, utils.solo_models)
+    try:
+        coordinator.submit(profile_ids)
+        for thread in threads:
+            thread.start()
+        with utils.writer.BatchWriter() as writer:
+            coordinator.run(writer, poll=0.05)
+    finally:
+        coordinator.stop()
+    for thread in threads:
+        thread.join(5)
+    assert not any(thread.is_alive() for thread in threads)
+    assert coordinator.counts() == {utils.crawl.COLLECTED: 5}
+    for profile_id in profile_ids:
+        assert [r.won_state for r in utils.solo_models.Rating.all_for(profile_id)] == ['lost']
+        assert os.path.exists(utils.solo_models.Match.data_file(profile_id))
+    assert coordinator.live_workers() == []
+
+def test_dead_worker_tasks_are_reassigned(tmp_path):
+    db_file = str(tmp_path / 'crawl.db')
+    coordinator = utils.crawl.Coordinator(db_file, utils.solo_models, timeout=10)
+    dead = utils.crawl.Worker(db_file, utils.solo_models, 'a')
+    alive = utils.crawl.Worker(db_file, utils.solo_models, 'b')
+    dead.beat()
+    alive.beat()
+    coordinator.submit(['5550030', '5550031', '5550032'])
+    assert coordinator.assign() == 3
+    # Even profile ids are in the shard of the first worker
+    assert dead.claim() == ('5550030', ['matches', 'ratings'], False)
+    assert coordinator.reap() == []
+    # a stops beating
+    coordinator.connection.execute("UPDATE workers SET heartbeat = heartbeat - 60 WHERE name = 'a'")
+    assert coordinator.reap() == ['a']
+    assert coordinator.live_workers() == ['b']
+    assert coordinator.assign() == 2
+    claimed = [alive.claim()[0] for _ in range(3)]
+    assert sorted(claimed) == ['5550030', '5550031', '5550032']
+    # The reaped worker can no longer complete its task
+    assert not dead.complete('5550030', {'matches': ['[]'], 'ratings': ['[]']})
+    assert alive.complete('5550030', {'matches': ['[]'], 'ratings': ['[]']})
+
+def test_run_gives_up_without_workers(tmp_path, capsys):
+    coordinator = utils.crawl.Coordinator(str(tmp_path / 'crawl.db'), utils.solo_models)
+    coordinator.submit(['5550040'])
+    with pytest.raises(RuntimeError):
+        with utils.writer.BatchWriter() as writer:
+            coordinator.run(writer, poll=0.01, no_workers_timeout=0.05)
+    assert 'Waiting for workers to download 1 profiles' in capsys.readouterr().out
+    coordinator.close()
+
+def test_download_all_uses_the_coordinator_given(tmp_path, monkeypatch):
+    coordinator = utils.crawl.Coordinator(str(tmp_path / 'crawl.db'), utils.solo_models)
+    monkeypatch.setattr(coordinator, 'run', lambda writer: None)
+    with utils.writer.BatchWriter() as writer:
+        utils.download.download_all(['5550050'], utils.solo_models, writer, coordinator=coordinator)
+        utils.download.download_all(['5550051'], utils.solo_models, writer, coordinator=coordinator)
+    assert coordinator.counts() == {utils.crawl.PENDING: 2}
+    coordinator.close()
@@ -0,0 +1,68 @@
+import itertools
+
+import numpy as np
+import pytest
+
+import utils.dominance
+
+def graph(n, edges):
+    adj = np.zeros((n, n), dtype=bool)
+    for i, j in edges:
+        adj[i, j] = True
+    return adj
+
+def test_normal_interval():
+    cl, cu = utils.dominance.normal_interval([50, 0], [100, 0])
+    assert cl[0] == pytest.approx(0.402, abs=0.001)
+    assert cu[0] == pytest.approx(0.598, abs=0.001)
+    assert np.isnan(cl[1])
+
+def test_matchups_and_adjacency():
+    # civ 0 beats civ 1 90 times out of 100 whichever side it plays
+    civs_1 = [0]*50 + [1]*50
+    civs_2 = [1]*50 + [0]*50
+    winners = [1]*45 + [2]*5 + [2]*45 + [1]*5
+    wins, totals = utils.dominance.matchups(civs_1, civs_2, winners, [1]*100, 3)
+    assert totals[0, 1] == totals[1, 0] == 100
+    assert wins[0, 1] == 90
+    assert wins[1, 0] == 10
+    adj = utils.dominance.adjacency(wins, totals)
+    assert adj.tolist() == [[False, True, False], [False, False, False], [False, False, False]]
+
+def test_strongly_connected_components():
+    adj = graph(6, [(0, 1), (1, 2), (2, 0), (2, 3), (3, 4), (4, 3), (5, 5)])
+    components = sorted(utils.dominance.strongly_connected_components(adj))
+    assert components == [[0, 1, 2], [3, 4], [5]]
+
+def test_strongly_connected_components_deep():
+    n = 5000
+    adj = graph(n, [(i, i + 1) for i in range(n - 1)] + [(n - 1, 0)])
+    assert utils.dominance.strongly_connected_components(adj) == [list(range(n))]
+
+def brute_force_cycles(adj, max_length):
+    n = len(adj)
+    found = set()
+    for length in range(2, max_length + 1):
+        for nodes in itertools.permutations(range(n), length):
+            if nodes[0] != min(nodes):
+                continue
+            if all(adj[nodes[i], nodes[(i + 1) % length]] for i in range(length)):
+                found.add(nodes)
+    return found
+
+@pytest.mark.parametrize('max_length', [2, 3, 5])
+def test_cycles(max_length):
+    rng = np.random.default_rng(7)
+    adj = rng.random((7, 7)) < .35
+    np.fill_diagonal(adj, False)
+    cycles = utils.dominance.cycles(adj, max_length)
+    assert len(cycles) == len(set(tuple(c) for c in cycles))
+    assert set(tuple(c) for c in cycles) == brute_force_cycles(adj, max_length)
+
+def test_cycles_limit():
+    adj = ~np.eye(6, dtype=bool)
+    assert len(utils.dominance.cycles(adj, limit=10)) == 10
+
+def test_ranking():
+    adj = graph(4, [(0, 1), (0, 2), (1, 2), (3, 0)])
+    assert utils.dominance.ranking(adj) == [(0, 1), (3, 1), (1, 0), (2, -2)]
@@ -1,5 +1,6 @@
 import os
 import pathlib
+import shutil
 
 ROOT_DIR = pathlib.Path(__file__).parent.parent.absolute()
 
@@ -7,15 +8,11 @@ import pytest
 import requests
 
 import utils.download
+import utils.raw_cache
 import utils.solo_models
 import utils.team_models
 
-@pytest.fixture(scope="session", autouse=True)
-def set_model_data_file_templates():
-    if not '/tests' in utils.solo_models.DATA_DIR:
-        utils.solo_models.DATA_DIR = utils.solo_models.DATA_DIR.replace('/data', '/tests/data')
-    if not '/tests' in utils.team_models.DATA_DIR:
-        utils.team_models.DATA_DIR = utils.team_models.DATA_DIR.replace('/team-data', '/tests/team-data')
+pytestmark = pytest.mark.usefixtures('data_dirs')
 
 def test_fetch_solo_users(requests_mock):
     data = {"total":2,"leaderboard_id":3,"leaderboard":[{"profile_id":199324,"rating":2264,"name":"[aM] Hera","games":1207,},
@@ -65,3 +62,29 @@ def test_profiles_from_files():
     # solo
     assert len(utils.download.profiles_from_files('ratings', utils.solo_models)) == 6
     assert len(utils.download.profiles_from_files('ratings', utils.team_models)) == 5
+
+def test_replay_ratings_from_raw_cache(requests_mock):
+    profile_id = '5550001'
+    data = [{"rating":1172,"num_wins":52,"num_losses":48,"streak":1,"drops":1,"timestamp":1582655493},
+            {"rating":1155,"num_wins":52,"num_losses":49,"streak":-1,"drops":1,"timestamp":1582815961}]
+    url = 'https://aoe2.net/api/player/ratinghistory?start=1&count=10000&game=aoe2de&leaderboard_id=3&profile_id={}'.format(profile_id)
+    requests_mock.get(url, json=data)
+    data_file = utils.solo_models.Rating.data_file(profile_id)
+    raw_dir = utils.raw_cache.raw_dir(utils.solo_models)
+    utils.download.SAVE_RAW = True
+    try:
+        utils.download.ratings(profile_id, utils.solo_models)
+        with open(data_file) as f:
+            downloaded = f.read()
+        assert len(utils.raw_cache.digests(utils.solo_models, 'ratings', profile_id)) == 1
+        assert profile_id in utils.raw_cache.profiles(utils.solo_models, 'ratings')
+        os.remove(data_file)
+        utils.download.replay(utils.solo_models)
+        with open(data_file) as f:
+            assert f.read() == downloaded
+        assert [r.won_state for r in utils.solo_models.Rating.all_for(profile_id)] == ['lost']
+    finally:
+        utils.download.SAVE_RAW = False
+        if os.path.exists(data_file):
+            os.remove(data_file)
+        shutil.rmtree(raw_dir, ignore_errors=True)
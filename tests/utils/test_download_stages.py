@@ -0,0 +1,79 @@
+import os
+
+import pytest
+
+import utils.download
+import utils.download_stages
+import utils.match_index
+import utils.solo_models
+import utils.writer
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    """ An empty data directory of its own, for the files and indexes the stages write. """
+    monkeypatch.setattr(utils.solo_models, 'DATA_DIR', str(tmp_path))
+    return tmp_path
+
+RATINGS = [{"rating":1172,"num_wins":52,"num_losses":48,"streak":1,"drops":1,"timestamp":1582655493},
+           {"rating":1155,"num_wins":52,"num_losses":49,"streak":-1,"drops":1,"timestamp":1582815961},
+           {"rating":1170,"num_wins":53,"num_losses":49,"streak":1,"drops":1,"timestamp":1582816961}]
+
+def mock_profile(requests_mock, profile_id, ratings, page_size=10000):
+    for start in range(0, max(len(ratings), 1), page_size):
+        url = utils.download.RATINGS_URL.format(start=start + 1, count=page_size, lb=3, profile_id=profile_id)
+        requests_mock.get(url, json=ratings[start:start + page_size])
+    url = utils.download.MATCHES_URL.format(start=1, count=page_size, profile_id=profile_id)
+    requests_mock.get(url, json=[])
+
+def test_stages_write_every_file(requests_mock, data_dir):
+    profile_ids = ['5550011', '5550012', '5550013']
+    for profile_id in profile_ids:
+        mock_profile(requests_mock, profile_id, RATINGS)
+    with utils.writer.BatchWriter() as writer:
+        with utils.download_stages.Stages(utils.solo_models, writer, fetch_workers=2, parse_workers=2, max_pending=2) as stages:
+            for profile_id in profile_ids:
+                stages.submit(profile_id)
+    for profile_id in profile_ids:
+        assert [r.won_state for r in utils.solo_models.Rating.all_for(profile_id)] == ['lost', 'won']
+        assert os.path.exists(utils.solo_models.Match.data_file(profile_id))
+    # Indexed once written, so every file is current
+    index = utils.match_index.load(str(data_dir))
+    assert sorted(index.current(str(data_dir)).profiles) == profile_ids
+    metrics = stages.metrics()
+    assert metrics['files'] == 6
+    assert metrics['pages'] == 6
+    assert metrics['pending'] == 0
+    assert metrics['fetch_queue'] == metrics['parse_queue'] == metrics['write_queue'] == 0
+    assert os.path.exists(stages.metrics_file())
+
+def test_stages_fetch_more_pages(requests_mock, monkeypatch):
+    monkeypatch.setattr(utils.download, 'MAX_DOWNLOAD', 2)
+    profile_id = '5550014'
+    mock_profile(requests_mock, profile_id, RATINGS, page_size=2)
+    with utils.writer.BatchWriter() as writer:
+        with utils.download_stages.Stages(utils.solo_models, writer, fetch_workers=1, parse_workers=1) as stages:
+            stages.submit(profile_id)
+    # The first rating has no old rating, so is not read back
+    assert [r.timestamp for r in utils.solo_models.Rating.all_for(profile_id)] == [1582815961, 1582816961]
+    assert stages.metrics()['more_pages'] == 1
+
+def test_stages_fail_on_api_error(requests_mock):
+    profile_id = '5550015'
+    requests_mock.get(utils.download.MATCHES_URL.format(start=1, count=10000, profile_id=profile_id), status_code=500, text='down')
+    mock_url = utils.download.RATINGS_URL.format(start=1, count=10000, lb=3, profile_id=profile_id)
+    requests_mock.get(mock_url, json=RATINGS)
+    with pytest.raises(RuntimeError):
+        with utils.writer.BatchWriter() as writer:
+            with utils.download_stages.Stages(utils.solo_models, writer, fetch_workers=1, parse_workers=1) as stages:
+                stages.submit(profile_id)
+    assert not os.path.exists(utils.solo_models.Match.data_file(profile_id))
+
+def test_stages_fetch_only_kinds_given(requests_mock):
+    profile_id = '5550016'
+    mock_profile(requests_mock, profile_id, RATINGS)
+    with utils.writer.BatchWriter() as writer:
+        with utils.download_stages.Stages(utils.solo_models, writer, fetch_workers=1, parse_workers=1) as stages:
+            stages.submit(profile_id, kinds=('ratings',))
+    assert [r.won_state for r in utils.solo_models.Rating.all_for(profile_id)] == ['lost', 'won']
+    assert not os.path.exists(utils.solo_models.Match.data_file(profile_id))
+    assert stages.metrics()['files'] == 1
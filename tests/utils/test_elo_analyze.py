@@ -0,0 +1,41 @@
+import pathlib
+import shutil
+
+import pytest
+
+import elo.analyze
+import utils.solo_models
+
+TEST_DATA = pathlib.Path(__file__).parent.parent / 'data' / 'match_for_test_data.csv'
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    """ The test data set, with 12 matches between players 101 and 102, in a directory of its own. """
+    shutil.copy(str(TEST_DATA), str(tmp_path / 'match_test_data.csv'))
+    with open(str(tmp_path / 'match_test_data.csv'), 'a') as f:
+        for i in range(12):
+            f.write('{},9,5:30,{}:{},101:102,1:2,1,0\n'.format(1590000000 + i, 1200 + i, 1100 - 10*i))
+    monkeypatch.setattr(utils.solo_models, 'DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(elo.analyze, '_player_stats', {})
+    return tmp_path
+
+def test_player_reports(capsys):
+    elo.analyze.ratings_counts('test')
+    assert capsys.readouterr().out.splitlines() == ['  12:    2:     2 (0.50)', '   1:    2:     4 (1.00)']
+    elo.analyze.stddev_counts('test')
+    assert capsys.readouterr().out.splitlines() == ['   3:    1:     1 (0.50)', '  36:    1:     2 (1.00)']
+    elo.analyze.best_stddev_counts('test', 5)
+    assert capsys.readouterr().out.splitlines() == ['   1:    1:     1 (0.50)', '  15:    1:     2 (1.00)']
+    elo.analyze.player_rating_stdevs('test')
+    assert capsys.readouterr().out.splitlines() == ['    3:     1 :       1', '   30:     1 :       2']
+    elo.analyze.players_with_decent_ratings('test', 20, 5)
+    assert capsys.readouterr().out.splitlines() == ['4', '10']
+    elo.analyze.players_with_decent_ratings('test', 20, 5, trimmed=True)
+    assert capsys.readouterr().out.splitlines() == ['4', '4']
+
+def test_minimum_timestamps(data_dir, capsys):
+    for profile_id in ('1301032', '242765'):
+        shutil.copy(str(TEST_DATA.parent / 'ratings_for_{}.csv'.format(profile_id)), str(data_dir))
+    elo.analyze.minimum_timestamp_rating('test')
+    elo.analyze.minimum_timestamp_match_report('test')
+    assert capsys.readouterr().out.splitlines() == ['1582231984', '1579987626']
@@ -0,0 +1,16 @@
+import pathlib
+import shutil
+
+import elo.calculations
+import utils.solo_models
+
+def test_likelihood_of_win_if_higher_rank(tmp_path, monkeypatch, capsys):
+    shutil.copy(str(pathlib.Path(__file__).parent.parent / 'data' / 'match_for_test_data.csv'), str(tmp_path))
+    monkeypatch.setattr(utils.solo_models, 'DATA_DIR', str(tmp_path))
+    # statsmodels is imported only for the confidence interval
+    monkeypatch.setattr(elo.calculations, 'proportion_confint', lambda wins, total: (wins/total - .1, wins/total + .1))
+    scores = utils.solo_models.MatchReport.columns('for_test')['score']
+    elo.calculations.likelihood_of_win_if_higher_rank('for_test')
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == 'for_test'
+    assert lines[1].split()[:5] == [str((scores != 0).sum()), 'records', 'out', 'of', str(len(scores))]
@@ -0,0 +1,31 @@
+import numpy as np
+
+import utils.filters
+
+class Report:
+    def __init__(self, timestamp, *players):
+        self.timestamp = timestamp
+        self.players = {player: {} for player in players}
+
+def test_unique_player_indexes():
+    players = np.array([['a', 'b'], ['b', 'c'], ['c', 'd'], ['a', 'e'], ['e', 'f']])
+    assert utils.filters.unique_player_indexes(players).tolist() == [0, 2, 4]
+    assert utils.filters.unique_player_indexes(players, [1, 0, 3, 2, 4]).tolist() == [1, 3]
+
+def test_unique_combo_indexes():
+    players = [['a', 'b'], ['b', 'a'], ['a', 'c'], ['a', 'b', 'c'], ['c', 'a']]
+    assert utils.filters.unique_combo_indexes(players).tolist() == [0, 2, 3]
+    assert utils.filters.unique_combo_indexes(players, [4, 3, 2, 1, 0]).tolist() == [4, 3, 1]
+
+def test_unique_player_reports():
+    reports = [Report(3, 'a', 'b'), Report(1, 'b', 'c'), Report(2, 'd', 'e')]
+    assert [r.timestamp for r in utils.filters.unique_player_reports(reports)] == [3, 2]
+    selected = utils.filters.unique_player_reports(reports, key=lambda r: r.timestamp)
+    assert [r.timestamp for r in selected] == [1, 2]
+    players = [p for r in selected for p in r.players]
+    assert len(players) == len(set(players))
+
+def test_unique_player_combo_reports():
+    reports = [Report(1, 'a', 'b'), Report(2, 'b', 'a'), Report(3, 'a', 'c')]
+    assert [r.timestamp for r in utils.filters.unique_player_combo_reports(reports)] == [1, 3]
+    assert utils.filters.unique_player_reports([]) == []
@@ -0,0 +1,17 @@
+from collections import Counter
+
+import civs.flourish
+import utils.team_models
+
+def test_export_pipeline_has_every_map():
+    pipeline = civs.flourish.export_pipeline(utils.team_models, 'model')
+    assert 'Baltic' not in utils.team_models.MAPS
+    assert 'utils.team_models-model-civ_popularity-Baltic' in pipeline.jobs
+
+def test_export_report_removes_map_without_enough_players(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils.team_models, 'GRAPH_DIR', str(tmp_path))
+    stale = tmp_path / 'flourish_baltic_popularity.csv'
+    stale.write_text('old')
+    shared = (None, Counter({'Baltic': civs.flourish.MIN_MAP_PLAYERS - 1}))
+    civs.flourish.export_report(shared, 'civ_popularity', 'utils.team_models', 'Baltic')
+    assert not stale.exists()
@@ -0,0 +1,39 @@
+from collections import Counter
+import io
+
+import civs.graphs
+import utils.rankings
+import utils.solo_models
+
+def heatmap_data():
+    rating_keys = ['1-650', '651-750']
+    store = utils.rankings.RankingStore(['Britons', 'Franks'], ['Arabia'], rating_keys)
+    store.assign('Overall', Counter({'Britons': 3, 'Franks': 1}))
+    civ_dict = {name: civs.graphs.Civ(name, store) for name in store.names}
+    map_store = utils.rankings.RankingStore(['Arabia', 'Arena'], (), rating_keys)
+    map_store.assign('1-650', Counter({'Arabia': 3, 'Arena': 1}))
+    map_store.assign('651-750', Counter({'Arena': 1}))
+    maps = {name: civs.graphs.Map(name, map_store) for name in map_store.names}
+    return civs.graphs.HeatmapData(civ_dict, ['Arabia'], rating_keys, maps)
+
+def test_maps_x_ratings_heatmap_table():
+    f = io.StringIO()
+    civs.graphs.write_maps_x_ratings_heatmap_table(f, heatmap_data())
+    lines = f.getvalue().split('\n')
+    assert lines[0] == '<h3>Overall Popularity of Maps per Rating</h3>'
+    # Arena is before Arabia in MAP_ORDER; 35 is the ranking of a map without matches
+    assert lines[3] == ('<tr><td class="ylabel">Arena</td>'
+                        '<td class="data" style="background-color: hsl(180.0, 100%, 60%)">2</td>'
+                        '<td class="data" style="background-color: hsl(0.0, 100%, 60%)">1</td></tr>')
+    assert lines[4] == ('<tr><td class="ylabel">Arabia</td>'
+                        '<td class="data" style="background-color: hsl(60.0, 100%, 60%)">1</td>'
+                        '<td class="data" style="background-color: hsl(240.0, 100%, 60%)">35</td></tr>')
+
+def test_civ_popularity_page_uses_shared_data(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils.solo_models, 'GRAPH_DIR', str(tmp_path))
+    def no_reports(data_set_type):
+        raise AssertionError('reports loaded again')
+    monkeypatch.setattr(utils.solo_models.MatchReport, 'all', no_reports)
+    data = heatmap_data()
+    civs.graphs.write_maps_x_ratings_heatmaps_to_html(None, data.maps, data.rating_keys, 'test', utils.solo_models, data)
+    assert 'Overall Popularity of Maps per Rating' in (tmp_path / 'civ_popularity_data.html').read_text()
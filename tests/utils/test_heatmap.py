@@ -0,0 +1,28 @@
+import io
+
+import numpy as np
+
+import utils.heatmap
+
+def test_nth_largest():
+    values = [.3, .1, .7, .7, 0, .2]
+    for n in range(1, 7):
+        assert utils.heatmap.nth_largest(values, n) == sorted(values, reverse=True)[n - 1]
+    assert utils.heatmap.nth_largest(np.array([[1, 5], [3, 2]]), 2) == 3
+    assert utils.heatmap.nth_largest([], 3) == 0
+
+def test_normalize():
+    assert utils.heatmap.normalize([0, .25, .5, 1], .5).tolist() == [0, .5, 1, 1]
+    assert utils.heatmap.normalize([0, .25], 0).tolist() == [0, 1]
+
+def test_write_table():
+    f = io.StringIO()
+    utils.heatmap.write_table(f, np.array([[0, .5], [1, .25]]), np.array([[1, 2], [3, 4]]), ['a', 'b'], ['x', 'y'], 'Map')
+    lines = f.getvalue().split('\n')
+    assert lines[0] == '<table>'
+    assert lines[1] == '<tr><th>Map</th><th class="xlabel">a</th><th class="xlabel">b</th></tr>'
+    assert lines[2] == ('<tr><td class="ylabel">x</td>'
+                        '<td class="data" style="background-color: hsl(240.0, 100%, 60%)">1</td>'
+                        '<td class="data" style="background-color: hsl(120.0, 100%, 60%)">2</td></tr>')
+    assert lines[3].startswith('<tr><td class="ylabel">y</td><td class="data" style="background-color: hsl(0.0, 100%, 60%)">3</td>')
+    assert lines[4] == '</table>'
@@ -0,0 +1,37 @@
+import subprocess
+import sys
+
+import utils.import_times
+import utils.lazy
+import utils.models
+
+def test_lazy_module_imports_on_first_use():
+    module = utils.lazy.module('json')
+    assert module._module is None
+    assert module.loads('[1]') == [1]
+    assert module._module is sys.modules['json']
+    dumps = utils.lazy.function('json', 'dumps')
+    assert dumps.__name__ == 'dumps'
+    assert dumps([1]) == '[1]'
+
+def test_lookup_is_shared():
+    assert utils.models.lookup() is utils.models.lookup()
+    assert utils.models.lookup().map_name(utils.models.lookup().map_type('Arabia')) == 'Arabia'
+
+def test_entry_points_skip_heavy_imports():
+    statement = ('import sys, utils.download, utils.models, elo.calculations, civs.analyze; '
+                 'print([m for m in ("requests", "matplotlib", "scipy", "statsmodels") if m in sys.modules], utils.models._lookup)')
+    result = subprocess.run([sys.executable, '-c', statement], cwd=str(utils.import_times.ROOT_DIR), capture_output=True, text=True)
+    assert result.stdout.strip() == '[] None'
+
+def test_slowest():
+    output = '\n'.join([
+        'import time: self [us] | cumulative | imported package',
+        'import time:       100 |        100 |   _io',
+        'import time:      1000 |       2000 | site',
+        'import time:       500 |        500 |     numpy.core',
+        'import time:      3000 |       4000 |   numpy',
+        'import time:       200 |        300 | requests',
+        'import time:       100 |       9000 | utils.models',
+    ])
+    assert utils.import_times.slowest(output, 2, exclude=('utils',)) == [('numpy', 0.004), ('requests', 0.0003)]
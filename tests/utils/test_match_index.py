@@ -0,0 +1,105 @@
+import csv
+import glob
+import os
+import shutil
+import types
+
+import pytest
+
+import utils.match_index
+import utils.models
+import utils.solo_models
+import utils.team_models
+
+@pytest.fixture(scope="session", autouse=True)
+def set_model_data_file_templates():
+    if not '/tests' in utils.solo_models.DATA_DIR:
+        utils.solo_models.DATA_DIR = utils.solo_models.DATA_DIR.replace('/data', '/tests/data')
+    if not '/tests' in utils.team_models.DATA_DIR:
+        utils.team_models.DATA_DIR = utils.team_models.DATA_DIR.replace('/team-data', '/tests/team-data')
+
+@pytest.fixture(params=[utils.solo_models, utils.team_models])
+def module(request, tmp_path):
+    """ A copy of a models module's matches files in a directory of its own. """
+    for path in glob.glob('{}/matches_for_*.csv'.format(request.param.DATA_DIR)):
+        shutil.copy(path, str(tmp_path))
+    return types.SimpleNamespace(DATA_DIR=str(tmp_path), Match=request.param.Match)
+
+def match_ids(matches):
+    return sorted(m.match_id for m in matches)
+
+def test_all_with_index(module):
+    without_index = utils.models.Match.all(module)
+    utils.match_index.rebuild(module)
+    index = utils.match_index.load(module.DATA_DIR)
+    assert index.profiles
+    assert match_ids(utils.models.Match.all(module)) == match_ids(without_index)
+    assert match_ids(utils.models.Match.all(module, True)) == sorted(
+        match_id for match_ids_, _ in index.profiles.values() for match_id in match_ids_)
+
+def test_all_with_index_drops_repeated_rows(module):
+    utils.match_index.rebuild(module)
+    profile_id, file_ids = sorted((p, ids) for p, ids in utils.match_index.load(module.DATA_DIR).owned().items() if ids)[0]
+    path = '{}/matches_for_{}.csv'.format(module.DATA_DIR, profile_id)
+    with open(path) as f:
+        rows = [row for row in f.readlines() if row.split(',')[0] in file_ids]
+    # The file repeats a match it owns
+    with open(path, 'a') as f:
+        f.write(rows[0])
+    utils.match_index.rebuild(module)
+    matches = match_ids(utils.models.Match.all(module))
+    assert len(matches) == len(set(matches))
+
+def test_duplicates_and_winners():
+    index = utils.match_index.MatchIndex({
+        '10': (['1', '2', '3'], ['1', '2', '0']),
+        '2': (['1', '2'], ['1', '1']),
+        '30': (['1', '4'], ['0', '0']),
+        })
+    assert index.owned() == {'2': {'1', '2'}, '10': {'3'}, '30': {'4'}}
+    assert index.duplicate_counts() == {3: 1, 2: 1, 1: 2}
+    ctr = index.winner_counts()
+    assert ctr == {'confirmed': 1, 'contradictory': 1, '1-1': 1, '1-2': 1}
+
+def test_record_and_compact(tmp_path):
+    data_dir = str(tmp_path)
+    matches = [types.SimpleNamespace(match_id='1', winner=2), types.SimpleNamespace(match_id='2')]
+    utils.match_index.record(data_dir, '5', matches[:1])
+    utils.match_index.record(data_dir, '5', matches)
+    utils.match_index.record(data_dir, '6', [])
+    assert utils.match_index.load(data_dir).profiles == {'5': (['1', '2'], ['2', '0']), '6': ([], [])}
+    utils.match_index.compact(data_dir)
+    with open(utils.match_index.index_file(data_dir)) as f:
+        assert len(f.readlines()) == 2
+    assert utils.match_index.load(data_dir).profiles['5'] == (['1', '2'], ['2', '0'])
+
+def unindexed_match_ids(module, tmp_path):
+    """ Match ids Match.all reads from a copy of module's matches files without the index. """
+    copy_dir = tmp_path / 'unindexed'
+    copy_dir.mkdir()
+    for path in glob.glob('{}/matches_for_*.csv'.format(module.DATA_DIR)):
+        shutil.copy(path, str(copy_dir))
+    return match_ids(utils.models.Match.all(types.SimpleNamespace(DATA_DIR=str(copy_dir), Match=module.Match)))
+
+def owner(module):
+    """ Profile id of the file owning the most matches. """
+    owned = utils.match_index.load(module.DATA_DIR).owned()
+    return max(owned, key=lambda profile_id: len(owned[profile_id]))
+
+def test_deleted_file_is_not_trusted(module, tmp_path):
+    utils.match_index.rebuild(module)
+    os.remove(utils.match_index.data_file(module.DATA_DIR, owner(module)))
+    assert match_ids(utils.models.Match.all(module)) == unindexed_match_ids(module, tmp_path)
+
+def test_rewritten_file_is_read_in_full(module, tmp_path):
+    utils.match_index.rebuild(module)
+    path = utils.match_index.data_file(module.DATA_DIR, owner(module))
+    with open(path) as f:
+        rows = list(csv.reader(f))
+    # A new match, and the file's first match dropped, without a new index row
+    rows = [rows[0], ['99999999'] + rows[-1][1:]] + rows[2:]
+    with open(path, 'w') as f:
+        csv.writer(f).writerows(rows)
+    found = match_ids(utils.models.Match.all(module))
+    assert '99999999' in found
+    assert found == unindexed_match_ids(module, tmp_path)
@@ -0,0 +1,45 @@
+import glob
+import shutil
+import types
+
+import numpy as np
+import pytest
+
+import utils.opponents
+import utils.profile_set
+import utils.team_models
+
+@pytest.fixture(scope="session", autouse=True)
+def set_model_data_file_templates():
+    if not '/tests' in utils.team_models.DATA_DIR:
+        utils.team_models.DATA_DIR = utils.team_models.DATA_DIR.replace('/team-data', '/tests/team-data')
+
+def graph(opponent_lists):
+    return utils.opponents.OpponentGraph.from_lists(opponent_lists)
+
+def test_frontier():
+    g = graph({'1': ['2', '3'], '2': ['1', '4'], '5': ['6']})
+    assert g.opponents_of([1, 2, 7]).tolist() == [1, 2, 3, 4]
+    assert g.frontier([1, 2], utils.profile_set.as_ids(['1', '3', 'foo'])).tolist() == [2, 4]
+    assert g.indexed(np.array([1, 3, 5])).tolist() == [True, False, True]
+
+def test_components():
+    g = graph({'5': ['9'], '9': ['7'], '1': ['3'], '4': ['3', '8'], '12': []})
+    nodes, labels = g.components()
+    assert dict(zip(nodes.tolist(), labels.tolist())) == {1: 1, 3: 1, 4: 1, 8: 1, 5: 5, 7: 5, 9: 5, 12: 12}
+
+def test_record_rebuild_and_compact(tmp_path):
+    for path in glob.glob('{}/matches_for_*.csv'.format(utils.team_models.DATA_DIR)):
+        shutil.copy(path, str(tmp_path))
+    module = types.SimpleNamespace(DATA_DIR=str(tmp_path), Match=utils.team_models.Match)
+    utils.opponents.rebuild(module)
+    g = utils.opponents.load(module.DATA_DIR)
+    matches = utils.team_models.Match.all_for('1895829')
+    expected = set(p for m in matches for p in m.players) - {'1895829'}
+    assert set(g.opponents_of([1895829]).tolist()) == set(int(p) for p in expected)
+    # Later rows replace earlier ones
+    utils.opponents.record(module.DATA_DIR, '1895829', matches[:1])
+    g = utils.opponents.load(module.DATA_DIR)
+    assert set(g.opponents_of([1895829]).tolist()) == set(int(p) for p in matches[0].players) - {1895829}
+    utils.opponents.compact(module.DATA_DIR)
+    assert utils.opponents.load(module.DATA_DIR).opponents_of([1895829]).tolist() == g.opponents_of([1895829]).tolist()
@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+import utils.pipeline
+
+def copy_upper(shared, source, target):
+    with open(source) as f:
+        data = f.read()
+    with open(target, 'w') as f:
+        f.write('{}{}'.format(shared, data.upper()))
+
+def concatenate(shared, sources, target):
+    with open(target, 'w') as f:
+        for source in sources:
+            with open(source) as s:
+                f.write(s.read())
+
+def fail(shared):
+    raise ValueError('failed')
+
+def build(tmp_path, workers):
+    source = tmp_path / 'source.txt'
+    other = tmp_path / 'other.txt'
+    upper = tmp_path / 'upper.txt'
+    both = tmp_path / 'both.txt'
+    pipeline = utils.pipeline.Pipeline(str(tmp_path / 'state.json'), workers)
+    pipeline.add(utils.pipeline.Job('both', concatenate, ([str(upper), str(other)], str(both)), [str(other)], [str(both)], ['upper']))
+    pipeline.add(utils.pipeline.Job('upper', copy_upper, (str(source), str(upper)), [str(source)], [str(upper)]))
+    pipeline.add(utils.pipeline.Job('other', copy_upper, (str(other), str(tmp_path / 'other_upper.txt')), [str(other)], [str(tmp_path / 'other_upper.txt')]))
+    return pipeline, source, other, both
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_run_only_changed(tmp_path, workers):
+    pipeline, source, other, both = build(tmp_path, workers)
+    source.write_text('a')
+    other.write_text('b')
+    calls = []
+    def shared():
+        calls.append(1)
+        return '>'
+    assert sorted(pipeline.run(shared)) == ['both', 'other', 'upper']
+    assert both.read_text() == '>Ab'
+    # Nothing changed: nothing runs and the shared data is not built
+    assert pipeline.run(shared) == []
+    assert len(calls) == 1
+    # A changed input reruns its job and the jobs depending on it
+    source.write_text('cc')
+    assert pipeline.run(shared) == ['upper', 'both']
+    assert both.read_text() == '>CCb'
+    # A missing output is rewritten
+    os.remove(str(both))
+    assert pipeline.run(shared) == ['both']
+    assert sorted(pipeline.run(shared, force=True)) == ['both', 'other', 'upper']
+
+def test_fingerprint_follows_sources(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / 'pipeline_job.py').write_text('def write(shared):\n    return 1\n')
+    (tmp_path / 'pipeline_helper.py').write_text('SCALE = 1\n')
+    import pipeline_job
+    job = utils.pipeline.Job('write', pipeline_job.write, sources=['pipeline_helper'])
+    before = utils.pipeline.fingerprint(job)
+    assert utils.pipeline.fingerprint(job) == before
+    # Editing the job's module or a module it uses changes the fingerprint
+    (tmp_path / 'pipeline_job.py').write_text('def write(shared):\n    return 2\n')
+    edited = utils.pipeline.fingerprint(job)
+    assert edited != before
+    (tmp_path / 'pipeline_helper.py').write_text('SCALE = 2\n')
+    assert utils.pipeline.fingerprint(job) not in (before, edited)
+
+def test_order():
+    pipeline = utils.pipeline.Pipeline('unused')
+    pipeline.add(utils.pipeline.Job('c', fail, depends=['b']))
+    pipeline.add(utils.pipeline.Job('b', fail, depends=['a']))
+    pipeline.add(utils.pipeline.Job('a', fail))
+    assert pipeline.order() == ['a', 'b', 'c']
+    pipeline.add(utils.pipeline.Job('d', fail, depends=['d']))
+    with pytest.raises(ValueError):
+        pipeline.order()
+
+def test_failure(tmp_path):
+    pipeline = utils.pipeline.Pipeline(str(tmp_path / 'state.json'), 2)
+    pipeline.add(utils.pipeline.Job('fail', fail))
+    pipeline.add(utils.pipeline.Job('after', fail, depends=['fail']))
+    with pytest.raises(RuntimeError):
+        pipeline.run()
+    assert pipeline.load_state() == {}
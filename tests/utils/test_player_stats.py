@@ -0,0 +1,94 @@
+import random
+from statistics import median, stdev
+
+import numpy as np
+import pytest
+
+import utils.player_stats
+import utils.rating_cache
+
+class Report:
+    def __init__(self, players):
+        self.players = {player_id: {'rating': rating} for player_id, rating in players.items()}
+
+@pytest.fixture
+def reports():
+    rng = random.Random(7)
+    reports = []
+    for _ in range(400):
+        first, second = rng.sample(range(30), 2)
+        reports.append(Report({str(first): rng.choice([50, rng.randint(800, 1400)]),
+                                str(second): rng.randint(900, 1000)}))
+    return reports
+
+def player_ratings(reports, min_rating):
+    ratings = {}
+    for report in reports:
+        for player_id, data in report.players.items():
+            ratings.setdefault(player_id, [])
+            if min_rating is None or data['rating'] > min_rating:
+                ratings[player_id].append(data['rating'])
+    return ratings
+
+def test_counts_and_stdevs(reports):
+    stats = utils.player_stats.PlayerStats(reports)
+    ratings = player_ratings(reports, 100)
+    stdevs = stats.stdevs()
+    assert sorted(stats.player_ids) == sorted(ratings)
+    for player_id, player_ratings_ in ratings.items():
+        idx = stats.player_index[player_id]
+        assert list(stats.ratings_for(player_id)) == sorted(player_ratings_)
+        assert stats.counts[idx] == len(player_ratings_)
+        assert stats.match_counts[idx] == len(player_ratings(reports, None)[player_id])
+        assert stdevs[idx] == pytest.approx(stdev(player_ratings_))
+
+@pytest.mark.parametrize('size', [3, 5, 10])
+def test_best_window_matches_best_rating(reports, size):
+    stats = utils.player_stats.PlayerStats(reports)
+    best_stdevs, best_medians = stats.best_window(size)
+    for player_id, ratings in player_ratings(reports, 100).items():
+        idx = stats.player_index[player_id]
+        if len(ratings) < size:
+            assert np.isnan(best_stdevs[idx])
+            continue
+        sorted_ratings = sorted(ratings)
+        windows = [sorted_ratings[i:i + size] for i in range(len(ratings) - size + 1)]
+        expected = min(reversed(windows), key=stdev)
+        assert best_stdevs[idx] == pytest.approx(stdev(expected))
+        assert best_medians[idx] == median(expected)
+        if len(ratings) >= size*1.5:
+            assert (best_medians[idx], best_stdevs[idx]) == pytest.approx(utils.rating_cache.best_rating(ratings, size))
+
+def test_best_window_without_last(reports):
+    stats = utils.player_stats.PlayerStats(reports, None)
+    best_stdevs, _ = stats.best_window(10, ties='first', last=False)
+    for player_id, ratings in player_ratings(reports, None).items():
+        if len(ratings) < 10:
+            continue
+        # As player_rating_stdevs always did: the first window, then each but the last
+        sorted_ratings = sorted(ratings)
+        best_std = stdev(sorted_ratings[:10])
+        for i in range(len(ratings) - 10):
+            best_std = min(best_std, stdev(sorted_ratings[i:i + 10]))
+        assert best_stdevs[stats.player_index[player_id]] == pytest.approx(best_std)
+
+def test_best_window_ties():
+    reports = [Report({'a': rating}) for rating in (900, 901, 950, 999, 1000)]
+    stats = utils.player_stats.PlayerStats(reports)
+    assert stats.best_window(2)[1][0] == 999.5
+    assert stats.best_window(2, ties='first')[1][0] == 900.5
+
+def test_bounds():
+    reports = [Report({'a': rating, 'b': rating*3}) for rating in (500, 900, 910, 920, 930, 1500)]
+    stats = utils.player_stats.PlayerStats(reports)
+    lower, upper, valid = stats.bounds(20, 4)
+    a = stats.player_index['a']
+    b = stats.player_index['b']
+    assert (lower[a], upper[a], valid[a]) == (500, 1500, True)
+    assert (lower[b], upper[b], valid[b]) == (10000, 0, False)
+    lower, upper, valid = stats.bounds(20, 4, trimmed=True)
+    assert (lower[a], upper[a], valid[a]) == (900, 930, True)
+    assert (lower[b], upper[b], valid[b]) == (10000, 0, False)
+
+def test_histogram():
+    assert utils.player_stats.histogram([1.5, 1.2, np.nan, 3]) == {1: 2, 3: 1}
@@ -0,0 +1,82 @@
+from collections import Counter
+
+import pytest
+
+import utils.buckets
+import utils.popularity
+import utils.solo_models
+
+def players():
+    rows = [
+        ['1588091226', '9', '11:16', '610:1014', 'foo:bar', '1:2', '0', '0'],
+        ['1588091227', '9', '12:17', '660:1014', 'foo:bar', '1:2', '1', '0'],
+        ['1588091228', '22', '13:16', '690:1014', 'foo:bar', '1:2', '2', '0'],
+        ['1588091229', '22', '13:17', '720:1024', 'foo:baz', '1:2', '1', '0'],
+        ['1588091230', '9', '11:17', '1020:700', 'bar:baz', '1:2', '2', '0'],
+        ]
+    reports = [utils.solo_models.MatchReport(row) for row in rows]
+    ps = utils.solo_models.Player.player_values(reports)
+    best = {'foo': 680, 'bar': 1014, 'baz': 705}
+    for p in ps:
+        p._best_ratings[5] = best[p.player_id]
+    return list(ps)
+
+BUCKETS = utils.buckets.overlapping([650, 700, 750, 1050, 10000])
+
+def assert_same(actual, expected):
+    assert set(actual) == set(expected)
+    for k in expected:
+        assert actual[k] == pytest.approx(expected[k])
+
+@pytest.mark.parametrize('map_name', ['all', 'Arabia', 'Rivers', 'No such map'])
+def test_civ_popularity(map_name):
+    ps = players()
+    counters, player_counts = utils.popularity.civ_popularity(utils.popularity.PlayerMatches(ps), map_name, BUCKETS)
+    for idx, (start, edge) in enumerate(BUCKETS):
+        expected = Counter()
+        total = 0
+        for p in ps:
+            if start < p.best_rating() <= edge and p.add_civ_percentages(expected, map_name, start, edge):
+                total += 1
+        assert_same(counters[idx], expected)
+        assert player_counts[idx] == total
+
+@pytest.mark.parametrize('map_name', ['all', 'Arabia'])
+def test_win_popularity(map_name):
+    ps = players()
+    wins, totals, _ = utils.popularity.win_popularity(utils.popularity.PlayerMatches(ps), map_name, BUCKETS)
+    for idx, (start, edge) in enumerate(BUCKETS):
+        expected_wins = Counter()
+        expected_totals = Counter()
+        for p in ps:
+            if start < p.best_rating() <= edge:
+                p.add_win_percentages(expected_wins, expected_totals, map_name, start, edge)
+        assert_same(totals[idx], expected_totals)
+        assert_same(wins[idx], +expected_wins)
+
+def test_map_popularity():
+    ps = players()
+    pm = utils.popularity.PlayerMatches(ps)
+    counters, _ = utils.popularity.map_popularity(pm, BUCKETS)
+    for idx, (start, edge) in enumerate(BUCKETS):
+        expected = Counter()
+        for p in ps:
+            if start < p.best_rating() <= edge:
+                p.add_map_percentages(expected, start, edge)
+        assert_same(counters[idx], expected)
+    by_group = utils.popularity.map_popularity_by_group(pm, [len(p.matches) for p in pm.players])
+    expected = Counter()
+    for p in ps:
+        if len(p.matches) == 4:
+            p.add_map_percentages(expected, 0, 10000)
+    assert_same(by_group[4], expected)
+
+def test_buckets():
+    buckets = utils.buckets.steps(650, 750)
+    assert list(buckets) == [(0, 650), (600, 700), (650, 750), (700, 10000)]
+    assert buckets.keys() == ['1-650', '601-700', '651-750', '701+']
+    assert utils.buckets.RATINGS.keys()[-1] == '1651+'
+    members = buckets.members([700, 0, 650, 651, 20000])
+    assert [sorted(m.tolist()) for m in members] == [[2], [0, 2, 3], [0, 3], []]
+    narrow = utils.buckets.steps(650, 700, step=25, overlap=0)
+    assert list(narrow) == [(0, 650), (650, 675), (675, 700), (700, 10000)]
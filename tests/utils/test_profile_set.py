@@ -0,0 +1,37 @@
+import numpy as np
+
+import utils.profile_set
+
+def test_normalizes_ids():
+    profiles = utils.profile_set.ProfileSet(['3', 1, 3, 'foo', np.int64(2)])
+    assert profiles.ids.tolist() == [1, 2, 3]
+    assert profiles.ids.dtype == np.int64
+    assert list(profiles) == [1, 2, 3]
+    assert profiles.strs() == ['1', '2', '3']
+    assert utils.profile_set.ProfileSet(np.array([5, 4, 5])).ids.tolist() == [4, 5]
+
+def test_membership():
+    profiles = utils.profile_set.ProfileSet([1, 5, 9])
+    assert 5 in profiles
+    assert '5' in profiles
+    assert not 4 in profiles
+    assert not 'foo' in profiles
+    assert not None in profiles
+    assert not 1 in utils.profile_set.ProfileSet()
+    assert profiles.contains([0, 1, 9, 10]).tolist() == [False, True, True, False]
+
+def test_set_operations():
+    a = utils.profile_set.ProfileSet([1, 2, 3])
+    b = utils.profile_set.ProfileSet(['2', '4'])
+    assert (a | b).ids.tolist() == [1, 2, 3, 4]
+    assert (a - b).ids.tolist() == [1, 3]
+    assert (a & b).ids.tolist() == [2]
+    assert (a - ['3', 'foo']).ids.tolist() == [1, 2]
+    assert a == utils.profile_set.ProfileSet(['1', '2', '3'])
+
+def test_update_does_not_change_taken_arrays():
+    profiles = utils.profile_set.ProfileSet([2])
+    ids = profiles.ids
+    profiles.update(['1', 3])
+    assert profiles.ids.tolist() == [1, 2, 3]
+    assert ids.tolist() == [2]
@@ -0,0 +1,43 @@
+from collections import Counter
+import pickle
+
+import utils.rankings
+
+RATING_KEYS = ['1-650', '601-700', '651+']
+
+def test_assign_and_view():
+    store = utils.rankings.RankingStore(['Britons', 'Franks'], ['Arabia'], RATING_KEYS)
+    store.assign('Overall', Counter({'Franks': 3, 'Britons': 1}))
+    store.assign('Arabia-601-700', Counter({'Britons': 2, 'Huns': 2}))
+    franks = store.view('popularity', 'Franks')
+    assert franks['Overall'] == .75
+    assert store.view('rankings', 'Franks')['Overall'] == 1
+    assert store.view('rankings', 'Britons')['Overall'] == 2
+    assert store.view('totals', 'Britons')['Overall'] == 4
+    # Ties ranked in counter order, unset values are the defaults
+    assert store.view('rankings', 'Britons')['Arabia-601-700'] == 1
+    assert store.view('rankings', 'Huns')['Arabia-601-700'] == 2
+    assert store.view('rankings', 'Franks')['Arabia-601-700'] == 35
+    assert franks['Arabia-601-700'] == 0
+    assert store.names == ['Britons', 'Franks', 'Huns']
+    assert sorted(store.view('popularity', 'Britons').keys()) == ['Arabia-601-700', 'Overall']
+
+def test_keys():
+    store = utils.rankings.RankingStore(rating_keys=RATING_KEYS)
+    view = store.view('popularity', 'Britons')
+    view['Arabia'] = .1
+    view['651+'] = .2
+    view['Alpine Lakes-1-650'] = .3
+    assert store.position('Arabia') == (1, 0)
+    assert store.position('651+') == (0, 3)
+    assert store.position('Alpine Lakes-1-650') == (2, 1)
+    assert dict(view.items()) == {'Arabia': .1, '651+': .2, 'Alpine Lakes-1-650': .3}
+
+def test_values_and_pickle():
+    store = utils.rankings.RankingStore(['Britons', 'Franks'], ['Arabia', 'Arena'], RATING_KEYS)
+    store.assign('Arena-651+', Counter({'Franks': 1, 'Britons': 3}))
+    store = pickle.loads(pickle.dumps(store))
+    values = store.values('popularity', ['Arabia', 'Arena'], ['651+'], ['Franks', 'Britons'])
+    assert values.shape == (2, 2, 1)
+    assert values[:, 1, 0].tolist() == [.25, .75]
+    assert not values[:, 0, 0].any()
@@ -0,0 +1,61 @@
+import os
+import shutil
+
+import pytest
+
+import utils.rating_store
+import utils.solo_models
+
+PROFILES = ('1301032', '242765',)
+
+@pytest.fixture(scope="session", autouse=True)
+def set_model_data_file_templates():
+    if not '/tests' in utils.solo_models.DATA_DIR:
+        utils.solo_models.DATA_DIR = utils.solo_models.DATA_DIR.replace('/data', '/tests/data')
+
+@pytest.fixture
+def data_dir(tmp_path):
+    for profile_id in PROFILES:
+        shutil.copy(utils.solo_models.Rating.data_file(profile_id), str(tmp_path))
+    return str(tmp_path)
+
+def expected_rows(profile_id):
+    ratings = sorted(utils.solo_models.Rating.all_for(profile_id), key=lambda r: r.timestamp)
+    return [(r.rating, r.old_rating, r.num_wins, r.num_losses, r.drops, r.timestamp, r.won_state or '') for r in ratings]
+
+def table_rows(table, profile_id):
+    rows = table.rows_for(profile_id)
+    columns = [table.columns[name][rows].tolist() for name in utils.rating_store.COLUMNS]
+    states = [utils.rating_store.WON_STATES[code] for code in table.won_state[rows]]
+    return list(zip(*columns, states))
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_read_files(data_dir, workers):
+    files = utils.rating_store.rating_files(data_dir)
+    table = utils.rating_store.read_files(files.values(), workers, chunk_size=1)
+    assert sorted(table.profiles().tolist()) == sorted(int(p) for p in PROFILES)
+    for profile_id in PROFILES:
+        assert table_rows(table, profile_id) == expected_rows(profile_id)
+
+def test_load_updates_store(data_dir):
+    table = utils.rating_store.load(data_dir)
+    store = utils.rating_store.store_file(data_dir)
+    assert os.path.exists(store)
+    assert len(table) == sum(len(expected_rows(p)) for p in PROFILES)
+    # Unchanged files come from the store
+    mtime = os.stat(store).st_mtime_ns
+    assert len(utils.rating_store.load(data_dir)) == len(table)
+    assert os.stat(store).st_mtime_ns == mtime
+    # Removed files are dropped
+    os.remove(os.path.join(data_dir, 'ratings_for_242765.csv'))
+    table = utils.rating_store.load(data_dir)
+    assert 242765 not in table.profiles()
+    assert table_rows(table, '1301032') == expected_rows('1301032')
+
+def test_load_subset_and_drift(data_dir):
+    table = utils.rating_store.load(data_dir, ['1301032'], use_store=False)
+    assert table.profiles().tolist() == [1301032]
+    profiles, drift = table.drift()
+    rows = expected_rows('1301032')
+    assert drift.tolist() == [rows[-1][0] - rows[0][0]]
+    assert not os.path.exists(utils.rating_store.store_file(data_dir))
@@ -6,12 +6,8 @@ import utils.solo_models
 import utils.team_models
 import utils.sample
 
-@pytest.fixture(scope="session", autouse=True)
-def set_model_data_file_templates():
-    if not '/tests' in utils.solo_models.DATA_DIR:
-        utils.solo_models.DATA_DIR = utils.solo_models.DATA_DIR.replace('/data', '/tests/data')
-    if not '/tests' in utils.team_models.DATA_DIR:
-        utils.team_models.DATA_DIR = utils.team_models.DATA_DIR.replace('/team-data', '/tests/team-data')
+@pytest.fixture(autouse=True)
+def data_set_files(data_dirs):
     # Make sure all the files exist to hit with stat
     for module in (utils.solo_models, utils.team_models):
         for data_set_type in ('test', 'model', 'verification',):
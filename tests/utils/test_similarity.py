@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import utils.similarity
+
+CUBE = np.array([
+    # civ 0: maps 0 and 2 alike
+    [[.1, .2, .3], [.5, .1, 0], [.1, .25, .3], [0, 0, 0]],
+    # civ 1: maps 1 and 2 alike
+    [[.4, .0, .1], [.2, .2, .2], [.2, .2, .25], [.3, .1, .1]],
+    ])
+
+def loop_l1(cube):
+    n_civs, n_maps, _ = cube.shape
+    dists = np.zeros((n_civs, n_maps, n_maps))
+    for c in range(n_civs):
+        for m in range(n_maps):
+            for n in range(n_maps):
+                dists[c, m, n] = sum(abs(a - b) for a, b in zip(cube[c, m], cube[c, n]))
+    return dists
+
+def test_l1():
+    assert utils.similarity.distances(CUBE) == pytest.approx(loop_l1(CUBE))
+
+def test_cosine():
+    dists = utils.similarity.distances(CUBE, 'cosine')
+    a, b = CUBE[1, 0], CUBE[1, 3]
+    assert dists[1, 0, 3] == pytest.approx(1 - a.dot(b)/np.linalg.norm(a)/np.linalg.norm(b))
+    assert dists[0, 0, 3] == 1
+
+def test_jensen_shannon():
+    dists = utils.similarity.distances(CUBE, 'js')
+    assert dists[1, 1, 1] == pytest.approx(0)
+    assert dists[0, 0, 1] == pytest.approx(dists[0, 1, 0])
+    assert 0 < dists[0, 0, 1] <= 1
+    assert dists[0, 0, 3] == 1
+
+def test_unknown_metric():
+    with pytest.raises(ValueError):
+        utils.similarity.distances(CUBE, 'l2')
+
+def test_best_match_scores():
+    dists = utils.similarity.distances(CUBE)
+    closest, closest_dists = utils.similarity.most_similar(dists)
+    assert closest[0, 0] == 2
+    assert closest[1, 1] == 2
+    scores = utils.similarity.best_match_scores(dists)
+    max_similarity = closest_dists.max()
+    expected = np.zeros((4, 4))
+    for c in range(2):
+        for m in range(4):
+            expected[m, closest[c, m]] += max_similarity - closest_dists[c, m]
+    assert scores == pytest.approx(expected)
+    assert not scores.diagonal().any()
@@ -5,12 +5,11 @@ import pathlib
 
 import pytest
 
+import utils.rating_cache
+import utils.report_columns
 import utils.solo_models
 
-@pytest.fixture(scope="session", autouse=True)
-def set_model_data_file_templates():
-    if not '/tests' in utils.solo_models.DATA_DIR:
-        utils.solo_models.DATA_DIR = utils.solo_models.DATA_DIR.replace('/data', '/tests/data')
+pytestmark = pytest.mark.usefixtures('data_dirs')
 
 # Match
 def test_match_to_from_csv():
@@ -293,8 +292,8 @@ def test_cache_best_rating():
     data_set_type = 'test_cache_best_rating'
     mincount = 3
     # remove cache file
-    if os.path.exists(utils.solo_models.Player.rating_cache_file(data_set_type, mincount)):
-        os.remove(utils.solo_models.Player.rating_cache_file(data_set_type, mincount))
+    if os.path.exists(utils.solo_models.Player.rating_cache_file(data_set_type)):
+        os.remove(utils.solo_models.Player.rating_cache_file(data_set_type))
     # Set up match report data
     match_reports = []
     match_reports.append(['1588091225', '9', '11:16', '10:101', 'foo:bar', '1:2', '0', '0'])
@@ -324,3 +323,112 @@ def test_cache_best_rating():
         elif player.player_id == 'bar':
             player.matches = []
             assert player.best_rating(mincount) == 1014
+
+def test_player_columns_follow_matches():
+    player = utils.solo_models.Player('foo')
+    player.matches.append(utils.solo_models.MatchReport(['1588091227', '9', '11:16', '1010:1014', 'foo:bar', '1:2', '1', '0']))
+    player.matches.append(utils.solo_models.MatchReport(['1588091226', '22', '12:17', '1020:1014', 'foo:bar', '1:2', '2', '0']))
+    assert player.ratings == [1010, 1020]
+    assert player.ordered_ratings('timestamp') == [1020, 1010]
+    assert player.latest_rating == 1010
+    assert player.latest_civ == 'Goths'
+    assert player.maps == set(['Arabia', 'Rivers'])
+    # Appending rebuilds the derived data
+    latest = utils.solo_models.MatchReport(['1588091228', '9', '13:16', '1030:1014', 'foo:bar', '1:2', '0', '0'])
+    player.matches.append(latest)
+    assert player.ratings == [1010, 1020, 1030]
+    assert player.latest_match is latest
+    assert player.latest_civ == 'Incas'
+    # And reordering them
+    player.matches.reverse()
+    assert player.ratings == [1030, 1020, 1010]
+    player.matches.sort(key=lambda m: m.timestamp)
+    assert player.ratings == [1020, 1010, 1030]
+    player.matches *= 2
+    assert player.ratings == [1020, 1010, 1030]*2
+    player.matches.sort(key=lambda m: m.rating_1)
+    assert player.ratings == [1010, 1010, 1020, 1020, 1030, 1030]
+    # As does replacing them
+    player.matches = player.matches[:1]
+    assert player.ratings == [1010]
+    assert player.latest_rating == 1010
+    player.matches = []
+    assert player.latest_match is None
+    assert player.ratings == []
+
+def test_cache_best_rating_incrementally():
+    data_set_type = 'test_cache_best_rating_incrementally'
+    cache_file = utils.solo_models.Player.rating_cache_file(data_set_type)
+    if os.path.exists(cache_file):
+        os.remove(cache_file)
+    match_reports = []
+    match_reports.append(['1588091225', '9', '11:16', '1010:1011', 'foo:bar', '1:2', '0', '0'])
+    match_reports.append(['1588091226', '9', '11:16', '1020:1012', 'foo:bar', '1:2', '0', '0'])
+    match_reports.append(['1588091227', '9', '12:17', '1030:1013', 'foo:bar', '1:2', '0', '0'])
+    match_reports.append(['1588091228', '22', '13:16', '1040:1014', 'foo:baz', '1:2', '0', '0'])
+    data_file = utils.solo_models.MatchReport.data_file(data_set_type)
+    with open(data_file, 'w') as f:
+        csv.writer(f).writerows(match_reports)
+    utils.solo_models.Player.cache_player_ratings(data_set_type, 2)
+    utils.solo_models.Player.cache_player_ratings(data_set_type, 3)
+    cache = utils.rating_cache.read(cache_file)
+    assert cache.mincounts == [2, 3]
+    assert cache.lookup(2) == {'foo': 1035, 'bar': 1012.5}
+    assert cache.lookup(3) == {}
+
+    # Only the players in appended reports are recalculated
+    cache.best['bar'][2] = 1
+    utils.rating_cache.write(cache_file, cache)
+    with open(data_file, 'a') as f:
+        csv.writer(f).writerow(['1588091229', '22', '13:16', '1050:1015', 'foo:baz', '1:2', '0', '0'])
+    utils.solo_models.Player.cache_player_ratings(data_set_type, 3)
+    cache = utils.rating_cache.read(cache_file)
+    assert cache.lookup(2) == {'foo': 1045, 'bar': 1}
+    assert cache.lookup(3) == {'foo': 1040}
+
+    # A rewritten report file rebuilds the cache
+    with open(data_file, 'w') as f:
+        csv.writer(f).writerows(match_reports[1:])
+    utils.solo_models.Player.cache_player_ratings(data_set_type, 2)
+    assert utils.rating_cache.best_ratings(cache_file)[2] == {'foo': 1035}
+
+def test_match_report_derived_fields():
+    # started, map_code, civs, ratings, player ids, teams, winner, version
+    mr = utils.solo_models.MatchReport(['1582654374', '33', '5:30', '1258:1100', '1301032:242765', '2:1', '2', '0'])
+    assert (mr.player_1, mr.rating_1, mr.civ_1) == ('242765', 1100, 'Tatars')
+    assert (mr.player_2, mr.rating_2, mr.civ_2) == ('1301032', 1258, 'Byzantines')
+    assert mr.score == 158
+    assert not mr.mirror
+    assert utils.report_columns.unpack_code(mr.code) == (30, 5, 33)
+    mr = utils.solo_models.MatchReport(['1582654374', '33', '5:5', '1258:1100', '1301032:242765', '2:1', '1', '0'])
+    assert mr.score == -158
+    assert mr.mirror
+
+def test_match_report_columns():
+    data_set_type = 'for_test'
+    reports = [r for r in utils.solo_models.MatchReport.all(data_set_type) if r.code is not None]
+    columns = utils.solo_models.MatchReport.columns(data_set_type)
+    assert len(columns['code']) == len(reports)
+    for name in ('rating_1', 'rating_2', 'score', 'mirror', 'code'):
+        assert columns[name].tolist() == [getattr(r, name) for r in reports]
+    assert [str(p) for p in columns['player_1']] == [r.player_1 for r in reports]
+    civ_1, civ_2, map_type = utils.report_columns.unpack_code(columns['code'])
+    assert (civ_1 == columns['civ_1']).all() and (civ_2 == columns['civ_2']).all()
+
+def test_match_report_arrays_follow_data_file(tmp_path, monkeypatch):
+    with open(utils.solo_models.MatchReport.data_file('for_test')) as f:
+        rows = f.readlines()
+    monkeypatch.setattr(utils.solo_models, 'DATA_DIR', str(tmp_path))
+    data_file = utils.solo_models.MatchReport.data_file('test')
+    with open(data_file, 'w') as f:
+        f.writelines(rows[:5])
+    assert len(utils.solo_models.MatchReport.arrays('test')) == 5
+    with open(data_file, 'a') as f:
+        f.writelines(rows[5:])
+    # Older than the data file, as if built from the first rows a second before
+    for derived_file in (utils.solo_models.MatchReport.packed_file('test'), utils.solo_models.MatchReport.columns_file('test'),):
+        stat = os.stat(derived_file)
+        os.utime(derived_file, ns=(stat.st_atime_ns, stat.st_mtime_ns - 10**9))
+    assert len(utils.solo_models.MatchReport.arrays('test')) == len(rows)
+    reports = [r for r in utils.solo_models.MatchReport.all('test') if r.code is not None]
+    assert utils.solo_models.MatchReport.columns('test')['code'].tolist() == [r.code for r in reports]
@@ -5,12 +5,10 @@ import pathlib
 
 import pytest
 
+import utils.codec
 import utils.team_models
 
-@pytest.fixture(scope="session", autouse=True)
-def set_model_data_file_templates():
-    if not '/tests' in utils.team_models.DATA_DIR:
-        utils.team_models.DATA_DIR = utils.team_models.DATA_DIR.replace('/team-data', '/tests/team-data')
+pytestmark = pytest.mark.usefixtures('data_dirs')
 
 # Match
 def test_match_from_data():
@@ -222,8 +220,8 @@ def test_cache_best_rating():
     data_set_type = 'test_cache_best_rating'
     mincount = 3
     # remove cache file
-    if os.path.exists(utils.team_models.Player.rating_cache_file(data_set_type, mincount)):
-        os.remove(utils.team_models.Player.rating_cache_file(data_set_type, mincount))
+    if os.path.exists(utils.team_models.Player.rating_cache_file(data_set_type)):
+        os.remove(utils.team_models.Player.rating_cache_file(data_set_type))
     # Set up match report data
     match_reports = []
     match_reports.append(['1588091225', '9', '11:16', '10:103', 'foo:bar', '1:2', '0', '0'])
@@ -253,3 +251,35 @@ def test_cache_best_rating():
         elif player.player_id == 'bar':
             player.matches = []
             assert player.best_rating(mincount) == 1016
+
+def test_match_to_from_packed():
+    match_row = [ '15483707', '1586536235', '20', '34:24', '659:818', '1310102:1406544', '1:2', '8276',]
+    match = utils.team_models.Match.from_csv(match_row)
+    assert len(match.to_packed) == utils.codec.RECORD.size
+    assert match_row == [str(x) for x in utils.team_models.Match.from_packed(match.to_packed).to_csv]
+    # No version
+    match_row[7] = ''
+    match = utils.team_models.Match.from_csv(match_row)
+    assert match_row == [str(x) for x in utils.team_models.Match.from_packed(match.to_packed).to_csv]
+
+def test_all_packed():
+    data_set_type = 'for_test'
+    packed_file = utils.team_models.MatchReport.packed_file(data_set_type)
+    if os.path.exists(packed_file):
+        os.remove(packed_file)
+    from_csv = utils.team_models.MatchReport.all(data_set_type)
+    try:
+        arrays = utils.team_models.MatchReport.arrays(data_set_type)
+        assert len(arrays) == len(from_csv)
+        assert list(arrays['count']) == [len(r.players) for r in from_csv]
+        assert list(arrays['winner']) == [r.winner for r in from_csv]
+        from_packed = utils.team_models.MatchReport.all(data_set_type)
+        for packed, report in zip(from_packed, from_csv):
+            assert packed.timestamp == report.timestamp
+            assert packed.map == report.map
+            assert packed.players == report.players
+            assert packed.match_type == report.match_type
+            assert packed.winner == report.winner
+            assert packed.version == report.version
+    finally:
+        os.remove(packed_file)
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+import utils.windows
+
+def test_stepped_windows():
+    assert utils.windows.stepped_windows(10, 6, 2, 4) == [(0, 6), (2, 8), (4, 10), (6, 10)]
+
+@pytest.mark.parametrize('windows', [
+    [(0, 6), (2, 8), (4, 10), (6, 10)],
+    [(0, 2), (5, 7), (7, 10)],
+    [(0, 0), (0, 10), (10, 10)],
+    ])
+def test_sliding_sums(windows):
+    keys = np.array([0, 1, 1, 2, 0, 2, 2, 1, 0, 0])
+    values = np.array([1, .5, 0, 1, .25, 0, 1, 1, 0, .75])
+    sums, counts = utils.windows.sliding_sums(keys, values, 4, windows)
+    for idx, (start, end) in enumerate(windows):
+        for key in range(4):
+            in_window = keys[start:end] == key
+            assert counts[idx, key] == np.count_nonzero(in_window)
+            assert sums[idx, key] == pytest.approx(values[start:end][in_window].sum())
+
+def test_sliding_sums_backwards():
+    with pytest.raises(ValueError):
+        utils.windows.sliding_sums([0, 1], [1, 1], 2, [(1, 2), (0, 2)])
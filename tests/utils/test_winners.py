@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import utils.rating_store
+import utils.solo_models
+import utils.team_models
+import utils.winners
+
+@pytest.fixture(scope="session", autouse=True)
+def set_model_data_file_templates():
+    if not '/tests' in utils.solo_models.DATA_DIR:
+        utils.solo_models.DATA_DIR = utils.solo_models.DATA_DIR.replace('/data', '/tests/data')
+    if not '/tests' in utils.team_models.DATA_DIR:
+        utils.team_models.DATA_DIR = utils.team_models.DATA_DIR.replace('/team-data', '/tests/team-data')
+
+def table(rows):
+    """ RatingTable of (profile, old rating, timestamp, won state) rows. """
+    columns = {name: [0]*len(rows) for name in utils.rating_store.COLUMNS}
+    columns['old_rating'] = [row[1] for row in rows]
+    columns['timestamp'] = [row[2] for row in rows]
+    won_state = [utils.rating_store.WON_STATE_CODES[row[3]] for row in rows]
+    return utils.rating_store.RatingTable([row[0] for row in rows], columns, won_state)
+
+def test_player_states():
+    ratings = table([
+        (1, 1000, 1100, 'won'),
+        (1, 1000, 5000, 'lost'),
+        (2, 900, 1500, 'lost'),
+        (3, 800, 1100, 'won'),
+        (3, 800, 1200, 'lost'),
+        (4, 700, 1000, 'won'),
+        (5, 600, 1100, ''),
+        ])
+    states = utils.winners.player_states(ratings, [1, 1, 2, 2, 3, 4, 5, 6], [1000, 1000, 900, 901, 800, 700, 600, 1000],
+                                         [1000, 4000, 1000, 1000, 1000, 1000, 1000, 1000])
+    W, L, U = utils.winners.WON, utils.winners.LOST, utils.winners.UNKNOWN
+    # Too late, right rating; wrong rating; contradiction; not after start; no won state; no ratings
+    assert states.tolist() == [W, L, L, U, U, U, U, U]
+
+def test_team_winners():
+    W, L, U = utils.winners.WON, utils.winners.LOST, utils.winners.UNKNOWN
+    match_idx = [0, 0, 1, 1, 2, 2, 3, 3, 3, 4, 4]
+    teams =     [1, 2, 1, 2, 1, 2, 1, 1, 2, 1, 2]
+    states =    [L, W, W, U, U, U, W, L, U, W, W]
+    assert utils.winners.team_winners(match_idx, teams, states, 6).tolist() == [2, 1, 0, 0, 0, 0]
+
+@pytest.mark.parametrize('module', [utils.solo_models, utils.team_models])
+def test_match_winners_agree_with_determine_winner(module):
+    matches = module.Match.all()
+    profile_ids = set(p for match in matches for p in match.players if p.isdigit())
+    ratings = utils.rating_store.load(module.DATA_DIR, profile_ids, use_store=False)
+    expected = [match.determine_winner(module.Match, module.Rating) for match in matches]
+    assert utils.winners.match_winners(matches, ratings) == expected
+    assert any(expected)
@@ -0,0 +1,94 @@
+import concurrent.futures
+import csv
+import os
+
+import pytest
+
+import utils.solo_models
+import utils.writer
+
+def test_write_file(tmp_path):
+    path = '{}/matches_for_1.csv'.format(tmp_path)
+    utils.writer.write_file(path, ['a', 'b'], [[1, 2], [3, 4]])
+    with open(path) as f:
+        assert list(csv.reader(f)) == [['a', 'b'], ['1', '2'], ['3', '4']]
+    assert not os.path.exists('{}.tmp'.format(path))
+    assert utils.writer.expected_rows(path) == 2
+    assert utils.writer.verify(path)
+    # Rewriting replaces the manifest entry
+    utils.writer.write_file(path, ['a', 'b'], [[1, 2]])
+    assert utils.writer.expected_rows(path) == 1
+    assert utils.writer.verify(path)
+    with open(path, 'a') as f:
+        f.write('5,6\n')
+    assert not utils.writer.verify(path)
+    assert utils.writer.verify('{}/not_written.csv'.format(tmp_path)) is None
+
+def test_batch_writer(tmp_path):
+    paths = ['{}/ratings_for_{}.csv'.format(tmp_path, i) for i in range(5)]
+    with utils.writer.BatchWriter(batch_size=3) as writer:
+        for path in paths:
+            writer.add(path, ['x'], [[path]])
+        # First batch written when full, the rest waits for close
+        assert [os.path.exists(p) for p in paths] == [True, True, True, False, False]
+    assert all([utils.writer.verify(p) for p in paths])
+    with open(utils.writer.manifest_file(tmp_path)) as f:
+        assert len(f.readlines()) == 5
+    writer.add(paths[0], ['x'], [])
+    writer.close()
+    utils.writer.compact_manifest(str(tmp_path))
+    # The rewritten file keeps its previous entry too
+    with open(utils.writer.manifest_file(tmp_path)) as f:
+        assert len(f.readlines()) == 6
+    assert utils.writer.expected_rows(paths[0]) == 0
+    assert utils.writer.written_rows(paths[0]) == set([0, 1])
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+def test_truncated_file_is_not_trusted(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils.solo_models, 'DATA_DIR', str(tmp_path))
+    match_row = [ '9409809','1582654374','33','30','1132','242765','5','1158','1301032','0', ]
+    utils.writer.write_file(utils.solo_models.Match.data_file('1301032'), utils.solo_models.Match.header, [match_row, match_row])
+    assert len(utils.solo_models.Match.all_for('1301032')) == 2
+    with open(utils.solo_models.Match.data_file('1301032')) as f:
+        lines = f.readlines()
+    with open(utils.solo_models.Match.data_file('1301032'), 'w') as f:
+        f.writelines(lines[:-1])
+    with pytest.raises(RuntimeError):
+        utils.solo_models.Match.all_for('1301032')
+
+def test_batch_writer_calls_after_once_written(tmp_path):
+    path = '{}/matches_for_1.csv'.format(tmp_path)
+    written = []
+    with utils.writer.BatchWriter() as writer:
+        writer.add(path, ['x'], [[1]], lambda: written.append('first'))
+        writer.add(path, ['x'], [[2]], lambda: written.append(os.path.exists(path)))
+        assert written == []
+    # Only the callback of the add that was written
+    assert written == [True]
+
+def test_crash_before_rename_keeps_file_readable(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils.solo_models, 'DATA_DIR', str(tmp_path))
+    match_row = [ '9409809','1582654374','33','30','1132','242765','5','1158','1301032','0', ]
+    data_file = utils.solo_models.Match.data_file('1301032')
+    utils.writer.write_file(data_file, utils.solo_models.Match.header, [match_row])
+    def crash(*args):
+        raise OSError('crashed')
+    monkeypatch.setattr(os, 'replace', crash)
+    with pytest.raises(OSError):
+        utils.writer.write_file(data_file, utils.solo_models.Match.header, [match_row, match_row])
+    monkeypatch.undo()
+    monkeypatch.setattr(utils.solo_models, 'DATA_DIR', str(tmp_path))
+    # The new write is recorded but the file written before is still on disk
+    assert utils.writer.expected_rows(data_file) == 2
+    assert len(utils.solo_models.Match.all_for('1301032')) == 1
+
+def test_manifest_appends_from_processes(tmp_path):
+    paths = ['{}/ratings_for_{}.csv'.format(tmp_path, i) for i in range(40)]
+    with concurrent.futures.ProcessPoolExecutor(4) as executor:
+        list(executor.map(write_one, paths))
+    assert all([utils.writer.verify(p) for p in paths])
+    with open(utils.writer.manifest_file(tmp_path)) as f:
+        assert sorted(list(csv.reader(f))) == sorted([[os.path.basename(p), '1', utils.writer.manifest(str(tmp_path))[os.path.basename(p)][1]] for p in paths])
+
+def write_one(path):
+    utils.writer.write_file(path, ['x'], [[path]])
@@ -0,0 +1,75 @@
+""" Rating buckets shared by the popularity reports.
+
+A bucket is a (start, edge] range of ratings. Buckets may overlap and differ in width.
+Membership is found by binary search on values sorted once, so finer resolutions
+cost one search per bucket rather than a pass over every player. """
+
+import numpy as np
+
+# Edge of the open-ended top bucket
+TOP = 10000
+
+class Buckets:
+    """ An ordered list of (start, edge] rating ranges. """
+    def __init__(self, bounds):
+        self.bounds = [(start, edge,) for start, edge in bounds]
+        self.starts = np.array([start for start, _ in self.bounds])
+        self.edges = np.array([edge for _, edge in self.bounds])
+
+    def __iter__(self):
+        return iter(self.bounds)
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def __getitem__(self, idx):
+        return self.bounds[idx]
+
+    def keys(self, separator='-'):
+        """ Labels of the buckets, e.g. '601-650', with the open-ended top bucket as '1651+'. """
+        labels = []
+        for start, edge in self.bounds:
+            if edge >= TOP:
+                labels.append('{}+'.format(start + 1))
+            else:
+                labels.append('{}{}{}'.format(start + 1, separator, edge))
+        return labels
+
+    def ranges(self, sorted_values):
+        """ For values sorted ascending, the (lo, hi) slice of values within each bucket. """
+        sorted_values = np.asarray(sorted_values)
+        lo = np.searchsorted(sorted_values, self.starts, side='right')
+        hi = np.searchsorted(sorted_values, self.edges, side='right')
+        return list(zip(lo.tolist(), hi.tolist()))
+
+    def members(self, values):
+        """ For each bucket, the indices of values within it. """
+        values = np.asarray(values)
+        order = np.argsort(values, kind='stable')
+        return [order[lo:hi] for lo, hi in self.ranges(values[order])]
+
+def overlapping(edges, overlap=50):
+    """ Buckets ending at each edge, each starting overlap below the previous edge (the first at 0). """
+    bounds = []
+    start = 0
+    for edge in edges:
+        bounds.append((start, edge,))
+        start = edge - overlap
+    return Buckets(bounds)
+
+def steps(low, high, step=50, overlap=None, top=TOP):
+    """ Buckets with edges every step from low to high, plus an open-ended bucket up to top.
+    Each bucket overlaps the previous one by overlap (default step, i.e. buckets two steps wide). """
+    if overlap is None:
+        overlap = step
+    edges = list(range(low, high + 1, step))
+    if top:
+        edges.append(top)
+    return overlapping(edges, overlap)
+
+def everything():
+    """ A single bucket of every rating. """
+    return Buckets(((0, TOP,),))
+
+# The buckets used by the popularity reports
+RATINGS = steps(650, 1700)
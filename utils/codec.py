@@ -0,0 +1,95 @@
+""" Packed binary encoding of match records (up to 8 players), as an alternative to the
+colon-delimited csv columns used by team Match and MatchReport files.
+
+Each record is a fixed RECORD.size bytes:
+match id, started, map type, version (-1 if none), winning team (0 if unknown),
+number of players, then 8 slots each of civs, ratings, profile ids and teams
+(players ordered by profile id, unused slots zero). """
+
+import os
+import struct
+
+import numpy as np
+
+MAX_PLAYERS = 8
+
+RECORD = struct.Struct('<qqhibB{0}B{0}h{0}I{0}b'.format(MAX_PLAYERS))
+
+DTYPE = np.dtype([
+    ('match_id', '<i8'),
+    ('started', '<i8'),
+    ('map_type', '<i2'),
+    ('version', '<i4'),
+    ('winner', 'i1'),
+    ('count', 'u1'),
+    ('civs', 'u1', (MAX_PLAYERS,)),
+    ('ratings', '<i2', (MAX_PLAYERS,)),
+    ('ids', '<u4', (MAX_PLAYERS,)),
+    ('teams', 'i1', (MAX_PLAYERS,)),
+])
+
+_EMPTY = (0,)*MAX_PLAYERS
+
+def encode(match_id, started, map_type, version, winner, players):
+    """ Packs a record. players is a dict of profile id to {'civ', 'rating', 'team'}. """
+    count = len(players)
+    if count > MAX_PLAYERS:
+        raise ValueError('{} players do not fit in a record'.format(count))
+    ids = sorted(players)
+    pad = _EMPTY[count:]
+    civs = tuple(int(players[i]['civ']) for i in ids) + pad
+    ratings = tuple(int(players[i]['rating']) for i in ids) + pad
+    teams = tuple(int(players[i]['team']) for i in ids) + pad
+    if version is None or version == '':
+        version = -1
+    return RECORD.pack(int(match_id or 0), int(started), int(map_type), int(version), int(winner or 0), count,
+                       *civs, *ratings, *(tuple(int(i) for i in ids) + pad), *teams)
+
+def decode(values):
+    """ Unpacks the values of a record (as returned by RECORD.unpack or iter_unpack) into
+    (match id, started, map type, version, winner, players). """
+    match_id, started, map_type, version, winner, count = values[:6]
+    civs = values[6:6 + count]
+    ratings = values[6 + MAX_PLAYERS:6 + MAX_PLAYERS + count]
+    ids = values[6 + 2*MAX_PLAYERS:6 + 2*MAX_PLAYERS + count]
+    teams = values[6 + 3*MAX_PLAYERS:6 + 3*MAX_PLAYERS + count]
+    players = {}
+    for i in range(count):
+        players[str(ids[i])] = {'civ': civs[i], 'rating': ratings[i], 'team': teams[i]}
+    if version < 0:
+        version = ''
+    else:
+        version = str(version)
+    return match_id, started, map_type, version, winner, players
+
+def encode_row(row):
+    """ Packs a match record row (as written by Match.to_record). """
+    civs = row[2].split(':')
+    ratings = row[3].split(':')
+    ids = row[4].split(':')
+    teams = row[5].split(':')
+    players = {}
+    for i in range(len(civs)):
+        players[ids[i]] = {'civ': civs[i], 'rating': ratings[i], 'team': teams[i]}
+    return encode(0, row[0], row[1], row[7], row[6], players)
+
+def write(data_file, records):
+    """ Atomically writes packed records to data_file. """
+    tmp_file = '{}.tmp'.format(data_file)
+    with open(tmp_file, 'wb') as f:
+        for record in records:
+            f.write(record)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, data_file)
+
+def read(data_file):
+    """ Yields the decoded records in data_file. """
+    with open(data_file, 'rb') as f:
+        data = f.read()
+    for values in RECORD.iter_unpack(data):
+        yield decode(values)
+
+def load_arrays(data_file):
+    """ Returns all the records in data_file as a numpy structured array of DTYPE. """
+    return np.fromfile(data_file, dtype=DTYPE)
@@ -0,0 +1,31 @@
+""" Predicts how many new matches downloading a profile would add, to skip the matches files of
+profiles whose matches are already on disk in other players' files. Their ratings files are still
+downloaded, as the winners of those matches are found from them.
+
+A profile's leaderboard game count less the number of its matches already in indexed matches
+files (see utils.opponents.OpponentGraph.known_matches) estimates the matches its own file would
+add. Profiles without a game count (not on the leaderboard) cannot be estimated and are kept. """
+
+import numpy as np
+
+# Predicted new matches of a profile whose game count is unknown
+UNKNOWN = -1
+
+def predicted_new_matches(graph, profile_ids, game_counts, combine='sum'):
+    """ int64 array of the predicted new matches of each of profile_ids (int array), UNKNOWN
+    where game_counts (dict of int profile id to number of games) has no count. """
+    profile_ids = np.asarray(profile_ids, dtype=np.int64)
+    counts = np.array([game_counts.get(int(p), UNKNOWN) for p in profile_ids], dtype=np.int64)
+    predicted = np.maximum(counts - graph.known_matches(profile_ids, combine), 0)
+    return np.where(counts == UNKNOWN, UNKNOWN, predicted)
+
+def plan(graph, profile_ids, game_counts, min_new_matches=1, combine='sum'):
+    """ (profiles to download, most predicted new matches first and unknown last; profiles to skip,
+    with fewer than min_new_matches predicted), both int arrays. """
+    profile_ids = np.asarray(profile_ids, dtype=np.int64)
+    predicted = predicted_new_matches(graph, profile_ids, game_counts, combine)
+    skip = (predicted != UNKNOWN) & (predicted < min_new_matches)
+    keep = np.flatnonzero(~skip)
+    # Unknown (-1) sorts after every known prediction
+    order = keep[np.argsort(-predicted[keep], kind='stable')]
+    return profile_ids[order], profile_ids[skip]
@@ -0,0 +1,286 @@
+""" Shares the downloading of profiles among worker processes, on this or other hosts, through
+a shared SQLite file.
+
+The coordinator (the host running update()) adds the profiles to download to the tasks table
+and shards them among the live workers by profile id. Each worker claims its tasks one at a
+time, fetches the api pages of the task's files and stores them in the task. The coordinator
+collects finished tasks, parses their pages into the data files (as the download stages do)
+and writes them to the consolidated data directory, so workers need nothing but the api and the
+SQLite file. Workers record a heartbeat every HEARTBEAT seconds; once a worker has missed
+TIMEOUT seconds of them its unfinished tasks are sharded among the others.
+
+Workers on other hosts need the file on a filesystem with working locks. """
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+import utils.download
+import utils.download_stages
+
+HEARTBEAT = 5
+TIMEOUT = 30
+# Seconds a worker without tasks, or a coordinator waiting for them, waits before looking again
+POLL = 1
+# Tries of a task before it is given up on
+MAX_ATTEMPTS = 3
+# Seconds a coordinator with tasks left waits for a worker to join before giving up
+NO_WORKERS_TIMEOUT = 600
+
+PENDING = 'pending'
+CLAIMED = 'claimed'
+DONE = 'done'
+COLLECTED = 'collected'
+FAILED = 'failed'
+
+LIVE = 'live'
+DEAD = 'dead'
+STOPPED = 'stopped'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    position INTEGER PRIMARY KEY AUTOINCREMENT,
+    profile_id INTEGER UNIQUE NOT NULL,
+    kinds TEXT NOT NULL,
+    updating INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    pages TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, worker);
+CREATE TABLE IF NOT EXISTS workers (
+    name TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    heartbeat REAL NOT NULL
+);
+"""
+
+def connect(db_file):
+    """ Connection to db_file in autocommit mode, creating the tables if they are not there. """
+    connection = sqlite3.connect(db_file, timeout=60, isolation_level=None, check_same_thread=False)
+    connection.executescript(SCHEMA)
+    return connection
+
+def shard(profile_id, workers):
+    """ The worker (of a sorted list of names) whose shard profile_id is in. """
+    return workers[int(profile_id) % len(workers)]
+
+class Coordinator:
+    """ Hands the profiles of module to the workers of db_file and writes what they download. """
+    def __init__(self, db_file, module, timeout=TIMEOUT):
+        self.module = module
+        self.timeout = timeout
+        self.connection = connect(db_file)
+        self.lock = threading.Lock()
+
+    def submit(self, profile_ids, update=False, kinds=utils.download_stages.KINDS):
+        """ Adds the profiles to download the files of kinds of. Without update, files already on
+        disk are left alone. """
+        rows = []
+        for profile_id in profile_ids:
+            kinds_left = [kind for kind in kinds
+                          if update or not os.path.exists(utils.download_stages.data_file(self.module, kind, profile_id))]
+            if kinds_left:
+                rows.append((int(profile_id), ':'.join(kinds_left), int(update), PENDING,))
+        with self.lock:
+            # A profile submitted again is downloaded again
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.connection.executemany("""INSERT INTO tasks (profile_id, kinds, updating, state) VALUES (?, ?, ?, ?)
+                                           ON CONFLICT (profile_id) DO UPDATE SET kinds = excluded.kinds, updating = excluded.updating,
+                                           state = excluded.state, worker = NULL, attempts = 0, pages = NULL""", rows)
+            self.connection.execute('COMMIT')
+
+    def live_workers(self):
+        return [row[0] for row in self.connection.execute('SELECT name FROM workers WHERE state = ? ORDER BY name', (LIVE,))]
+
+    def reap(self, now=None):
+        """ Marks workers without a heartbeat for timeout seconds dead and returns their unfinished
+        tasks to be sharded again. Returns the names of the workers reaped. """
+        now = now or time.time()
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            dead = [row[0] for row in self.connection.execute('SELECT name FROM workers WHERE state = ? AND heartbeat < ?',
+                                                              (LIVE, now - self.timeout,))]
+            for name in dead:
+                self.connection.execute('UPDATE workers SET state = ? WHERE name = ?', (DEAD, name,))
+                self.connection.execute('UPDATE tasks SET state = ?, worker = NULL WHERE worker = ? AND state IN (?, ?)',
+                                        (PENDING, name, PENDING, CLAIMED,))
+            self.connection.execute('COMMIT')
+        return dead
+
+    def assign(self):
+        """ Shards the pending tasks without a worker among the live workers. Returns how many. """
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            workers = self.live_workers()
+            rows = self.connection.execute('SELECT profile_id FROM tasks WHERE state = ? AND worker IS NULL', (PENDING,)).fetchall()
+            if workers:
+                self.connection.executemany('UPDATE tasks SET worker = ? WHERE profile_id = ?',
+                                            [(shard(profile_id, workers), profile_id,) for profile_id, in rows])
+            self.connection.execute('COMMIT')
+        return len(rows) if workers else 0
+
+    def collect(self, writer):
+        """ Writes the files of finished tasks to writer (a BatchWriter). Returns how many tasks. """
+        rows = self.connection.execute('SELECT profile_id, kinds, updating, pages FROM tasks WHERE state = ? ORDER BY position',
+                                       (DONE,)).fetchall()
+        for profile_id, kinds, updating, pages in rows:
+            pages = json.loads(pages)
+            for kind in kinds.split(':'):
+                path, header, csv_rows, index_rows = utils.download_stages.parse(self.module.__name__, kind, str(profile_id),
+                                                                                bool(updating), pages[kind])
+                writer.add(path, header, csv_rows, utils.download_stages.index_appender(self.module.DATA_DIR, index_rows))
+            with self.lock:
+                self.connection.execute('UPDATE tasks SET state = ?, pages = NULL WHERE profile_id = ?', (COLLECTED, profile_id,))
+        return len(rows)
+
+    def counts(self):
+        """ dict of task state to number of tasks. """
+        return dict(self.connection.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state').fetchall())
+
+    def remaining(self):
+        counts = self.counts()
+        return counts.get(PENDING, 0) + counts.get(CLAIMED, 0) + counts.get(DONE, 0)
+
+    def run(self, writer, poll=POLL, no_workers_timeout=NO_WORKERS_TIMEOUT):
+        """ Reaps, shards and collects until every task is collected or has failed. Raises
+        RuntimeError if tasks are left and no worker has been live for no_workers_timeout seconds. """
+        waiting_since = None
+        while True:
+            self.reap()
+            self.assign()
+            self.collect(writer)
+            if not self.remaining():
+                break
+            if self.live_workers():
+                waiting_since = None
+            elif waiting_since is None:
+                waiting_since = time.time()
+                print('  Waiting for workers to download {} profiles'.format(self.remaining()))
+            elif time.time() - waiting_since > no_workers_timeout:
+                raise RuntimeError('No crawl workers for {} seconds with {} profiles left'.format(no_workers_timeout, self.remaining()))
+            time.sleep(poll)
+        failed = self.counts().get(FAILED, 0)
+        if failed:
+            print('  {} profiles failed to download'.format(failed))
+
+    def stop(self):
+        """ Tells every worker to exit. """
+        with self.lock:
+            self.connection.execute('UPDATE workers SET state = ? WHERE state = ?', (STOPPED, LIVE,))
+
+    def close(self):
+        self.connection.close()
+
+class Worker:
+    """ Downloads the tasks sharded to name (default host and process id) in db_file. """
+    def __init__(self, db_file, module, name=None, heartbeat=HEARTBEAT):
+        self.module = module
+        self.name = name or '{}-{}'.format(socket.gethostname(), os.getpid())
+        self.heartbeat = heartbeat
+        self.connection = connect(db_file)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def beat(self):
+        """ Records a heartbeat, rejoining the workers if this one was reaped. Returns whether to
+        keep working. """
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            row = self.connection.execute('SELECT state FROM workers WHERE name = ?', (self.name,)).fetchone()
+            if row and row[0] == STOPPED:
+                self.connection.execute('COMMIT')
+                return False
+            self.connection.execute('INSERT OR REPLACE INTO workers (name, state, heartbeat) VALUES (?, ?, ?)',
+                                    (self.name, LIVE, time.time(),))
+            self.connection.execute('COMMIT')
+        return True
+
+    def leave(self):
+        """ Removes this worker, returning the tasks sharded to it that it has not started. """
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.connection.execute('DELETE FROM workers WHERE name = ?', (self.name,))
+            self.connection.execute('UPDATE tasks SET worker = NULL WHERE worker = ? AND state = ?', (self.name, PENDING,))
+            self.connection.execute('COMMIT')
+
+    def claim(self):
+        """ (profile id, kinds, update) of the next task sharded to this worker, now claimed, or None. """
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            row = self.connection.execute("""SELECT profile_id, kinds, updating FROM tasks WHERE state = ? AND worker = ?
+                                             ORDER BY position LIMIT 1""", (PENDING, self.name,)).fetchone()
+            if row:
+                self.connection.execute('UPDATE tasks SET state = ?, attempts = attempts + 1 WHERE profile_id = ?', (CLAIMED, row[0],))
+            self.connection.execute('COMMIT')
+        if row:
+            return str(row[0]), row[1].split(':'), bool(row[2])
+        return None
+
+    def complete(self, profile_id, pages):
+        """ Stores the pages (dict of kind to list of page texts) of a claimed task. Returns False
+        if the task was taken from this worker meanwhile. """
+        with self.lock:
+            cursor = self.connection.execute('UPDATE tasks SET state = ?, pages = ? WHERE profile_id = ? AND worker = ? AND state = ?',
+                                             (DONE, json.dumps(pages), int(profile_id), self.name, CLAIMED,))
+        return cursor.rowcount == 1
+
+    def release(self, profile_id):
+        """ Gives a claimed task back, to be tried again, or failed after MAX_ATTEMPTS tries. """
+        with self.lock:
+            self.connection.execute("""UPDATE tasks SET state = CASE WHEN attempts < ? THEN ? ELSE ? END, worker = NULL
+                                       WHERE profile_id = ? AND worker = ? AND state = ?""",
+                                    (MAX_ATTEMPTS, PENDING, FAILED, int(profile_id), self.name, CLAIMED,))
+
+    def fetch(self, profile_id, kinds):
+        """ dict of kind to the api page texts of each of kinds of profile_id. """
+        pages = {}
+        for kind in kinds:
+            task = utils.download_stages.Task(kind, profile_id)
+            while True:
+                task.pages.append(utils.download.fetch(task.url(self.module), self.module, kind, profile_id))
+                if len(json.loads(task.pages[-1])) < utils.download.MAX_DOWNLOAD:
+                    break
+            pages[kind] = task.pages
+        return pages
+
+    def _beat(self):
+        while not self.stopped.wait(self.heartbeat):
+            if not self.beat():
+                self.stopped.set()
+
+    def run(self, poll=POLL, idle_limit=None):
+        """ Downloads tasks until the coordinator stops the workers, or, with idle_limit, until
+        there has been nothing to do for idle_limit seconds. """
+        if not self.beat():
+            return
+        self.stopped.clear()
+        heart = threading.Thread(target=self._beat, daemon=True)
+        heart.start()
+        idle_since = time.time()
+        try:
+            while not self.stopped.is_set():
+                task = self.claim()
+                if not task:
+                    if idle_limit is not None and time.time() - idle_since > idle_limit:
+                        break
+                    self.stopped.wait(poll)
+                    continue
+                profile_id, kinds, _ = task
+                try:
+                    pages = self.fetch(profile_id, kinds)
+                except (Exception, SystemExit) as e:
+                    # fetch exits on an api error; give the task back rather than the worker up
+                    print('  Failed to download {}: {!r}'.format(profile_id, e))
+                    self.release(profile_id)
+                else:
+                    self.complete(profile_id, pages)
+                idle_since = time.time()
+        finally:
+            self.stopped.set()
+            heart.join()
+            self.leave()
@@ -0,0 +1,136 @@
+""" Dominance graph of civs: which civs reliably beat which, the cycles in that relation and a ranking.
+
+Nodes are civ indices 0..n-1. adjacency[i, j] is True when civ i is superior to civ j. """
+
+from statistics import NormalDist
+
+import numpy as np
+
+def normal_interval(successes, totals, alpha=0.05):
+    """ Normal approximation confidence interval for successes/totals, elementwise
+    (as statsmodels' proportion_confint with the default method). NaN where totals is zero. """
+    successes = np.asarray(successes, dtype=float)
+    totals = np.asarray(totals, dtype=float)
+    z = NormalDist().inv_cdf(1 - alpha/2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = successes/totals
+        dist = z*np.sqrt(p*(1 - p)/totals)
+    return p - dist, p + dist
+
+def matchups(civs_1, civs_2, winners, weights, n_civs):
+    """ n_civs x n_civs matrices of weighted wins of each civ against each other civ and of
+    the number of matches between them. winners is 1 or 2 for the winning side (anything else
+    counts as played but not won); weights is the value of each win. """
+    civs_1 = np.asarray(civs_1, dtype=np.int64)
+    civs_2 = np.asarray(civs_2, dtype=np.int64)
+    winners = np.asarray(winners)
+    weights = np.asarray(weights, dtype=float)
+    wins = np.zeros((n_civs, n_civs))
+    totals = np.zeros((n_civs, n_civs), dtype=np.int64)
+    np.add.at(totals, (civs_1, civs_2), 1)
+    np.add.at(totals, (civs_2, civs_1), 1)
+    first = winners == 1
+    np.add.at(wins, (civs_1[first], civs_2[first]), weights[first])
+    second = winners == 2
+    np.add.at(wins, (civs_2[second], civs_1[second]), weights[second])
+    return wins, totals
+
+def adjacency(wins, totals, alpha=0.05):
+    """ adjacency[i, j] is True where the lower bound of civ i's win rate against civ j is over .5. """
+    cl, _ = np.asarray(normal_interval(np.minimum(wins, totals), totals, alpha))
+    superior = np.nan_to_num(cl, nan=0.0) > .5
+    np.fill_diagonal(superior, False)
+    return superior
+
+def strongly_connected_components(adj):
+    """ Strongly connected components of the graph (Tarjan's algorithm, without recursion).
+    Returns a list of lists of nodes, in reverse topological order. """
+    adj = np.asarray(adj, dtype=bool)
+    n = len(adj)
+    successors = [np.flatnonzero(row).tolist() for row in adj]
+    index = [None]*n
+    lowlink = [0]*n
+    on_stack = [False]*n
+    stack = []
+    components = []
+    counter = 0
+    for root in range(n):
+        if index[root] is not None:
+            continue
+        work = [(root, 0)]
+        while work:
+            node, child_idx = work.pop()
+            if child_idx == 0:
+                index[node] = lowlink[node] = counter
+                counter += 1
+                stack.append(node)
+                on_stack[node] = True
+            recursed = False
+            children = successors[node]
+            while child_idx < len(children):
+                child = children[child_idx]
+                child_idx += 1
+                if index[child] is None:
+                    work.append((node, child_idx))
+                    work.append((child, 0))
+                    recursed = True
+                    break
+                if on_stack[child]:
+                    lowlink[node] = min(lowlink[node], index[child])
+            if recursed:
+                continue
+            if lowlink[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(sorted(component))
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+    return components
+
+def cycles(adj, max_length=None, limit=None):
+    """ Simple cycles of the graph, each once, starting from its lowest node, of at most max_length
+    nodes and at most limit cycles in all. Only nodes in the same strongly connected component can
+    share a cycle, so the search never leaves the component of its start. """
+    adj = np.asarray(adj, dtype=bool)
+    found = []
+    for component in strongly_connected_components(adj):
+        if len(component) < 2:
+            continue
+        members = set(component)
+        successors = {node: [s for s in np.flatnonzero(adj[node]).tolist() if s in members] for node in component}
+        for start in component:
+            # Depth first search over nodes above start, with an explicit stack of successor iterators
+            path = [start]
+            on_path = {start}
+            iterators = [iter(successors[start])]
+            while iterators:
+                advanced = False
+                for successor in iterators[-1]:
+                    if successor == start:
+                        found.append(list(path))
+                        if limit and len(found) >= limit:
+                            return found
+                    elif successor > start and successor not in on_path and (not max_length or len(path) < max_length):
+                        path.append(successor)
+                        on_path.add(successor)
+                        iterators.append(iter(successors[successor]))
+                        advanced = True
+                        break
+                if not advanced:
+                    iterators.pop()
+                    on_path.discard(path.pop())
+    return found
+
+def ranking(adj):
+    """ Copeland ranking: nodes ordered by number of nodes they are superior to minus number superior
+    to them (ties by node). Returns a list of (node, score). """
+    adj = np.asarray(adj, dtype=bool)
+    scores = adj.sum(axis=1).astype(np.int64) - adj.sum(axis=0).astype(np.int64)
+    order = sorted(range(len(scores)), key=lambda i: (-scores[i], i))
+    return [(node, int(scores[node]),) for node in order]
@@ -5,6 +5,7 @@ import csv
 import json
 import concurrent.futures
 import functools
+import importlib
 import os
 import sys
 import pathlib
@@ -15,12 +16,45 @@ import time
 
 ROOT_DIR = pathlib.Path(__file__).parent.parent.absolute()
 
-import requests
-
+import utils.coverage
+import utils.crawl
+import utils.download_stages
+import utils.lazy
+import utils.match_index
+import utils.opponents
+import utils.profile_set
+import utils.raw_cache
 import utils.solo_models
 import utils.team_models
+import utils.writer
+
+requests = utils.lazy.module('requests')
 
 MAX_DOWNLOAD = 10000
+MATCHES_URL = 'https://aoe2.net/api/player/matches?game=aoe2de&profile_id={profile_id}&count={count}&start={start}'
+RATINGS_URL = 'https://aoe2.net/api/player/ratinghistory?start={start}&count={count}&game=aoe2de&leaderboard_id={lb}&profile_id={profile_id}'
+# Whether to keep the raw api pages for offline reprocessing (see replay)
+SAVE_RAW = False
+# Fewest predicted new matches for the crawl to download an opponent (see utils.coverage)
+MIN_NEW_MATCHES = 1
+# Concurrency of the download stages (see utils.download_stages); parse workers default to one per core
+FETCH_WORKERS = 8
+PARSE_WORKERS = None
+MAX_PENDING = 64
+# Seconds between reports of the stages' queue depths (None for none)
+METRICS_INTERVAL = 30
+# SQLite file through which workers download instead of the stages (see utils.crawl)
+COORDINATOR_DB = None
+
+def fetch(url, module, kind, profile_id):
+    """ Returns the text of an api page, saving it to the raw cache if SAVE_RAW. """
+    r = requests.get(url)
+    if r.status_code != 200:
+        print(r.text)
+        sys.exit(1)
+    if SAVE_RAW:
+        utils.raw_cache.store(module, kind, profile_id, r.text)
+    return r.text
 
 def users(module, force=False, write=True):
     User = module.User
@@ -28,7 +62,7 @@ def users(module, force=False, write=True):
     if os.path.exists(User.data_file()):
         if force:
             for u in User.all():
-                existing_users[u.profile_id] = u
+                existing_users[int(u.profile_id)] = u
         else:
             print('users.csv already exists')
             return
@@ -47,22 +81,20 @@ def users(module, force=False, write=True):
             records = d['total']
         for record in d['leaderboard']:
             added += 1
-            if record['profile_id'] in existing_users:
-                existing_users[record['profile_id']].update(record)
+            if int(record['profile_id']) in existing_users:
+                existing_users[int(record['profile_id'])].update(record)
             else:
                 u = User(record)
-                existing_users[u.profile_id] = u
+                existing_users[int(u.profile_id)] = u
         if added >= records:
             break
         start = MAX_DOWNLOAD + start
     if write:
-        with open(User.data_file(), 'w') as f:
-            csv.writer(f).writerows([User.header])
-            csv.writer(f).writerows([u.to_csv for u in existing_users.values()])
+        utils.writer.write_file(User.data_file(), User.header, [u.to_csv for u in existing_users.values()])
     return existing_users
 
-def matches(profile_id, module, update=False):
-    """ Downloads matches for a given profile"""
+def matches(profile_id, module, update=False, writer=None):
+    """ Downloads matches for a given profile. If writer (a BatchWriter) is given, the file is queued on it."""
     Match = module.Match
     data_file = Match.data_file(profile_id)
     r1v1 = {}
@@ -73,25 +105,27 @@ def matches(profile_id, module, update=False):
         else:
             print('  matches for {} already exists'.format(profile_id))
             return
-    url_template = 'https://aoe2.net/api/player/matches?game=aoe2de&profile_id={profile_id}&count={count}&start={start}'
     start = 1
     total = 0
 
     while True:
         print("  Downloading matches {} to {} for {}".format(start, start - 1 + MAX_DOWNLOAD, profile_id))
-        r = requests.get(url_template.format(start=start, count=MAX_DOWNLOAD, profile_id=profile_id))
-        if r.status_code != 200:
-            print(r.text)
-            sys.exit(1)
-
-        data = json.loads(r.text)
-        for match_data in data:
-            if match_data['leaderboard_id'] == module.leaderboard and module.num_player_check(match_data['num_players']):
-                match = Match(match_data)
-                r1v1[match.started] = match
+        data = json.loads(fetch(MATCHES_URL.format(start=start, count=MAX_DOWNLOAD, profile_id=profile_id), module, 'matches', profile_id))
+        add_matches(r1v1, data, module)
         if len(data) < MAX_DOWNLOAD:
             break
         start = MAX_DOWNLOAD + start
+    write_matches(profile_id, module, r1v1, writer)
+
+def add_matches(r1v1, data, module):
+    """ Adds the matches in a page of api data to r1v1, keyed by start time. """
+    for match_data in data:
+        if match_data['leaderboard_id'] == module.leaderboard and module.num_player_check(match_data['num_players']):
+            match = module.Match(match_data)
+            r1v1[match.started] = match
+
+def rated_matches(profile_id, r1v1):
+    """ The matches in r1v1 in which the profile has a rating, newest first. """
     matches = []
     for starting in sorted(r1v1, reverse=True):
         match = r1v1[starting]
@@ -103,13 +137,20 @@ def matches(profile_id, module, update=False):
         if not current_rating:
             continue
         matches.append(match)
-    with open(data_file, 'w') as f:
-        writer = csv.writer(f)
-        writer.writerow(Match.header)
-        writer.writerows([m.to_csv for m in matches])
+    return matches
 
-def ratings(profile_id, module, update=False):
-    """ Downloads ratings for a given profile """
+def write_matches(profile_id, module, r1v1, writer=None):
+    """ Writes the matches in r1v1 in which the profile has a rating, newest first. """
+    Match = module.Match
+    matches = rated_matches(profile_id, r1v1)
+    def record():
+        # The match index keeps the file's size and mtime, so only once it is written
+        utils.match_index.record(module.DATA_DIR, profile_id, matches)
+        utils.opponents.record(module.DATA_DIR, profile_id, matches)
+    write(Match.data_file(profile_id), Match.header, [m.to_csv for m in matches], writer, record)
+
+def ratings(profile_id, module, update=False, writer=None):
+    """ Downloads ratings for a given profile. If writer (a BatchWriter) is given, the file is queued on it."""
     Rating = module.Rating
     data_file = Rating.data_file(profile_id)
     r1v1 = {}
@@ -121,23 +162,25 @@ def ratings(profile_id, module, update=False):
         else:
             print('  ratings for {} already exists'.format(profile_id))
             return
-    url_template = 'https://aoe2.net/api/player/ratinghistory?start={start}&count={count}&game=aoe2de&leaderboard_id={lb}&profile_id={profile_id}'
     start = 1
     total = 0
     while True:
         print("  Downloading ratings {} to {} for {}".format(start, start - 1 + MAX_DOWNLOAD, profile_id))
-        r = requests.get(url_template.format(start=start, count=MAX_DOWNLOAD, lb=module.leaderboard, profile_id=profile_id))
-        if r.status_code != 200:
-            print(r.text)
-            sys.exit(1)
-
-        data = json.loads(r.text)
-        for rating_data in data:
-            rating = Rating(profile_id, rating_data)
-            r1v1[rating.timestamp] = rating
+        data = json.loads(fetch(RATINGS_URL.format(start=start, count=MAX_DOWNLOAD, lb=module.leaderboard, profile_id=profile_id), module, 'ratings', profile_id))
+        add_ratings(r1v1, profile_id, data, module)
         if len(data) < MAX_DOWNLOAD:
             break
         start = MAX_DOWNLOAD + start
+    write_ratings(profile_id, module, r1v1, writer)
+
+def add_ratings(r1v1, profile_id, data, module):
+    """ Adds the ratings in a page of api data to r1v1, keyed by timestamp. """
+    for rating_data in data:
+        rating = module.Rating(profile_id, rating_data)
+        r1v1[rating.timestamp] = rating
+
+def derive_ratings(r1v1):
+    """ Sets old rating and won state of the ratings in r1v1 from the one before each. """
     last_rating = None
     for rating in sorted(r1v1.values(), key=lambda x: x.timestamp):
         if last_rating:
@@ -147,10 +190,45 @@ def ratings(profile_id, module, update=False):
             elif rating.num_losses > last_rating.num_losses:
                 rating.won_state = 'lost'
         last_rating = rating
-    with open(data_file, 'w') as f:
-        writer = csv.writer(f)
-        writer.writerow(Rating.header)
-        writer.writerows([m.to_csv for m in r1v1.values()])
+
+def write_ratings(profile_id, module, r1v1, writer=None):
+    """ Derives old rating and won state from the sequence of ratings in r1v1 and writes them. """
+    Rating = module.Rating
+    derive_ratings(r1v1)
+    write(Rating.data_file(profile_id), Rating.header, [m.to_csv for m in r1v1.values()], writer)
+
+def write(data_file, header, rows, writer=None, after=None):
+    """ Queues the file on writer if there is one, otherwise writes it immediately. Either way atomically,
+    calling after() (if given) once it is written. """
+    if writer:
+        writer.add(data_file, header, rows, after)
+    else:
+        utils.writer.write_file(data_file, header, rows)
+        if after:
+            after()
+
+def replay_profile(profile_id, module_name):
+    """ Rebuilds the matches and ratings files of a profile from the raw cache. """
+    module = importlib.import_module(module_name)
+    if utils.raw_cache.digests(module, 'matches', profile_id):
+        r1v1 = {}
+        for data in utils.raw_cache.pages(module, 'matches', profile_id):
+            add_matches(r1v1, data, module)
+        write_matches(profile_id, module, r1v1)
+    if utils.raw_cache.digests(module, 'ratings', profile_id):
+        r1v1 = {}
+        for data in utils.raw_cache.pages(module, 'ratings', profile_id):
+            add_ratings(r1v1, profile_id, data, module)
+        write_ratings(profile_id, module, r1v1)
+    return profile_id
+
+def replay(module, chunksize=50):
+    """ Rebuilds all matches and ratings files from the raw cache without the network. """
+    profiles = utils.profile_set.ProfileSet(utils.raw_cache.profiles(module, 'matches')) | utils.raw_cache.profiles(module, 'ratings')
+    print('Replaying {} profiles'.format(len(profiles)))
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        for _ in executor.map(functools.partial(replay_profile, module_name=module.__name__), profiles.strs(), chunksize=chunksize):
+            pass
 
 def profiles_from_files(file_prefix, module):
     profile_pattern = re.compile(r'{}_for_([0-9]+)\.csv$'.format(file_prefix))
@@ -164,71 +242,138 @@ def profiles_from_files(file_prefix, module):
     return profiles
 
 def fetch_unchecked(profile_id, module, checked):
-    unchecked = set()
-    for match in module.Match.all_for(profile_id):
-        for player_id in match.players:
-            if not player_id in checked:
-                unchecked.add(player_id)
-    return unchecked
-
-def new_matches_and_ratings(to_check, checked, module):
+    """ ProfileSet of the players in the matches of profile_id that are not in checked. """
+    players = utils.profile_set.ProfileSet([player_id for match in module.Match.all_for(profile_id) for player_id in match.players])
+    return players - checked
+
+def new_matches_and_ratings(to_check, checked, module, writer, game_counts=None, coordinator=None):
+    """ Downloads the unchecked opponents of to_check, then theirs, and so on. to_check and checked
+    are ProfileSets; checked gains every profile downloaded or skipped. With game_counts (dict of
+    int profile id to leaderboard game count), the matches of profiles predicted to add fewer than
+    MIN_NEW_MATCHES matches are skipped and the rest downloaded most new matches first (see
+    utils.coverage). Skipped profiles still have their ratings downloaded, as the winners of their
+    matches are found from them. With coordinator (a utils.crawl.Coordinator), the crawl workers
+    download them. """
     print('Calling All Matches and Ratings')
     print('Checking {}, skipping {} profiles'.format(len(to_check), len(checked)))
-    to_download = set()
+    graph = utils.opponents.load(module.DATA_DIR)
+    indexed = graph.indexed(to_check.ids)
+    to_download = utils.profile_set.ProfileSet.from_sorted(graph.frontier(to_check.ids[indexed], checked.ids))
+    # Profiles whose matches were written before the opponents index existed
+    unindexed = [str(p) for p in to_check.ids[~indexed].tolist()]
     with concurrent.futures.ThreadPoolExecutor() as executor:
-        for unchecked in executor.map(functools.partial(fetch_unchecked, module=module, checked=checked), to_check):
+        for unchecked in executor.map(functools.partial(fetch_unchecked, module=module, checked=checked), unindexed):
             to_download.update(unchecked)
 
+    ordered = to_download.ids
+    skipped = ordered[:0]
+    if game_counts:
+        # Each match is in the file of every other player, so only 1v1 coverage can be summed
+        combine = 'sum' if module is utils.solo_models else 'max'
+        ordered, skipped = utils.coverage.plan(graph, to_download.ids, game_counts, MIN_NEW_MATCHES, combine)
+        print('Skipping {} profiles with matches already downloaded'.format(len(skipped)))
+        checked.update(skipped)
+        to_download = utils.profile_set.ProfileSet(ordered)
     print('Downloading {} profiles'.format(len(to_download)))
-    with concurrent.futures.ThreadPoolExecutor() as p:
-        p.map(functools.partial(both, module=module), to_download)
+    download_all([str(profile_id) for profile_id in ordered.tolist()], module, writer, coordinator=coordinator)
+    if len(skipped):
+        print('Downloading ratings of {} skipped profiles'.format(len(skipped)))
+        download_all([str(profile_id) for profile_id in skipped.tolist()], module, writer, kinds=('ratings',), coordinator=coordinator)
+    # Next round reads the files just downloaded
+    writer.flush()
     checked.update(to_download)
-    if to_download:
-        new_matches_and_ratings(to_download, checked, module)
+    if len(to_download):
+        new_matches_and_ratings(to_download, checked, module, writer, game_counts, coordinator)
+
+def download_all(profile_ids, module, writer, update=False, coordinator=None, kinds=utils.download_stages.KINDS):
+    """ Downloads the files of kinds (default matches and ratings) of profile_ids, in order, through
+    the download stages or, with coordinator (a utils.crawl.Coordinator), the crawl workers. """
+    if coordinator:
+        coordinator.submit(profile_ids, update, kinds)
+        coordinator.run(writer)
+        return
+    with utils.download_stages.Stages(module, writer, FETCH_WORKERS, PARSE_WORKERS, MAX_PENDING, METRICS_INTERVAL) as stages:
+        for profile_id in profile_ids:
+            stages.submit(profile_id, update, kinds)
 
-def both_force(profile_id, module):
-    matches(profile_id, module, True)
-    ratings(profile_id, module, True)
+def both_force(profile_id, module, writer=None):
+    matches(profile_id, module, True, writer)
+    ratings(profile_id, module, True, writer)
 
-def both(profile_id, module):
-    matches(profile_id, module)
-    ratings(profile_id, module)
+def both(profile_id, module, writer=None):
+    matches(profile_id, module, writer=writer)
+    ratings(profile_id, module, writer=writer)
 
 def reconcile(module):
-    match_ids = profiles_from_files('matches', module)
-    rating_ids = profiles_from_files('ratings', module)
-    for rating in rating_ids:
-        if rating not in match_ids:
-            matches(rating, module)
-    for match in match_ids:
-        if match not in rating_ids:
-            ratings(match, module)
+    match_ids = utils.profile_set.ProfileSet(profiles_from_files('matches', module))
+    rating_ids = utils.profile_set.ProfileSet(profiles_from_files('ratings', module))
+    for rating in (rating_ids - match_ids).strs():
+        matches(rating, module)
+    for match in (match_ids - rating_ids).strs():
+        ratings(match, module)
 
 def update(module):
-    file_profiles = profiles_from_files('ratings', module)
     # Sort by last modified, so files updated longest ago are updated first
+    file_order = {profile_id: idx for idx, profile_id in enumerate(profiles_from_files('ratings', module))}
     def priority(profile_id):
-        if profile_id not in file_profiles:
-            return 0
-        return file_profiles.index(profile_id)
+        return file_order.get(profile_id, 0)
     users(module, True)
     all_users = module.User.all()
     user_list = sorted([str(user.profile_id) for user in all_users if user.should_update], key=priority)
-    checked = set(profiles_from_files('matches', module))
+    checked = utils.profile_set.ProfileSet(profiles_from_files('matches', module))
     print('Downloading {} profiles'.format(len(user_list)))
-    with concurrent.futures.ThreadPoolExecutor() as p:
-        p.map(functools.partial(both_force, module=module), user_list)
-    downloaded = set([u.profile_id for u in all_users])
-    new_matches_and_ratings(downloaded, checked, module)
+    # One coordinator (and SQLite connection) for every round, stopping the workers at the end
+    coordinator = utils.crawl.Coordinator(COORDINATOR_DB, module) if COORDINATOR_DB else None
+    try:
+        with utils.writer.BatchWriter() as writer:
+            download_all(user_list, module, writer, update=True, coordinator=coordinator)
+            writer.flush()
+            downloaded = utils.profile_set.ProfileSet([u.profile_id for u in all_users])
+            game_counts = {int(u.profile_id): int(u.game_count) for u in all_users}
+            new_matches_and_ratings(downloaded, checked, module, writer, game_counts, coordinator)
+    finally:
+        if coordinator:
+            coordinator.stop()
+            coordinator.close()
+    utils.writer.compact_manifest(module.DATA_DIR)
+    utils.match_index.compact(module.DATA_DIR)
+    utils.opponents.compact(module.DATA_DIR)
 
 def run():
+    global SAVE_RAW, MIN_NEW_MATCHES, FETCH_WORKERS, PARSE_WORKERS, MAX_PENDING, METRICS_INTERVAL, COORDINATOR_DB
     parser = argparse.ArgumentParser()
     parser.add_argument('klass', choices=('team', 'solo',), help="team or solo")
+    parser.add_argument('--raw-cache', action='store_true', help="Save raw api pages for replay")
+    parser.add_argument('--replay', action='store_true', help="Rebuild data files from raw api pages instead of downloading")
+    parser.add_argument('--min-new-matches', type=int, default=MIN_NEW_MATCHES, help="Skip the matches (not ratings) of opponents predicted to add fewer new matches")
+    parser.add_argument('--fetch-workers', type=int, default=FETCH_WORKERS, help="Threads downloading api pages")
+    parser.add_argument('--parse-workers', type=int, default=PARSE_WORKERS, help="Processes parsing api pages (default one per core)")
+    parser.add_argument('--max-pending', type=int, default=MAX_PENDING, help="Most files in the download stages at once")
+    parser.add_argument('--metrics-interval', type=float, default=METRICS_INTERVAL, help="Seconds between reports of the download queues (0 for none)")
+    parser.add_argument('--coordinate', metavar='DB', help="Hand downloads to workers sharing this SQLite file")
+    parser.add_argument('--work', metavar='DB', help="Download for the coordinator sharing this SQLite file")
+    parser.add_argument('--rebuild-index', action='store_true', help="Rebuild the match and opponents indexes from the matches files")
     args = parser.parse_args()
+    SAVE_RAW = args.raw_cache
+    MIN_NEW_MATCHES = args.min_new_matches
+    FETCH_WORKERS = args.fetch_workers
+    PARSE_WORKERS = args.parse_workers
+    MAX_PENDING = args.max_pending
+    METRICS_INTERVAL = args.metrics_interval or None
+    COORDINATOR_DB = args.coordinate
     if args.klass == 'team':
-        update(utils.team_models)
+        module = utils.team_models
+    else:
+        module = utils.solo_models
+    if args.rebuild_index:
+        utils.match_index.rebuild(module)
+        utils.opponents.rebuild(module)
+    elif args.replay:
+        replay(module)
+    elif args.work:
+        utils.crawl.Worker(args.work, module).run()
     else:
-        update(utils.solo_models)
+        update(module)
 
 if __name__ == '__main__':
     run()
@@ -0,0 +1,314 @@
+""" Downloads profiles in stages connected by queues, to keep both the network and every core busy.
+
+Fetch threads download the api pages of each file (the matches or the ratings of a profile).
+A process pool parses the pages into the rows of the file, away from the fetch threads' GIL.
+A single writer thread queues the finished files on a BatchWriter and appends to the match and
+opponents indexes. A file that needs another page (its last page was full) goes back to the
+fetch threads.
+
+submit() takes a slot for every file and the writer gives it back, so at most max_pending files
+are in the stages at once. Every queue holds at least that many, so no stage ever waits on a
+full queue downstream, and submit() is the only place that waits for room. metrics() reports
+the depth of each queue and what each stage has done, and is written to METRICS_FILE while the
+stages run. """
+
+from collections import Counter
+import concurrent.futures
+import importlib
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+import utils.download
+import utils.match_index
+import utils.opponents
+
+KINDS = ('matches', 'ratings',)
+METRICS_FILE = 'download_metrics.json'
+
+def _pool_context():
+    # Forked workers see the module's data directory as this process has it
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return None
+
+def _ready():
+    return True
+
+class Task:
+    """ One file to download, with the api pages fetched for it so far. update merges them with
+    the file already on disk. """
+    def __init__(self, kind, profile_id, update=False):
+        self.kind = kind
+        self.profile_id = str(profile_id)
+        self.update = update
+        self.pages = []
+
+    def url(self, module):
+        start = len(self.pages)*utils.download.MAX_DOWNLOAD + 1
+        if self.kind == 'matches':
+            return utils.download.MATCHES_URL.format(start=start, count=utils.download.MAX_DOWNLOAD, profile_id=self.profile_id)
+        return utils.download.RATINGS_URL.format(start=start, count=utils.download.MAX_DOWNLOAD, lb=module.leaderboard, profile_id=self.profile_id)
+
+def data_file(module, kind, profile_id):
+    if kind == 'matches':
+        return module.Match.data_file(profile_id)
+    return module.Rating.data_file(profile_id)
+
+def parse(module_name, kind, profile_id, update, pages):
+    """ Runs in a worker process. None if the last of pages was full, so there are more to fetch;
+    otherwise (data file, header, rows, index rows) of the file the pages make, with the match and
+    opponents index rows of a matches file. """
+    module = importlib.import_module(module_name)
+    data = [json.loads(page) for page in pages]
+    if len(data[-1]) >= utils.download.MAX_DOWNLOAD:
+        return None
+    r1v1 = {}
+    if kind == 'matches':
+        if update and os.path.exists(module.Match.data_file(profile_id)):
+            for match in module.Match.all_for(profile_id):
+                r1v1[match.started] = match
+        for page in data:
+            utils.download.add_matches(r1v1, page, module)
+        matches = utils.download.rated_matches(profile_id, r1v1)
+        index_rows = [utils.match_index.row(profile_id, matches), utils.opponents.row(profile_id, matches)]
+        return module.Match.data_file(profile_id), module.Match.header, [m.to_csv for m in matches], index_rows
+    if update and os.path.exists(module.Rating.data_file(profile_id)):
+        for rating in module.Rating.all_for(profile_id):
+            r1v1[rating.timestamp] = rating
+    for page in data:
+        utils.download.add_ratings(r1v1, profile_id, page, module)
+    utils.download.derive_ratings(r1v1)
+    return module.Rating.data_file(profile_id), module.Rating.header, [r.to_csv for r in r1v1.values()], []
+
+def index_appender(data_dir, index_rows):
+    """ Function appending the index rows parse() gave to the indexes of data_dir (None if there are
+    none), to call once the matches file is written. """
+    if not index_rows:
+        return None
+    def append():
+        utils.match_index.append(data_dir, index_rows[0])
+        utils.opponents.append(data_dir, index_rows[1])
+    return append
+
+class Stages:
+    """ Fetch threads, parse processes and writer thread for the files of module, written to writer
+    (a BatchWriter). Use as a context manager: leaving it waits until every submitted file is
+    written. If a stage fails, the remaining files are dropped and RuntimeError raised. """
+    def __init__(self, module, writer, fetch_workers=8, parse_workers=None, max_pending=64, metrics_interval=None):
+        self.module = module
+        self.writer = writer
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers or os.cpu_count()
+        self.max_pending = max_pending
+        self.metrics_interval = metrics_interval
+        # Room for every file in the stages plus the end markers
+        self.fetch_queue = queue.Queue(max_pending + fetch_workers)
+        self.parse_queue = queue.Queue(max_pending + 1)
+        self.write_queue = queue.Queue(max_pending + 1)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        # Limits parses handed to the pool, so the backlog shows in the parse queue
+        self.parsing = threading.BoundedSemaphore(2*self.parse_workers)
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.pending = 0
+        self.in_pool = 0
+        self.counts = Counter()
+        self.error = None
+        # Set when the stages are left early, to drop the files still in them
+        self.cancelled = False
+        self.started = None
+        self.stopped = threading.Event()
+        self.executor = None
+        self.fetchers = []
+        self.threads = {}
+
+    def start(self):
+        self.started = time.time()
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.parse_workers, mp_context=_pool_context())
+        # Fork the workers before any of the stage threads exist
+        self.executor.submit(_ready).result()
+        self.fetchers = [self._thread(self._fetch) for _ in range(self.fetch_workers)]
+        self.threads = {'dispatch': self._thread(self._dispatch), 'write': self._thread(self._write)}
+        if self.metrics_interval:
+            self.threads['report'] = self._thread(self._report)
+        return self
+
+    def _thread(self, target):
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        return thread
+
+    def submit(self, profile_id, update=False, kinds=KINDS):
+        """ Queues the files of kinds (default matches and ratings) of profile_id, waiting while
+        max_pending files are in the stages. Without update, files already on disk are left alone. """
+        for kind in kinds:
+            if not update and os.path.exists(data_file(self.module, kind, profile_id)):
+                print('  {} for {} already exists'.format(kind, profile_id))
+                continue
+            while not self.slots.acquire(timeout=1):
+                self._check()
+            self._check()
+            with self.lock:
+                self.pending += 1
+            self.fetch_queue.put(Task(kind, profile_id, update))
+
+    def join(self):
+        """ Waits until every submitted file is written. """
+        with self.idle:
+            while self.pending and not self.error:
+                self.idle.wait()
+        self._check()
+
+    def close(self):
+        """ Stops the stages, after the files already in them. """
+        for _ in self.fetchers:
+            self.fetch_queue.put(None)
+        for thread in self.fetchers:
+            thread.join()
+        # The dispatcher ends the writer once the pool has parsed everything handed to it
+        self.parse_queue.put(None)
+        self.threads['dispatch'].join()
+        self.threads['write'].join()
+        self.stopped.set()
+        if 'report' in self.threads:
+            self.threads['report'].join()
+        self.executor.shutdown()
+        self.write_metrics()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, *args):
+        try:
+            if exc_type is None:
+                self.join()
+            else:
+                self.cancelled = True
+        finally:
+            self.close()
+        self._check()
+
+    def metrics(self):
+        """ dict of the depth of each queue and counts of what the stages have done. """
+        with self.lock:
+            metrics = dict(self.counts)
+            metrics['pending'] = self.pending
+            metrics['parsing'] = self.in_pool
+        metrics['fetch_queue'] = self.fetch_queue.qsize()
+        metrics['parse_queue'] = self.parse_queue.qsize()
+        metrics['write_queue'] = self.write_queue.qsize()
+        metrics['seconds'] = round(time.time() - self.started, 3)
+        return metrics
+
+    def metrics_file(self):
+        return '{}/{}'.format(self.module.DATA_DIR, METRICS_FILE)
+
+    def write_metrics(self):
+        tmp_file = '{}.tmp'.format(self.metrics_file())
+        with open(tmp_file, 'w') as f:
+            json.dump(self.metrics(), f, sort_keys=True)
+        os.replace(tmp_file, self.metrics_file())
+
+    def _dropping(self):
+        return self.error is not None or self.cancelled
+
+    def _check(self):
+        if self.error:
+            raise RuntimeError('Download stage failed: {!r}'.format(self.error))
+
+    def _fail(self, error):
+        with self.idle:
+            if not self.error:
+                self.error = error
+            self.idle.notify_all()
+
+    def _count(self, **counts):
+        with self.lock:
+            self.counts.update(counts)
+
+    def _finish(self, task):
+        self.slots.release()
+        with self.idle:
+            self.pending -= 1
+            self.idle.notify_all()
+
+    def _fetch(self):
+        while True:
+            task = self.fetch_queue.get()
+            if task is None:
+                break
+            if self._dropping():
+                self._finish(task)
+                continue
+            try:
+                text = utils.download.fetch(task.url(self.module), self.module, task.kind, task.profile_id)
+            except BaseException as e:
+                # fetch exits on an api error, which would otherwise just end this thread
+                self._fail(e)
+                self._finish(task)
+                continue
+            task.pages.append(text)
+            self._count(pages=1, bytes=len(text))
+            self.parse_queue.put(task)
+
+    def _dispatch(self):
+        while True:
+            task = self.parse_queue.get()
+            if task is None:
+                break
+            if self._dropping():
+                self._finish(task)
+                continue
+            self.parsing.acquire()
+            with self.lock:
+                self.in_pool += 1
+            future = self.executor.submit(parse, self.module.__name__, task.kind, task.profile_id, task.update, task.pages)
+            future.add_done_callback(lambda future, task=task: self._parsed(task, future))
+        # Wait for the parses in the pool before ending the writer
+        for _ in range(2*self.parse_workers):
+            self.parsing.acquire()
+        self.write_queue.put(None)
+
+    def _parsed(self, task, future):
+        with self.lock:
+            self.in_pool -= 1
+        try:
+            result = future.result()
+            if self._dropping():
+                self._finish(task)
+            elif result is None:
+                self._count(more_pages=1)
+                self.fetch_queue.put(task)
+            else:
+                self.write_queue.put((task, result))
+        except BaseException as e:
+            self._fail(e)
+            self._finish(task)
+        finally:
+            # Only once the result is queued, so the dispatcher cannot end the writer before it
+            self.parsing.release()
+
+    def _write(self):
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                break
+            task, (path, header, rows, index_rows) = item
+            try:
+                if not self._dropping():
+                    self.writer.add(path, header, rows, index_appender(self.module.DATA_DIR, index_rows))
+                    self._count(files=1, rows=len(rows))
+            except BaseException as e:
+                self._fail(e)
+            self._finish(task)
+
+    def _report(self):
+        while not self.stopped.wait(self.metrics_interval):
+            metrics = self.metrics()
+            print('  Stages: {} to fetch, {} to parse, {} parsing, {} to write; {} files written'.format(
+                metrics['fetch_queue'], metrics['parse_queue'], metrics['parsing'], metrics['write_queue'], metrics.get('files', 0)))
+            self.write_metrics()
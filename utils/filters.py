@@ -0,0 +1,63 @@
+""" Selects independent samples of match reports: each player, or each combination of players,
+used at most once.
+
+Selection is one greedy pass over the reports in a chosen order, checking players against a
+set, so it is linear in the number of reports. The *_indexes functions take the players of
+each match as rows (lists or a 2d array, e.g. columns of a columnar data set) and return an
+index array; the *_reports functions do the same for lists of reports. """
+
+import numpy as np
+
+def _order(n, order):
+    if order is None:
+        return range(n)
+    return np.asarray(order, dtype=np.int64).tolist()
+
+def _rows(players):
+    if isinstance(players, np.ndarray):
+        return players.tolist()
+    return players
+
+def unique_player_indexes(players, order=None):
+    """ Indexes of matches (rows of players) in which no player is in an earlier chosen match.
+    Matches are considered in order (an array of indexes) if given. """
+    rows = _rows(players)
+    used = set()
+    chosen = []
+    for idx in _order(len(rows), order):
+        row = rows[idx]
+        if used.isdisjoint(row):
+            used.update(row)
+            chosen.append(idx)
+    return np.array(chosen, dtype=np.int64)
+
+def unique_combo_indexes(players, order=None):
+    """ Indexes of matches (rows of players) whose combination of players is not that of an
+    earlier chosen match. Matches are considered in order (an array of indexes) if given. """
+    rows = _rows(players)
+    used = set()
+    chosen = []
+    for idx in _order(len(rows), order):
+        combo = frozenset(rows[idx])
+        if combo not in used:
+            used.add(combo)
+            chosen.append(idx)
+    return np.array(chosen, dtype=np.int64)
+
+def _report_order(reports, key):
+    if key is None:
+        return None
+    return sorted(range(len(reports)), key=lambda idx: key(reports[idx]))
+
+def unique_player_reports(reports, key=None):
+    """ Reports in which no player is in an earlier chosen report, going through reports sorted by key. """
+    reports = list(reports)
+    indexes = unique_player_indexes([list(report.players) for report in reports], _report_order(reports, key))
+    return [reports[idx] for idx in indexes]
+
+def unique_player_combo_reports(reports, key=None):
+    """ Reports whose players are not the same as those of an earlier chosen report, going through
+    reports sorted by key. """
+    reports = list(reports)
+    indexes = unique_combo_indexes([list(report.players) for report in reports], _report_order(reports, key))
+    return [reports[idx] for idx in indexes]
@@ -0,0 +1,36 @@
+""" Streams html heatmap tables straight to a file, with normalization done on whole arrays. """
+
+import numpy as np
+
+HEADER_CELL = '<th class="xlabel">{}</th>'
+CELL = '<td class="data" style="background-color: hsl({}, 100%, 60%)">{}</td>'
+
+def nth_largest(values, n):
+    """ The nth largest of values (as sorted(values, reverse=True)[n - 1], without the sort). """
+    values = np.asarray(values, dtype=float).ravel()
+    if not values.size:
+        return 0
+    n = min(max(n, 1), values.size)
+    return float(np.partition(values, values.size - n)[values.size - n])
+
+def normalize(values, max_value):
+    """ values as a fraction of max_value, capped at 1 (0 where values is 0). """
+    values = np.asarray(values, dtype=float)
+    if max_value <= 0:
+        return (values > 0).astype(float)
+    return np.minimum(values/max_value, 1)
+
+def hues(heat):
+    """ Hue of each normalized heat value: 240 (blue) for 0 to 0 (red) for 1. """
+    return (1 - np.asarray(heat, dtype=float))*240
+
+def write_table(f, heat, values, xlabels, ylabels, row_label_header):
+    """ Writes an html table with a row per ylabel and a column per xlabel, each cell colored by
+    heat (normalized 0-1) and showing values. Rows are written as they are formatted. """
+    f.write('<table>\n')
+    f.write(''.join(['<tr><th>{}</th>'.format(row_label_header)] + [HEADER_CELL.format(l) for l in xlabels] + ['</tr>']))
+    for ylabel, hue_row, value_row in zip(ylabels, hues(heat).tolist(), np.asarray(values).tolist()):
+        f.write('\n<tr><td class="ylabel">{}</td>'.format(ylabel))
+        f.write(''.join([CELL.format(hue, value) for hue, value in zip(hue_row, value_row)]))
+        f.write('</tr>')
+    f.write('\n</table>')
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+""" Measures how long each entry point takes to import in a fresh interpreter. """
+
+import argparse
+import pathlib
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = pathlib.Path(__file__).parent.parent.absolute()
+
+ENTRY_POINTS = (
+    'utils.models',
+    'utils.download',
+    'utils.sample',
+    'utils.monitor_download',
+    'civs.analyze',
+    'civs.flourish',
+    'civs.graphs',
+    'elo.analyze',
+    'elo.calculations',
+    'elo.graphs',
+)
+
+# Imported by every interpreter on startup
+STARTUP = ('site', 'encodings', 'codecs', 'io', 'abc',)
+
+def slowest(importtime_output, count=3, exclude=()):
+    """ (package, cumulative seconds) of the count slowest top level packages (other than exclude
+    and those of interpreter startup) in the output of python -X importtime. """
+    packages = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        if package in exclude or package in STARTUP or package.startswith('_'):
+            continue
+        packages[package] = max(packages.get(package, 0), int(cumulative)/1000000)
+    return sorted(packages.items(), key=lambda x: x[1], reverse=True)[:count]
+
+def import_time(statement, repeats=5, exclude=()):
+    """ (median seconds, slowest imports of the last run) for a new interpreter to run statement,
+    or (None, error) if it fails. """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], cwd=str(ROOT_DIR),
+                                capture_output=True, text=True)
+        times.append(time.perf_counter() - start)
+        if result.returncode:
+            return None, result.stderr.strip().splitlines()[-1]
+    return statistics.median(times), slowest(result.stderr, exclude=exclude)
+
+def report(modules, repeats):
+    baseline, _ = import_time('pass', repeats)
+    template = '{:22}: {:>8} {:>8}  {}'
+    print(template.format('Entry point', 'ms', '+ms', 'slowest packages (ms)'))
+    print(template.format('(interpreter)', int(baseline*1000), '', ''))
+    for module in modules:
+        seconds, detail = import_time('import {}'.format(module), repeats, (module.split('.')[0],))
+        if seconds is None:
+            print(template.format(module, 'failed', '', detail))
+            continue
+        imports = ', '.join(['{} {}'.format(package, int(cumulative*1000)) for package, cumulative in detail])
+        print(template.format(module, int(seconds*1000), int((seconds - baseline)*1000), imports))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('modules', nargs='*', default=ENTRY_POINTS, help="modules to import (default every entry point)")
+    parser.add_argument('--repeats', type=int, default=5, help="imports of each module to take the median of")
+    args = parser.parse_args()
+    report(args.modules, args.repeats)
@@ -0,0 +1,34 @@
+""" Stand-ins for modules that are imported only when first used.
+
+matplotlib, scipy, statsmodels and requests each take a good part of a second to import, and
+most commands of the scripts that use them (text reports, downloads from cached files, process
+pool workers) never touch them. """
+
+import importlib
+
+class LazyModule:
+    """ Looks up attributes on the module name, importing it on the first lookup. """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        # Only called for attributes not set in __init__
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return '<lazy module {}{}>'.format(self._name, '' if self._module is None else ' (imported)')
+
+def module(name):
+    """ Stand-in for `import name`. """
+    return LazyModule(name)
+
+def function(module_name, name):
+    """ Stand-in for `from module_name import name` of a function. """
+    lazy = LazyModule(module_name)
+    def call(*args, **kwargs):
+        return getattr(lazy, name)(*args, **kwargs)
+    call.__name__ = name
+    return call
@@ -0,0 +1,180 @@
+""" Persistent index of which profiles' matches files contain each match.
+
+Every match is downloaded once from the perspective of each of its players that is checked,
+so a match can be in several matches files, sometimes with different winners. Whenever a
+matches file is written, the downloader appends a row to the index of its directory with the
+profile id, the colon-delimited match ids and winners in the file, and the file's size and
+mtime. As with the writer's manifest, the latest row of a profile wins and compact() drops the
+rest.
+
+Duplicate and contradiction counts are then scans of the index, and Match.all() reads each
+match from only one file (its owner, the file of the lowest profile id containing it),
+skipping files that own no matches without opening them. Only files still as they were when
+indexed (see MatchIndex.current) are trusted; the rest are read in full. """
+
+from collections import Counter, defaultdict
+import csv
+import os
+import re
+import threading
+
+INDEX = 'match_index.csv'
+MATCH_FILE_PATTERN = re.compile(r'matches_for_([0-9]+)\.csv$')
+
+# Serializes appends from several download threads
+_index_lock = threading.Lock()
+# Parsed indexes by directory, with the index mtime and size they were read at
+_index_cache = {}
+
+def index_file(data_dir):
+    return '{}/{}'.format(data_dir, INDEX)
+
+def row(profile_id, matches):
+    """ Index row of the matches file of profile_id, for append(). """
+    return [profile_id, ':'.join([str(m.match_id) for m in matches]),
+            ':'.join([str(getattr(m, 'winner', 0) or 0) for m in matches])]
+
+def record(data_dir, profile_id, matches):
+    """ Records the matches now in the matches file of profile_id. """
+    append(data_dir, row(profile_id, matches))
+
+def data_file(data_dir, profile_id):
+    return '{}/matches_for_{}.csv'.format(data_dir, profile_id)
+
+def file_stat(data_dir, profile_id):
+    """ (size, mtime in ns) of the matches file of profile_id, None if there is none. """
+    try:
+        stat = os.stat(data_file(data_dir, profile_id))
+    except FileNotFoundError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns,)
+
+def append(data_dir, row):
+    """ Appends row (see row()) with the size and mtime its matches file has now, so call it once
+    the file is written. """
+    stat = file_stat(data_dir, row[0]) or ('', '',)
+    row = list(row) + list(stat)
+    with _index_lock:
+        with open(index_file(data_dir), 'a') as f:
+            csv.writer(f).writerow(row)
+
+def _split(value):
+    return value.split(':') if value else []
+
+class MatchIndex:
+    """ profiles is a dict of profile id to (list of match ids, list of winners) in its matches file,
+    stats a dict of profile id to (size, mtime in ns) of the file when it was indexed. """
+    def __init__(self, profiles=None, stats=None):
+        self.profiles = profiles if profiles is not None else {}
+        self.stats = stats if stats is not None else {}
+        self._perspectives = None
+
+    def current(self, data_dir):
+        """ MatchIndex of only the profiles whose matches files are still as they were indexed.
+        Files that are gone, rewritten without a new row or indexed without a stat are left out. """
+        stats = {profile_id: stat for profile_id, stat in self.stats.items()
+                 if profile_id in self.profiles and file_stat(data_dir, profile_id) == stat}
+        return MatchIndex({profile_id: self.profiles[profile_id] for profile_id in stats}, stats)
+
+    def perspectives(self):
+        """ dict of match id to list of (profile id, winner) of every file containing it. """
+        if self._perspectives is None:
+            perspectives = defaultdict(list)
+            for profile_id in sorted(self.profiles, key=int):
+                match_ids, winners = self.profiles[profile_id]
+                for match_id, winner in zip(match_ids, winners):
+                    perspectives[match_id].append((profile_id, winner))
+            self._perspectives = dict(perspectives)
+        return self._perspectives
+
+    def owned(self):
+        """ dict of profile id to the set of match ids its file is the first (by profile id) to contain. """
+        owned = {profile_id: set() for profile_id in self.profiles}
+        for match_id, perspectives in self.perspectives().items():
+            owned[perspectives[0][0]].add(match_id)
+        return owned
+
+    def duplicate_counts(self):
+        """ Counter of number of files a match is in to number of such matches. """
+        return Counter(len(perspectives) for perspectives in self.perspectives().values())
+
+    def winner_counts(self):
+        """ Counter of how the known winners of each match agree ('solo', 'confirmed' or
+        'contradictory') and of each combination of known winners (e.g. '1-1' or '1-2'). Matches
+        without a known winner are left out. """
+        ctr = Counter()
+        for perspectives in self.perspectives().values():
+            winners = sorted(int(winner) for _, winner in perspectives if int(winner))
+            if not winners:
+                continue
+            if len(winners) == 1:
+                ctr['solo'] += 1
+            elif len(set(winners)) == 1:
+                ctr['confirmed'] += 1
+            else:
+                ctr['contradictory'] += 1
+            ctr['-'.join([str(x) for x in winners])] += 1
+        return ctr
+
+def load(data_dir):
+    """ MatchIndex of data_dir (empty if there is no index). """
+    data_file = index_file(data_dir)
+    if not os.path.exists(data_file):
+        return MatchIndex()
+    stat = os.stat(data_file)
+    version = (stat.st_mtime_ns, stat.st_size,)
+    cached = _index_cache.get(data_dir)
+    if cached and cached[0] == version:
+        return cached[1]
+    profiles = {}
+    stats = {}
+    with open(data_file) as f:
+        for row in csv.reader(f):
+            if len(row) in (3, 5,):
+                profiles[row[0]] = (_split(row[1]), _split(row[2]))
+                stats.pop(row[0], None)
+                if len(row) == 5 and row[3]:
+                    stats[row[0]] = (int(row[3]), int(row[4]),)
+    index = MatchIndex(profiles, stats)
+    _index_cache[data_dir] = (version, index)
+    return index
+
+def _write(data_dir, profiles, stats):
+    data_file = index_file(data_dir)
+    tmp_file = '{}.tmp'.format(data_file)
+    with open(tmp_file, 'w') as f:
+        csv.writer(f).writerows([[profile_id, ':'.join(match_ids), ':'.join(winners)] + list(stats.get(profile_id, ('', '',)))
+                                 for profile_id, (match_ids, winners) in sorted(profiles.items())])
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, data_file)
+
+def compact(data_dir):
+    """ Rewrites the index keeping only the latest row of every profile. """
+    with _index_lock:
+        index = load(data_dir)
+        if index.profiles:
+            _write(data_dir, index.profiles, index.stats)
+
+def rebuild(module):
+    """ Rewrites the index of module's data directory from its matches files. """
+    profiles = {}
+    stats = {}
+    for filename in os.listdir(module.DATA_DIR):
+        m = MATCH_FILE_PATTERN.match(filename)
+        if m:
+            profile_id = m.group(1)
+            match_ids = []
+            winners = []
+            with open('{}/{}'.format(module.DATA_DIR, filename)) as f:
+                for row in csv.reader(f):
+                    try:
+                        match = module.Match.from_csv(row)
+                    except ValueError:
+                        continue
+                    match_ids.append(str(match.match_id))
+                    winners.append(str(getattr(match, 'winner', 0) or 0))
+            profiles[profile_id] = (match_ids, winners)
+            stats[profile_id] = file_stat(module.DATA_DIR, profile_id)
+    with _index_lock:
+        _write(module.DATA_DIR, profiles, stats)
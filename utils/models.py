@@ -6,22 +6,155 @@ from datetime import datetime
 import os
 import pathlib
 import re
-from statistics import median, stdev
 
 from utils.lookup import Lookup
+import utils.codec
+import utils.match_index
+import utils.rating_cache
+import utils.rating_store
+import utils.report_columns
+import utils.writer
 
 ROOT_DIR = pathlib.Path(__file__).parent.parent.absolute()
 
-LOOKUP = Lookup()
+# Read from strings.json the first time a report needs a name, not on import
+_lookup = None
+
+def lookup():
+    """ The Lookup shared by all reports. """
+    global _lookup
+    if _lookup is None:
+        _lookup = Lookup()
+    return _lookup
+
+def check_complete(data_file, row_count):
+    """ Raises RuntimeError if a downloaded file (header plus rows) has fewer or more rows than were written. """
+    expected = utils.writer.written_rows(data_file)
+    if expected and row_count - 1 not in expected:
+        raise RuntimeError('{} has {} rows but {} were written'.format(data_file, row_count - 1, utils.writer.expected_rows(data_file)))
+
+def out_of_date(derived_file, data_file):
+    """ Whether derived_file is missing or older than the data_file it was built from. """
+    return not os.path.exists(derived_file) or os.stat(derived_file).st_mtime < os.stat(data_file).st_mtime
+
+class MatchList(list):
+    """ A player's matches. Tells the player whenever it changes so derived data is rebuilt. """
+    def __init__(self, player, matches=()):
+        super().__init__(matches)
+        self.player = player
+
+    def append(self, match):
+        super().append(match)
+        self.player.matches_changed()
+
+    def extend(self, matches):
+        super().extend(matches)
+        self.player.matches_changed()
+
+    def insert(self, idx, match):
+        super().insert(idx, match)
+        self.player.matches_changed()
+
+    def remove(self, match):
+        super().remove(match)
+        self.player.matches_changed()
+
+    def pop(self, *args):
+        match = super().pop(*args)
+        self.player.matches_changed()
+        return match
+
+    def clear(self):
+        super().clear()
+        self.player.matches_changed()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.player.matches_changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.player.matches_changed()
+
+    def __iadd__(self, matches):
+        super().__iadd__(matches)
+        self.player.matches_changed()
+        return self
+
+    def __imul__(self, count):
+        super().__imul__(count)
+        self.player.matches_changed()
+        return self
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self.player.matches_changed()
+
+    def reverse(self):
+        super().reverse()
+        self.player.matches_changed()
+
+class MatchColumns:
+    """ A player's civ, rating, result, timestamp and map for every match, in match order. """
+    def __init__(self, player_id, matches):
+        self.civs = []
+        self.ratings = []
+        self.results = []
+        self.timestamps = []
+        self.maps = []
+        self.latest = None
+        latest_timestamp = None
+        for idx, m in enumerate(matches):
+            civ, rating, result = m.info_for(player_id)
+            self.civs.append(civ)
+            self.ratings.append(rating)
+            self.results.append(result)
+            self.timestamps.append(m.timestamp)
+            self.maps.append(m.map)
+            # Last of the matches sharing the latest timestamp, as a stable sort would give
+            if latest_timestamp is None or m.timestamp >= latest_timestamp:
+                latest_timestamp = m.timestamp
+                self.latest = idx
+        self.valid_ratings = [rating for rating in self.ratings if rating > 100]
+        self._timestamp_ratings = None
+
+    @property
+    def timestamp_ratings(self):
+        """ Valid ratings in timestamp order. """
+        if self._timestamp_ratings is None:
+            order = sorted(range(len(self.timestamps)), key=lambda i: self.timestamps[i])
+            self._timestamp_ratings = [self.ratings[i] for i in order if self.ratings[i] > 100]
+        return self._timestamp_ratings
 
 class Player:
     """ Holds information about a given player of the game (loaded from MatchReport data). """
     def __init__(self, player_id):
         self.player_id = player_id
-        self.matches = []
+        self._matches = MatchList(self)
+        self._columns = None
         self._best_ratings = {}
         self._best_stdevs = {}
 
+    @property
+    def matches(self):
+        return self._matches
+
+    @matches.setter
+    def matches(self, matches):
+        self._matches = MatchList(self, matches)
+        self.matches_changed()
+
+    def matches_changed(self):
+        """ Called whenever matches changes. Cached best ratings are kept, as they may come from the rating cache. """
+        self._columns = None
+
+    @property
+    def columns(self):
+        """ Per-match data, calculated once for the current matches. """
+        if self._columns is None:
+            self._columns = MatchColumns(self.player_id, self._matches)
+        return self._columns
+
     def best_stdev(self, mincount):
         if not self._best_stdevs[mincount]:
             self.best_rating(mincount)
@@ -34,29 +167,19 @@ class Player:
         if key in self._best_ratings:
             return self._best_ratings[key]
 
-        if len(self.ratings) < mincount*1.5:
+        best, best_std = utils.rating_cache.best_rating(self.ratings, mincount)
+        if best is None:
             return
-
-        sorted_ratings = sorted(self.ratings)
-        best_group = sorted_ratings[:mincount]
-        best_std = stdev(best_group)
-        for i in range(1, len(sorted_ratings) - mincount + 1):
-            test_group = sorted_ratings[i:i+mincount]
-            test_std = stdev(test_group)
-            if test_std <= best_std:
-                best_group = test_group
-                best_std = test_std
-        best = median(best_group)
         self._best_ratings[key] = best # cache the calculation
         self._best_stdevs[key] = best_std # cache the calculation
         return best
 
     def add_civ_percentages(self, ctr, map_name, start, edge):
-        """ Proportionally adds civs within range to ctr. """
+        """ Proportionally adds civs within range to ctr. For many players see utils.popularity. """
+        columns = self.columns
         civ_ctr = Counter()
-        for m in self.matches:
-            civ, rating, _ = m.info_for(self.player_id)
-            if start < rating <= edge and (map_name == 'all' or m.map == map_name):
+        for civ, rating, map_played in zip(columns.civs, columns.ratings, columns.maps):
+            if start < rating <= edge and (map_name == 'all' or map_played == map_name):
                 civ_ctr[civ] += 1
         total = float(sum(civ_ctr.values()))
         for civ, count in civ_ctr.items():
@@ -64,14 +187,14 @@ class Player:
         return bool(civ_ctr)
 
     def add_win_percentages(self, win_ctr, total_ctr, map_name, start, edge):
-        """ Proportionally adds civs within range to ctr. """
+        """ Proportionally adds civs within range to ctr. For many players see utils.popularity. """
+        columns = self.columns
         win_civ_ctr = Counter()
         total_civ_ctr = Counter()
-        for m in self.matches:
-            civ, rating, winner = m.info_for(self.player_id)
+        for civ, rating, winner, map_played in zip(columns.civs, columns.ratings, columns.results, columns.maps):
             if winner == 'na':
                 continue
-            if start < rating <= edge and (map_name == 'all' or m.map == map_name):
+            if start < rating <= edge and (map_name == 'all' or map_played == map_name):
                 total_civ_ctr[civ] += 1
                 if winner == 'won':
                     win_civ_ctr[civ] += 1
@@ -83,62 +206,48 @@ class Player:
         return bool(total_civ_ctr)
 
     def add_map_percentages(self, ctr, start, edge):
-        """ Proportionally adds maps within range to ctr. """
+        """ Proportionally adds maps within range to ctr. For many players see utils.popularity. """
+        columns = self.columns
         map_ctr = Counter()
-        for m in self.matches:
-            _, rating, _ = m.info_for(self.player_id)
+        for rating, map_played in zip(columns.ratings, columns.maps):
             if start < rating <= edge:
-                map_ctr[m.map] += 1
+                map_ctr[map_played] += 1
         total = float(sum(map_ctr.values()))
         for m, count in map_ctr.items():
             ctr[m] += count/total
         return bool(map_ctr)
 
     def ordered_ratings(self, ordering):
-        r = []
         if ordering == 'timestamp':
-            matches = sorted(self.matches, key=lambda x: x.timestamp)
-        else:
-            return self.ratings
-        for m in matches:
-            _, rating, _ = m.info_for(self.player_id)
-            r.append(rating)
-        return [rating for rating in r if rating > 100]
+            return self.columns.timestamp_ratings
+        return self.ratings
 
     @property
     def ratings(self):
-        r = []
-        for m in self.matches:
-            _, rating, _ = m.info_for(self.player_id)
-            r.append(rating)
-        return [rating for rating in r if rating > 100]
+        return self.columns.valid_ratings
 
     @property
     def latest_match(self):
         if not self.matches:
             return None
-        return sorted(self.matches, key=lambda x: x.timestamp)[-1]
+        return self.matches[self.columns.latest]
 
     @property
     def latest_rating(self):
         if not self.matches:
             return None
-        m = self.latest_match
-        _, rating, _ = m.info_for(self.player_id)
-        return rating
+        return self.columns.ratings[self.columns.latest]
 
     @property
     def latest_civ(self):
         if not self.matches:
             return None
-        m = self.latest_match
-        civ, _, _ = m.info_for(self.player_id)
-        return civ
+        return self.columns.civs[self.columns.latest]
 
     @property
     def maps(self):
         """ List of all maps played by this player. """
-        return set([m.map for m in self.matches])
+        return set(self.columns.maps)
 
     def rated_players(matches, mincount):
         return [p for p in Player.player_values(matches) if p.best_rating(mincount)]
@@ -150,18 +259,14 @@ class Player:
         if include_ratings in ('test', 'model', 'verification',):
             include_ratings = ((include_ratings, 5,),)
 
-        cached_ratings = defaultdict(lambda: {})
+        cached_ratings = {}
+        cache_lookups = {}
         for cache_pair in include_ratings:
             data_set_type, mincount = cache_pair
-            cache_file = module.Player.rating_cache_file(data_set_type, mincount)
-            if not os.path.exists(cache_file):
-                continue
-            with open(cache_file) as f:
-                for l in f:
-                    player_id, rating = l.strip().split(',')
-                    if rating == 'None':
-                        continue
-                    cached_ratings[cache_pair][player_id] = int(rating)
+            if data_set_type not in cache_lookups:
+                cache_lookups[data_set_type] = utils.rating_cache.best_ratings(module.Player.rating_cache_file(data_set_type))
+            if mincount in cache_lookups[data_set_type]:
+                cached_ratings[cache_pair] = cache_lookups[data_set_type][mincount]
         player_dict = {}
         for match in matches:
             for player_id in match.players:
@@ -176,34 +281,44 @@ class Player:
         return player_dict.values()
 
     def cache_player_ratings(module, data_set_type, mincount):
-        """ Calculate player ratings at mincount and write to cache.
-        n.b. overwrites existing cache. """
-        players = module.Player.player_values(module.MatchReport.all(data_set_type))
-        data_file = module.Player.rating_cache_file(data_set_type, mincount)
-        with open(data_file, 'w') as f:
-            for player in players:
-                best_rating = player.best_rating(mincount)
-                if best_rating:
-                    f.write('{},{}\n'.format(player.player_id, best_rating))
+        """ Brings the rating cache up to date with the data set's reports, recalculating players at
+        mincount only where their reports have changed (see utils.rating_cache). """
+        utils.rating_cache.update(module.Player.rating_cache_file(data_set_type),
+                                  module.MatchReport.data_file(data_set_type), (mincount,))
 
 class MatchReport():
     """ Holds match information from both players' perspective (loaded from Match records). """
     def __init__(self, row):
-        self.timestamp = int(row[0])
-        self.map = LOOKUP.map_name(row[1])
-        self.players = {}
         civs = row[2].split(':')
         ratings = row[3].split(':')
         ids = row[4].split(':')
         teams = row[5].split(':')
+        players = {}
         for i in range(len(civs)):
-            self.players[ids[i]] = { 'civ': LOOKUP.civ_name(civs[i]), 'rating': int(ratings[i]), 'team': int(teams[i]) }
+            players[ids[i]] = { 'civ': civs[i], 'rating': ratings[i], 'team': teams[i] }
+        self.load(int(row[0]), row[1], players, int(row[6]), row[7])
+
+    def load(self, timestamp, map_type, players, winner, version):
+        """ Sets attributes from map and civ codes and players dict of id to civ, rating and team codes. """
+        names = lookup()
+        self.timestamp = timestamp
+        self.map = names.map_name(map_type)
+        self.players = {}
         team_ctr = Counter()
-        for team in teams:
+        for player_id, data in players.items():
+            team = int(data['team'])
+            self.players[player_id] = { 'civ': names.civ_name(data['civ']), 'rating': int(data['rating']), 'team': team }
             team_ctr[team] += 1
         self.match_type = 'v'.join([str(i) for i in sorted(team_ctr.values())])
-        self.winner = int(row[6])
-        self.version = row[7]
+        self.winner = winner
+        self.version = version
+
+    def from_packed(klass, values):
+        """ Builds a report from the values of a packed record (see utils.codec). """
+        _, started, map_type, version, winner, players = utils.codec.decode(values)
+        report = klass.__new__(klass)
+        report.load(started, map_type, players, winner, version)
+        return report
 
     def info_for(self, player_id):
         player_id = str(player_id)
@@ -219,20 +334,52 @@ class MatchReport():
         return player['civ'], player['rating'], winner
 
     def all(klass, data_set_type):
+        """ All reports in a data set, read from the packed file if it is up to date. """
+        packed_file = klass.packed_file(data_set_type)
+        if not out_of_date(packed_file, klass.data_file(data_set_type)):
+            with open(packed_file, 'rb') as f:
+                return [MatchReport.from_packed(klass, values) for values in utils.codec.RECORD.iter_unpack(f.read())]
         reports = []
         with open(klass.data_file(data_set_type)) as f:
             reader = csv.reader(f)
             for row in reader:
-                reports.append(MatchReport(row))
+                reports.append(klass(row))
         return reports
 
+    def write_packed(klass, data_set_type):
+        """ Writes the packed version of a data set's csv file. """
+        with open(klass.data_file(data_set_type)) as f:
+            utils.codec.write(klass.packed_file(data_set_type), [utils.codec.encode_row(row) for row in csv.reader(f)])
+
+    def arrays(klass, data_set_type):
+        """ The packed data set as a numpy structured array (see utils.codec.DTYPE), rebuilt if out of date. """
+        if out_of_date(klass.packed_file(data_set_type), klass.data_file(data_set_type)):
+            klass.write_packed(data_set_type)
+        return utils.codec.load_arrays(klass.packed_file(data_set_type))
+
+    def write_columns(klass, data_set_type):
+        """ Writes the fields derived from the two players of each report in the packed data set (see utils.report_columns). """
+        utils.report_columns.write(klass.columns_file(data_set_type), utils.report_columns.columns(klass.arrays(data_set_type)))
+
+    def columns(klass, data_set_type):
+        """ dict of column name to array of the derived two player fields of a data set, rebuilt with the packed file if out of date. """
+        columns_file = klass.columns_file(data_set_type)
+        if out_of_date(columns_file, klass.data_file(data_set_type)):
+            klass.write_packed(data_set_type)
+        return utils.report_columns.read(columns_file)
+
+    def by_rating(klass, data_set_type, lower, upper):
+        """ Reports with any player rated at least lower and less than upper. """
+        return [report for report in klass.all(data_set_type)
+                if any(lower <= p['rating'] < upper for p in report.players.values())]
+
     def by_map(klass, data_set_type, map_type):
         reports = []
         with open(klass.data_file(data_set_type)) as f:
             reader = csv.reader(f)
             for row in reader:
                 if row[1] == str(map_type):
-                    reports.append(MatchReport(row))
+                    reports.append(klass(row))
         return reports
 
     def by_map_and_rating(klass, data_set_type, map_type, lower, upper):
@@ -258,32 +405,54 @@ class Match():
         if not os.path.exists(data_file):
             raise RuntimeError('No match data available for {}'.format(profile_id))
         matches = []
+        row_count = 0
         with open(data_file) as f:
             reader = csv.reader(f)
             for row in reader:
+                row_count += 1
                 try:
                     matches.append(klass.from_csv(row))
                 except ValueError:
                     pass
+        check_complete(data_file, row_count)
         return matches
 
     def all(module, include_duplicates=False):
-        """ Returns all matches for all users, with duplicates removed """
-        data_file_pattern = re.compile(r'matches_for_[0-9]+\.csv$')
+        """ Returns all matches for all users, with duplicates removed. Matches in the match index
+        are only read from the file that owns them (see utils.match_index); files changed since they
+        were indexed are read in full. """
+        data_file_pattern = re.compile(r'matches_for_([0-9]+)\.csv$')
         data_dir = module.DATA_DIR
+        owned = {} if include_duplicates else utils.match_index.load(data_dir).current(data_dir).owned()
         matches = []
         match_ids = set()
+        for file_ids in owned.values():
+            match_ids |= file_ids
+        # Owned matches read so far, as a file can hold a match more than once
+        owned_read = set()
         for filename in os.listdir(data_dir):
-            if data_file_pattern.match(filename):
-                with open('{}/{}'.format(data_dir, filename)) as f:
-                    reader = csv.reader(f)
-                    for row in reader:
-                        if include_duplicates or row[0] not in match_ids:
-                            match_ids.add(row[0])
-                            try:
-                                matches.append(module.Match.from_csv(row))
-                            except ValueError:
-                                pass
+            m = data_file_pattern.match(filename)
+            if not m:
+                continue
+            file_ids = owned.get(m.group(1))
+            if file_ids is not None and not file_ids:
+                # Every match in the file is read from another one
+                continue
+            with open('{}/{}'.format(data_dir, filename)) as f:
+                reader = csv.reader(f)
+                for row in reader:
+                    if file_ids is not None:
+                        if row[0] not in file_ids or row[0] in owned_read:
+                            continue
+                        owned_read.add(row[0])
+                    elif not include_duplicates:
+                        if row[0] in match_ids:
+                            continue
+                        match_ids.add(row[0])
+                    try:
+                        matches.append(module.Match.from_csv(row))
+                    except ValueError:
+                        pass
         return matches
 
     def player_won_state(rating_klass, profile_id, rating, started):
@@ -323,8 +492,8 @@ class Match():
             return winners[0]
         return 0
 
-    def to_record(self, klass, rating_klass):
-        """ Outputs self as record for analysis.
+    def to_record(self, klass, rating_klass, winning_team=None):
+        """ Outputs self as record for analysis, determining the winning team unless it is given (see utils.winners).
         timestamp
         map code
         colon-delimited civilization codes
@@ -334,7 +503,8 @@ class Match():
         winning team
         version
         """
-        winning_team = self.determine_winner(klass, rating_klass)
+        if winning_team is None:
+            winning_team = self.determine_winner(klass, rating_klass)
 
         ids = []
         civs = []
@@ -384,15 +554,22 @@ class Rating():
         if not os.path.exists(data_file):
             raise RuntimeError('No rating data available for', profile_id)
         ratings = []
+        row_count = 0
         with open(data_file) as f:
             reader = csv.reader(f)
             for row in reader:
+                row_count += 1
                 try:
                     ratings.append(klass.from_csv(row))
                 except ValueError:
                     pass
+        check_complete(data_file, row_count)
         return ratings
 
+    def table(module, profile_ids=None, workers=None):
+        """ Ratings of many profiles (all by default) as a utils.rating_store.RatingTable. """
+        return utils.rating_store.load(module.DATA_DIR, profile_ids, workers)
+
     def lookup_for(klass, profile_id):
         lookup = defaultdict(lambda:[])
         for rating in klass.all_for(profile_id):
@@ -0,0 +1,196 @@
+""" Persistent index of the opponents of every downloaded profile, as integer arrays.
+
+Whenever the downloader writes a matches file it appends a row to the opponents index of its
+directory with the profile id, the colon-delimited ids of everyone else in its matches and the
+number of matches each is in. As with the match index, the latest row of a profile wins and
+compact() drops the rest.
+
+load() gives an OpponentGraph: the profiles in compressed sparse rows (sorted profile ids,
+offsets, and opponent ids), so finding the next profiles to download is set arithmetic on
+integer arrays rather than parsing every matches file again. """
+
+from collections import Counter
+import csv
+import os
+import re
+import threading
+
+import numpy as np
+
+INDEX = 'opponents.csv'
+MATCH_FILE_PATTERN = re.compile(r'matches_for_([0-9]+)\.csv$')
+
+# Serializes appends from several download threads
+_index_lock = threading.Lock()
+# Parsed graphs by directory, with the index mtime and size they were read at
+_graph_cache = {}
+
+def index_file(data_dir):
+    return '{}/{}'.format(data_dir, INDEX)
+
+def opponents(profile_id, matches):
+    """ dict of the id of everyone but profile_id in matches to the number of matches they are in. """
+    found = Counter()
+    for match in matches:
+        found.update([p for p in match.players if p.isdigit()])
+    del found[str(profile_id)]
+    return dict(found)
+
+def _row(profile_id, found):
+    ids = sorted(found, key=int)
+    return [profile_id, ':'.join(ids), ':'.join([str(found[i]) for i in ids])]
+
+def record(data_dir, profile_id, matches):
+    """ Records the opponents of profile_id in the matches now in its matches file. """
+    append(data_dir, row(profile_id, matches))
+
+def row(profile_id, matches):
+    """ Index row of the opponents of profile_id in matches, for append(). """
+    return _row(profile_id, opponents(profile_id, matches))
+
+def append(data_dir, row):
+    with _index_lock:
+        with open(index_file(data_dir), 'a') as f:
+            csv.writer(f).writerow(row)
+
+class OpponentGraph:
+    """ profiles (sorted int64), and the opponents of profiles[i] in neighbors[offsets[i]:offsets[i + 1]],
+    with the number of the profile's matches each is in in weights. """
+    def __init__(self, profiles, offsets, neighbors, weights=None):
+        self.profiles = profiles
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.weights = weights if weights is not None else np.ones(len(neighbors), dtype=np.int64)
+
+    def from_lists(opponent_lists):
+        """ Graph from a dict of profile id to dict of opponent id to number of matches (or list of opponent ids). """
+        profiles = np.array(sorted(int(p) for p in opponent_lists), dtype=np.int64)
+        rows = [opponent_lists[str(p)] for p in profiles]
+        rows = [row if isinstance(row, dict) else dict.fromkeys(row, 1) for row in rows]
+        counts = np.array([len(row) for row in rows], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        neighbors = np.array([int(o) for row in rows for o in row], dtype=np.int64)
+        weights = np.array([int(n) for row in rows for n in row.values()], dtype=np.int64)
+        return OpponentGraph(profiles, offsets, neighbors, weights)
+
+    def __len__(self):
+        return len(self.profiles)
+
+    def indexed(self, profile_ids):
+        """ Boolean array of whether each of profile_ids (int array) has a row. """
+        if not len(self.profiles):
+            return np.zeros(len(profile_ids), dtype=bool)
+        idx = np.minimum(np.searchsorted(self.profiles, profile_ids), len(self.profiles) - 1)
+        return self.profiles[idx] == profile_ids
+
+    def opponents_of(self, profile_ids):
+        """ Sorted unique opponents of profile_ids (int array; ids without a row are ignored). """
+        profile_ids = np.asarray(profile_ids, dtype=np.int64)
+        rows = np.searchsorted(self.profiles, profile_ids[self.indexed(profile_ids)])
+        if not len(rows):
+            return np.zeros(0, dtype=np.int64)
+        starts = self.offsets[rows]
+        counts = self.offsets[rows + 1] - starts
+        # Positions of every opponent of every row, without a python loop over rows
+        positions = np.repeat(starts - np.concatenate(([0], np.cumsum(counts)[:-1])), counts) + np.arange(counts.sum())
+        return np.unique(self.neighbors[positions])
+
+    def frontier(self, profile_ids, checked):
+        """ Opponents of profile_ids that are not in checked (int arrays). """
+        return np.setdiff1d(self.opponents_of(profile_ids), checked, assume_unique=False)
+
+    def known_matches(self, profile_ids, combine='sum'):
+        """ For each of profile_ids (int array), how many of its matches are in indexed files of other
+        profiles. 'sum' adds up the matches in every file, which is exact when every match has two
+        players; 'max' takes the file with the most, a lower bound when matches have more. """
+        profile_ids = np.asarray(profile_ids, dtype=np.int64)
+        known = np.zeros(len(profile_ids), dtype=np.int64)
+        if not len(self.neighbors) or not len(profile_ids):
+            return known
+        nodes, node_idx = np.unique(self.neighbors, return_inverse=True)
+        if combine == 'sum':
+            totals = np.bincount(node_idx.ravel(), weights=self.weights, minlength=len(nodes)).astype(np.int64)
+        elif combine == 'max':
+            totals = np.zeros(len(nodes), dtype=np.int64)
+            np.maximum.at(totals, node_idx.ravel(), self.weights)
+        else:
+            raise ValueError('Unknown combine {}; expected sum or max'.format(combine))
+        idx = np.minimum(np.searchsorted(nodes, profile_ids), len(nodes) - 1)
+        found = nodes[idx] == profile_ids
+        known[found] = totals[idx[found]]
+        return known
+
+    def components(self):
+        """ (nodes, labels): every profile and opponent id, sorted, and the smallest id in its
+        connected component. Labels spread along edges, with pointer jumping, until stable. """
+        sources = np.repeat(self.profiles, np.diff(self.offsets))
+        nodes = np.union1d(self.profiles, self.neighbors)
+        a = np.searchsorted(nodes, sources)
+        b = np.searchsorted(nodes, self.neighbors)
+        labels = np.arange(len(nodes))
+        while True:
+            new_labels = labels.copy()
+            np.minimum.at(new_labels, a, labels[b])
+            np.minimum.at(new_labels, b, labels[a])
+            new_labels = new_labels[new_labels]
+            if np.array_equal(new_labels, labels):
+                break
+            labels = new_labels
+        return nodes, nodes[labels]
+
+def load(data_dir):
+    """ OpponentGraph of data_dir (empty if there is no index). """
+    data_file = index_file(data_dir)
+    if not os.path.exists(data_file):
+        return OpponentGraph.from_lists({})
+    stat = os.stat(data_file)
+    version = (stat.st_mtime_ns, stat.st_size,)
+    cached = _graph_cache.get(data_dir)
+    if cached and cached[0] == version:
+        return cached[1]
+    graph = OpponentGraph.from_lists(_read(data_file))
+    _graph_cache[data_dir] = (version, graph)
+    return graph
+
+def _read(data_file):
+    opponent_lists = {}
+    with open(data_file) as f:
+        for row in csv.reader(f):
+            if len(row) == 3:
+                ids = row[1].split(':') if row[1] else []
+                counts = [int(c) for c in row[2].split(':')] if row[2] else []
+                opponent_lists[row[0]] = dict(zip(ids, counts))
+    return opponent_lists
+
+def _write(data_dir, opponent_lists):
+    data_file = index_file(data_dir)
+    tmp_file = '{}.tmp'.format(data_file)
+    with open(tmp_file, 'w') as f:
+        csv.writer(f).writerows([_row(profile_id, opponent_lists[profile_id]) for profile_id in sorted(opponent_lists, key=int)])
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, data_file)
+
+def compact(data_dir):
+    """ Rewrites the index keeping only the latest row of every profile. """
+    with _index_lock:
+        data_file = index_file(data_dir)
+        if os.path.exists(data_file):
+            _write(data_dir, _read(data_file))
+
+def rebuild(module):
+    """ Rewrites the index of module's data directory from its matches files. """
+    opponent_lists = {}
+    for filename in os.listdir(module.DATA_DIR):
+        m = MATCH_FILE_PATTERN.match(filename)
+        if m:
+            matches = []
+            with open('{}/{}'.format(module.DATA_DIR, filename)) as f:
+                for row in csv.reader(f):
+                    try:
+                        matches.append(module.Match.from_csv(row))
+                    except ValueError:
+                        pass
+            opponent_lists[m.group(1)] = opponents(m.group(1), matches)
+    with _index_lock:
+        _write(module.DATA_DIR, opponent_lists)
@@ -0,0 +1,184 @@
+""" Runs export jobs in a process pool, regenerating only outputs whose inputs have changed.
+
+Each Job names the files it reads and writes. A job is skipped when the fingerprint of its
+inputs (paths, sizes and modification times, the source of the modules its function runs, its
+arguments and the fingerprints of the jobs it depends on) matches the one recorded in the state
+file when it last ran and its outputs still exist. Data shared by all jobs (e.g. loaded players) is built by a factory only if some
+job has to run, and handed to the worker processes once rather than once per job. """
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import hashlib
+import importlib
+import json
+import multiprocessing
+import os
+
+# Data shared by all jobs in a worker process
+_shared = None
+
+def _set_shared(shared):
+    global _shared
+    _shared = shared
+
+def _run(func, args):
+    return func(_shared, *args)
+
+class Job:
+    """ func is called as func(shared, *args) and must be a module level function so it can be
+    sent to a worker process. inputs and outputs are file paths; depends are names of jobs that
+    must finish first; sources are names of the modules, besides func's own, whose code writes
+    the outputs. """
+    def __init__(self, name, func, args=(), inputs=(), outputs=(), depends=(), sources=()):
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.depends = list(depends)
+        self.sources = list(sources)
+
+def file_fingerprint(path):
+    if not os.path.exists(path):
+        return [path, None, None]
+    stat = os.stat(path)
+    return [path, stat.st_size, stat.st_mtime_ns]
+
+def source_fingerprint(module_name):
+    """ sha1 of the source file of a module, importing it if it is not already. """
+    with open(importlib.import_module(module_name).__file__, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def fingerprint(job, dependency_fingerprints=()):
+    """ sha1 of the job's function (name and the source of its module and of job.sources),
+    arguments, inputs and the fingerprints of its dependencies. """
+    data = [
+        '{}.{}'.format(job.func.__module__, job.func.__qualname__),
+        [source_fingerprint(name) for name in [job.func.__module__] + job.sources],
+        repr(job.args),
+        [file_fingerprint(path) for path in job.inputs],
+        list(dependency_fingerprints),
+    ]
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _pool_context():
+    # Forked workers inherit the shared data without it being pickled
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return None
+
+class Pipeline:
+    """ A set of jobs, with their last fingerprints kept in state_file. """
+    def __init__(self, state_file, workers=None):
+        self.state_file = state_file
+        self.workers = workers
+        self.jobs = {}
+
+    def add(self, job):
+        if job.name in self.jobs:
+            raise ValueError('Duplicate job {}'.format(job.name))
+        self.jobs[job.name] = job
+        return job
+
+    def load_state(self):
+        if not os.path.exists(self.state_file):
+            return {}
+        with open(self.state_file) as f:
+            return json.load(f)
+
+    def save_state(self, state):
+        tmp_file = '{}.tmp'.format(self.state_file)
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+        os.replace(tmp_file, self.state_file)
+
+    def order(self):
+        """ Job names with every job after the jobs it depends on. """
+        ordered = []
+        visiting = set()
+        done = set()
+        for name in self.jobs:
+            stack = [(name, False)]
+            while stack:
+                current, expanded = stack.pop()
+                if current in done:
+                    continue
+                if expanded:
+                    visiting.discard(current)
+                    done.add(current)
+                    ordered.append(current)
+                    continue
+                if current not in self.jobs:
+                    raise ValueError('Unknown job {}'.format(current))
+                if current in visiting:
+                    raise ValueError('Job {} depends on itself'.format(current))
+                visiting.add(current)
+                stack.append((current, True))
+                for dependency in reversed(self.jobs[current].depends):
+                    stack.append((dependency, False))
+        return ordered
+
+    def fingerprints(self):
+        """ dict of job name to current fingerprint. """
+        fingerprints = {}
+        for name in self.order():
+            job = self.jobs[name]
+            fingerprints[name] = fingerprint(job, [fingerprints[d] for d in job.depends])
+        return fingerprints
+
+    def stale(self, force=False):
+        """ Names of jobs that have to run, in dependency order. """
+        state = self.load_state()
+        fingerprints = self.fingerprints()
+        stale = []
+        for name in self.order():
+            job = self.jobs[name]
+            if (force or state.get(name) != fingerprints[name]
+                    or not all(os.path.exists(path) for path in job.outputs)
+                    or any(d in stale for d in job.depends)):
+                stale.append(name)
+        return stale
+
+    def run(self, shared_factory=None, force=False):
+        """ Runs stale jobs, independent ones in parallel, and returns the names of the jobs run.
+        shared_factory is called (once, and only if a job has to run) for the data passed to every job. """
+        to_run = self.stale(force)
+        if not to_run:
+            return []
+        fingerprints = self.fingerprints()
+        state = self.load_state()
+        shared = shared_factory() if shared_factory else None
+        if self.workers == 1:
+            for name in to_run:
+                job = self.jobs[name]
+                job.func(shared, *job.args)
+                state[name] = fingerprints[name]
+                self.save_state(state)
+            return to_run
+        finished = set(name for name in self.jobs if name not in to_run)
+        waiting = list(to_run)
+        running = {}
+        failures = []
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=_pool_context(),
+                                 initializer=_set_shared, initargs=(shared,)) as executor:
+            while waiting or running:
+                for name in list(waiting):
+                    if all(d in finished for d in self.jobs[name].depends):
+                        job = self.jobs[name]
+                        running[executor.submit(_run, job.func, job.args)] = name
+                        waiting.remove(name)
+                if not running:
+                    # Everything left depends on a job that failed
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error:
+                        failures.append((name, error))
+                        continue
+                    finished.add(name)
+                    state[name] = fingerprints[name]
+                    self.save_state(state)
+        if failures:
+            raise RuntimeError('Jobs failed: {}'.format(', '.join('{} ({})'.format(n, e) for n, e in failures)))
+        return to_run
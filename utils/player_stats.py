@@ -0,0 +1,134 @@
+""" Per-player rating statistics of a whole data set, calculated in one pass and kept as arrays.
+
+Every player's ratings are stored sorted, one player after another, with running sums of the
+ratings and their squares, so the standard deviation of any window of a player's sorted ratings
+costs two subtractions. Sums are kept as integers so equal windows compare exactly equal. """
+
+from collections import Counter
+
+import numpy as np
+
+class PlayerStats:
+    """ Statistics of every player in reports. Only ratings above min_rating are used
+    (None for all ratings); match_counts counts every match. """
+    def __init__(self, reports, min_rating=100):
+        player_index = {}
+        player_idx = []
+        ratings = []
+        match_counts = []
+        for report in reports:
+            for player_id, data in report.players.items():
+                if player_id not in player_index:
+                    player_index[player_id] = len(player_index)
+                    match_counts.append(0)
+                idx = player_index[player_id]
+                match_counts[idx] += 1
+                rating = int(data['rating'])
+                if min_rating is None or rating > min_rating:
+                    player_idx.append(idx)
+                    ratings.append(rating)
+        self.player_ids = list(player_index)
+        self.player_index = player_index
+        self.match_counts = np.array(match_counts, dtype=np.int64)
+        player_idx = np.array(player_idx, dtype=np.int64)
+        ratings = np.array(ratings, dtype=np.int64)
+        order = np.lexsort((ratings, player_idx))
+        self.ratings = ratings[order]
+        self.counts = np.bincount(player_idx, minlength=len(self.player_ids)).astype(np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(self.counts))).astype(np.int64)
+        self.sums = np.concatenate(([0], np.cumsum(self.ratings))).astype(np.int64)
+        self.squares = np.concatenate(([0], np.cumsum(self.ratings*self.ratings))).astype(np.int64)
+        self._best = {}
+
+    def __len__(self):
+        return len(self.player_ids)
+
+    def ratings_for(self, player_id):
+        """ Sorted ratings of a player. """
+        idx = self.player_index[player_id]
+        return self.ratings[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def _spread(self, starts, ends):
+        """ n*sum of squares - sum**2 of ratings[starts:ends] (n*(n-1) times the sample variance). """
+        n = ends - starts
+        total = self.sums[ends] - self.sums[starts]
+        return n*(self.squares[ends] - self.squares[starts]) - total*total
+
+    def stdevs(self):
+        """ Sample standard deviation of each player's ratings (NaN for fewer than 2). """
+        n = self.counts.astype(float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.counts > 1, np.sqrt(self._spread(self.offsets[:-1], self.offsets[1:])/(n*(n - 1))), np.nan)
+
+    def best_window(self, size, ties='last', last=True):
+        """ For each player, the standard deviation and median of the window of size sorted ratings
+        with the lowest standard deviation (NaN if the player has fewer ratings). ties is 'last' to
+        prefer the highest such window (as Player.best_rating) or 'first' for the lowest. Without
+        last, a player's highest window is only used if it is their only one. """
+        key = (size, ties, last,)
+        if key in self._best:
+            return self._best[key]
+        n_players = len(self.player_ids)
+        best_stdevs = np.full(n_players, np.nan)
+        best_medians = np.full(n_players, np.nan)
+        starts = np.arange(max(len(self.ratings) - size + 1, 0))
+        window_players = np.repeat(np.arange(n_players), self.counts)[starts]
+        # Keep windows that end within their player's ratings
+        within = starts + size <= self.offsets[window_players + 1]
+        if not last:
+            within &= (starts + size < self.offsets[window_players + 1]) | (starts == self.offsets[window_players])
+        starts = starts[within]
+        window_players = window_players[within]
+        if len(starts):
+            spreads = self._spread(starts, starts + size)
+            # Sort by player, then spread, then start (descending for 'last'), and take each player's first
+            tie_order = -starts if ties == 'last' else starts
+            order = np.lexsort((tie_order, spreads, window_players))
+            first = np.concatenate(([True], window_players[order][1:] != window_players[order][:-1]))
+            chosen = order[first]
+            players = window_players[chosen]
+            best_stdevs[players] = np.sqrt(spreads[chosen]/(size*(size - 1))) if size > 1 else 0
+            middle = starts[chosen] + size//2
+            if size % 2:
+                best_medians[players] = self.ratings[middle]
+            else:
+                best_medians[players] = (self.ratings[middle - 1] + self.ratings[middle])/2
+        self._best[key] = (best_stdevs, best_medians)
+        return self._best[key]
+
+    def bounds(self, max_std, mincount, trimmed=False):
+        """ For each player, whether dropping outlying ratings (the end furthest from its neighbor
+        first) brings their standard deviation within max_std before fewer than mincount are left.
+        Returns lower and upper, the lowest and highest of all the ratings of such players (of the
+        ratings left, with trimmed; 10000 and 0 for the others), and whether each player is one of them. """
+        n_players = len(self.player_ids)
+        lower = np.full(n_players, 10000, dtype=np.int64)
+        upper = np.zeros(n_players, dtype=np.int64)
+        valid = np.zeros(n_players, dtype=bool)
+        limit = max_std*max_std
+        for idx in np.flatnonzero(self.counts >= max(mincount, 2)):
+            lo = int(self.offsets[idx])
+            hi = int(self.offsets[idx + 1])
+            while True:
+                n = hi - lo
+                variance = self._spread(lo, hi)/(n*(n - 1))
+                if variance <= limit or n < mincount or n < 3:
+                    break
+                if self.ratings[hi - 1] - self.ratings[hi - 2] > self.ratings[lo + 1] - self.ratings[lo]:
+                    hi -= 1
+                else:
+                    lo += 1
+            if variance <= limit:
+                if not trimmed:
+                    lo, hi = self.offsets[idx], self.offsets[idx + 1]
+                lower[idx] = self.ratings[lo]
+                upper[idx] = self.ratings[hi - 1]
+                valid[idx] = True
+        return lower, upper, valid
+
+def histogram(values):
+    """ Counter of the integer part of values, ignoring NaN. """
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    keys, counts = np.unique(values.astype(np.int64), return_counts=True)
+    return Counter(dict(zip(keys.tolist(), counts.tolist())))
@@ -0,0 +1,152 @@
+""" Proportional popularity of civs and maps across many players, calculated with numpy.
+
+Same results as Player.add_civ_percentages, add_win_percentages and add_map_percentages
+summed over players: every player contributes at most 1 to a bucket, split by the
+proportion of their matches in the bucket played with each civ (or on each map). """
+
+from collections import Counter
+
+import numpy as np
+
+def counters(matrix, labels):
+    """ One Counter of label to value per row of matrix, leaving out zero values. """
+    rows = []
+    for row in matrix:
+        ctr = Counter()
+        for idx in np.flatnonzero(row):
+            ctr[labels[idx]] = row[idx]
+        rows.append(ctr)
+    return rows
+
+class PlayerMatches:
+    """ The civ, rating, result and map of every match of many players, concatenated into arrays.
+    Players are ordered by best rating and each player's matches are contiguous, so the matches
+    of the players in a rating bucket are one slice of the arrays. """
+    def __init__(self, players, mincount=5):
+        players = list(players)
+        best_ratings = [player.best_rating(mincount) or 0 for player in players]
+        order = sorted(range(len(players)), key=lambda i: best_ratings[i])
+        self.players = [players[i] for i in order]
+        self.best_ratings = np.array([best_ratings[i] for i in order], dtype=float)
+        civ_codes = {}
+        map_codes = {}
+        match_counts = []
+        ratings = []
+        civs = []
+        maps = []
+        results = []
+        for player in self.players:
+            columns = player.columns
+            match_counts.append(len(columns.ratings))
+            ratings.extend(columns.ratings)
+            civs.extend([civ_codes.setdefault(civ, len(civ_codes)) for civ in columns.civs])
+            maps.extend([map_codes.setdefault(map_name, len(map_codes)) for map_name in columns.maps])
+            results.extend(columns.results)
+        self.civ_names = list(civ_codes)
+        self.map_names = list(map_codes)
+        self.match_counts = np.array(match_counts, dtype=np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(self.match_counts))).astype(np.int64)
+        self.player_idx = np.repeat(np.arange(len(self.players)), self.match_counts)
+        self.ratings = np.array(ratings, dtype=np.int64)
+        self.civs = np.array(civs, dtype=np.int64)
+        self.maps = np.array(maps, dtype=np.int64)
+        results = np.array(results, dtype=object)
+        self.won = results == 'won'
+        self.decided = results != 'na'
+
+    def bucket_ranges(self, buckets):
+        """ (lo, hi) range of players whose best rating is within each bucket. """
+        return buckets.ranges(self.best_ratings)
+
+    def bucket_matches(self, lo, hi, start, edge, map_name='all'):
+        """ Indices of the matches of players lo to hi rated within (start, edge] on map_name ('all' for any map). """
+        first = self.offsets[lo]
+        last = self.offsets[hi]
+        ratings = self.ratings[first:last]
+        mask = (ratings > start) & (ratings <= edge)
+        if map_name != 'all':
+            if map_name not in self.map_names:
+                return np.zeros(0, dtype=np.int64)
+            mask &= self.maps[first:last] == self.map_names.index(map_name)
+        return first + np.flatnonzero(mask)
+
+    def proportions(self, keys, n_keys, matches, lo=0, hi=None, weights=None):
+        """ (hi - lo) x n_keys matrix of the proportion of each of players lo to hi's given matches with each key.
+        If weights are given, the numerator counts only the weight of each match (e.g. wins). """
+        if hi is None:
+            hi = len(self.players)
+        n_players = hi - lo
+        player_idx = self.player_idx[matches] - lo
+        pairs = player_idx*n_keys + keys[matches]
+        totals = np.bincount(player_idx, minlength=n_players).astype(float)
+        if weights is None:
+            counts = np.bincount(pairs, minlength=n_players*n_keys).astype(float)
+        else:
+            counts = np.bincount(pairs, weights=weights[matches].astype(float), minlength=n_players*n_keys).astype(float)
+        matrix = counts.reshape(n_players, n_keys)
+        has_matches = totals > 0
+        matrix[has_matches] /= totals[has_matches, None]
+        return matrix
+
+def civ_popularity_matrix(player_matches, map_name, buckets):
+    """ Returns a buckets x civs matrix of summed player proportions and the number of players
+    contributing to each bucket. buckets is a utils.buckets.Buckets. """
+    pm = player_matches
+    matrix = np.zeros((len(buckets), len(pm.civ_names)))
+    player_counts = np.zeros(len(buckets), dtype=np.int64)
+    for idx, ((start, edge), (lo, hi)) in enumerate(zip(buckets, pm.bucket_ranges(buckets))):
+        matches = pm.bucket_matches(lo, hi, start, edge, map_name)
+        proportions = pm.proportions(pm.civs, len(pm.civ_names), matches, lo, hi)
+        matrix[idx] = proportions.sum(axis=0)
+        player_counts[idx] = np.count_nonzero(proportions.any(axis=1))
+    return matrix, player_counts
+
+def civ_popularity(player_matches, map_name, buckets):
+    """ Returns one Counter of civ popularity per bucket and the number of players contributing to each. """
+    matrix, player_counts = civ_popularity_matrix(player_matches, map_name, buckets)
+    return counters(matrix, player_matches.civ_names), list(player_counts)
+
+def win_popularity(player_matches, map_name, buckets):
+    """ As civ_popularity for matches with a known result, returning Counters of proportional wins
+    and of proportional matches per bucket, and the number of players contributing to each. """
+    pm = player_matches
+    wins = np.zeros((len(buckets), len(pm.civ_names)))
+    totals = np.zeros((len(buckets), len(pm.civ_names)))
+    player_counts = []
+    for idx, ((start, edge), (lo, hi)) in enumerate(zip(buckets, pm.bucket_ranges(buckets))):
+        matches = pm.bucket_matches(lo, hi, start, edge, map_name)
+        matches = matches[pm.decided[matches]]
+        proportions = pm.proportions(pm.civs, len(pm.civ_names), matches, lo, hi)
+        totals[idx] = proportions.sum(axis=0)
+        wins[idx] = pm.proportions(pm.civs, len(pm.civ_names), matches, lo, hi, pm.won).sum(axis=0)
+        player_counts.append(np.count_nonzero(proportions.any(axis=1)))
+    return counters(wins, pm.civ_names), counters(totals, pm.civ_names), player_counts
+
+def map_popularity_matrix(player_matches, buckets):
+    """ Returns a buckets x maps matrix of summed player proportions and the number of players
+    contributing to each bucket. """
+    pm = player_matches
+    matrix = np.zeros((len(buckets), len(pm.map_names)))
+    player_counts = np.zeros(len(buckets), dtype=np.int64)
+    for idx, ((start, edge), (lo, hi)) in enumerate(zip(buckets, pm.bucket_ranges(buckets))):
+        matches = pm.bucket_matches(lo, hi, start, edge)
+        proportions = pm.proportions(pm.maps, len(pm.map_names), matches, lo, hi)
+        matrix[idx] = proportions.sum(axis=0)
+        player_counts[idx] = np.count_nonzero(proportions.any(axis=1))
+    return matrix, player_counts
+
+def map_popularity(player_matches, buckets):
+    """ Returns one Counter of map popularity per bucket and the number of players contributing to each. """
+    matrix, player_counts = map_popularity_matrix(player_matches, buckets)
+    return counters(matrix, player_matches.map_names), list(player_counts)
+
+def map_popularity_by_group(player_matches, groups, start=0, edge=10000):
+    """ Map popularity of matches rated within (start, edge], summed over players with the same group.
+    groups is one label per player (in player_matches.players order). Returns a dict of group to Counter. """
+    pm = player_matches
+    labels, group_idx = np.unique(np.asarray(groups), return_inverse=True)
+    matches = pm.bucket_matches(0, len(pm.players), start, edge)
+    proportions = pm.proportions(pm.maps, len(pm.map_names), matches)
+    matrix = np.zeros((len(labels), len(pm.map_names)))
+    np.add.at(matrix, group_idx, proportions)
+    return dict(zip(labels.tolist(), counters(matrix, pm.map_names)))
@@ -0,0 +1,74 @@
+""" Sets of profile ids as sorted int64 arrays.
+
+The crawler keeps track of hundreds of thousands of profile ids (checked, to download, on the
+leaderboard), which arrive as ints from the api and users file and as strings from matches
+files. A ProfileSet normalizes them all to ints, stores them in 8 bytes apiece rather than a
+python string and set entry each, and does union, difference and membership with numpy. """
+
+import numpy as np
+
+def as_ids(values):
+    """ Sorted unique int64 array of profile ids in values (ints, strings, an int array or a
+    ProfileSet), leaving out any that are not numbers. """
+    if isinstance(values, ProfileSet):
+        return values.ids
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'iu':
+        return np.unique(values.astype(np.int64))
+    return np.unique(np.fromiter((int(v) for v in values if str(v).isdigit()), dtype=np.int64))
+
+class ProfileSet:
+    """ Profile ids, sorted and unique, in ids. Operators return new sets; update() replaces ids,
+    so arrays taken from a set are never changed under the caller. """
+    def __init__(self, values=()):
+        self.ids = as_ids(values)
+
+    def from_sorted(ids):
+        """ Set of ids that are already a sorted unique int64 array. """
+        profile_set = ProfileSet()
+        profile_set.ids = ids
+        return profile_set
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def __contains__(self, profile_id):
+        try:
+            value = int(profile_id)
+        except (TypeError, ValueError):
+            return False
+        idx = np.searchsorted(self.ids, value)
+        return bool(idx < len(self.ids) and self.ids[idx] == value)
+
+    def __eq__(self, other):
+        return isinstance(other, ProfileSet) and np.array_equal(self.ids, other.ids)
+
+    def __repr__(self):
+        return 'ProfileSet({})'.format(len(self.ids))
+
+    def contains(self, profile_ids):
+        """ Boolean array of whether each of profile_ids (int array) is in the set. """
+        profile_ids = np.asarray(profile_ids, dtype=np.int64)
+        if not len(self.ids):
+            return np.zeros(len(profile_ids), dtype=bool)
+        idx = np.minimum(np.searchsorted(self.ids, profile_ids), len(self.ids) - 1)
+        return self.ids[idx] == profile_ids
+
+    def __or__(self, other):
+        return ProfileSet.from_sorted(np.union1d(self.ids, as_ids(other)))
+
+    def __sub__(self, other):
+        return ProfileSet.from_sorted(np.setdiff1d(self.ids, as_ids(other), assume_unique=True))
+
+    def __and__(self, other):
+        return ProfileSet.from_sorted(np.intersect1d(self.ids, as_ids(other), assume_unique=True))
+
+    def update(self, values):
+        """ Adds values (anything as_ids takes) to the set. """
+        self.ids = np.union1d(self.ids, as_ids(values))
+
+    def strs(self):
+        """ List of the ids as strings, as matches files key players. """
+        return [str(p) for p in self.ids.tolist()]
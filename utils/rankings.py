@@ -0,0 +1,154 @@
+""" Dense storage of rankings, popularity and totals of many names (civs) by map and rating key.
+
+Values used to live in per-civ dicts keyed by strings such as 'Overall', '651-700', 'Arabia'
+and 'Arabia-651-700'. RankingStore holds them in name x map x rating key arrays, where the map
+'all' and the rating key 'Overall' stand for no filter, and StoreView gives the old dict-like
+access to one name's values. """
+
+import numpy as np
+
+ALL_MAPS = 'all'
+OVERALL = 'Overall'
+
+# Value of each attribute for a key that has not been set
+DEFAULTS = {
+    'rankings': 35,
+    'popularity': 0,
+    'totals': 0,
+}
+
+class RankingStore:
+    """ name x map x rating key arrays of every attribute in DEFAULTS. Names and maps are added as they are
+    first used; rating keys must be given up front so 'map-rating key' strings can be split. """
+    def __init__(self, names=(), maps=(), rating_keys=()):
+        self.names = []
+        self.maps = [ALL_MAPS]
+        self.rating_keys = [OVERALL] + list(rating_keys)
+        self.name_index = {}
+        self.map_index = {ALL_MAPS: 0}
+        self.rating_key_index = {rk: idx for idx, rk in enumerate(self.rating_keys)}
+        self.arrays = {attr: np.full((0, 1, len(self.rating_keys)), default, dtype=float)
+                       for attr, default in DEFAULTS.items()}
+        for name in names:
+            self.row(name)
+        for map_name in maps:
+            self.map_column(map_name)
+
+    def _grow(self, axis):
+        for attr, array in self.arrays.items():
+            shape = list(array.shape)
+            shape[axis] = 1
+            self.arrays[attr] = np.concatenate((array, np.full(shape, DEFAULTS[attr], dtype=float)), axis=axis)
+
+    def row(self, name):
+        """ Index of name, adding it if new. """
+        if name not in self.name_index:
+            self.name_index[name] = len(self.names)
+            self.names.append(name)
+            self._grow(0)
+        return self.name_index[name]
+
+    def map_column(self, map_name):
+        """ Index of map_name, adding it if new. """
+        if map_name not in self.map_index:
+            self.map_index[map_name] = len(self.maps)
+            self.maps.append(map_name)
+            self._grow(1)
+        return self.map_index[map_name]
+
+    def position(self, key):
+        """ (map index, rating key index) of a string key: 'Overall', a rating key, a map name or
+        'map name-rating key'. """
+        if key in self.rating_key_index:
+            return 0, self.rating_key_index[key]
+        if key in self.map_index:
+            return self.map_index[key], 0
+        for rk, rk_idx in self.rating_key_index.items():
+            if key.endswith('-{}'.format(rk)):
+                return self.map_column(key[:-len(rk) - 1]), rk_idx
+        return self.map_column(key), 0
+
+    def get(self, attr, name, key):
+        # Find the position first, as it may grow the arrays
+        idx = (self.row(name),) + self.position(key)
+        value = self.arrays[attr][idx]
+        if value.is_integer():
+            return int(value)
+        return float(value)
+
+    def set(self, attr, name, key, value):
+        idx = (self.row(name),) + self.position(key)
+        self.arrays[attr][idx] = value
+
+    def values(self, attr, maps=(ALL_MAPS,), rating_keys=(OVERALL,), names=None):
+        """ names x maps x rating_keys array of attr (all names in store order by default). """
+        if names is None:
+            rows = np.arange(len(self.names))
+        else:
+            rows = [self.row(name) for name in names]
+        columns = [self.map_column(map_name) for map_name in maps]
+        rks = [self.rating_key_index[rk] for rk in rating_keys]
+        return self.arrays[attr][np.ix_(rows, columns, rks)]
+
+    def assign(self, key, ctr):
+        """ Sets rankings (1 for most popular), popularity (share of total) and totals for key
+        from a Counter of name to popularity. """
+        if not ctr:
+            return
+        map_idx, rk_idx = self.position(key)
+        names = list(ctr)
+        rows = np.array([self.row(name) for name in names])
+        # Rows and columns are added before the arrays are looked up, as adding replaces them
+        counts = np.array([ctr[name] for name in names], dtype=float)
+        total = counts.sum()
+        order = np.argsort(-counts, kind='stable')
+        self.arrays['rankings'][rows[order], map_idx, rk_idx] = np.arange(1, len(order) + 1)
+        self.arrays['popularity'][rows, map_idx, rk_idx] = counts/total
+        self.arrays['totals'][rows, map_idx, rk_idx] = total
+
+    def view(self, attr, name):
+        return StoreView(self, attr, name)
+
+class StoreView:
+    """ Dict-like access to one name's values of one attribute, by string key. """
+    def __init__(self, store, attr, name):
+        self.store = store
+        self.attr = attr
+        self.name = name
+
+    def __getitem__(self, key):
+        return self.store.get(self.attr, self.name, key)
+
+    def __setitem__(self, key, value):
+        self.store.set(self.attr, self.name, key, value)
+
+    def __contains__(self, key):
+        return self[key] != DEFAULTS[self.attr]
+
+    def keys(self):
+        """ Keys with a value other than the default. """
+        row = self.store.row(self.name)
+        array = self.store.arrays[self.attr][row]
+        found = []
+        for map_idx, rk_idx in zip(*np.nonzero(array != DEFAULTS[self.attr])):
+            map_name = self.store.maps[map_idx]
+            rk = self.store.rating_keys[rk_idx]
+            if map_name == ALL_MAPS:
+                found.append(rk)
+            elif rk == OVERALL:
+                found.append(map_name)
+            else:
+                found.append('{}-{}'.format(map_name, rk))
+        return found
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
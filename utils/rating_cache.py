@@ -0,0 +1,185 @@
+""" Incrementally maintained cache of players' best ratings.
+
+One binary file per data set holds, for every player (sorted by id), the best rating
+at each cached mincount and the valid ratings it was calculated from. The cache also
+records how far into the match report file it has read, so when reports are appended
+only the players in the new reports are recalculated. If the start of the report file
+no longer matches what was read (e.g. the data set was resampled), it is rebuilt.
+
+Layout: HEADER, mincounts (u2), ids (fixed width bytes), best ratings (f8, NaN for none,
+players x mincounts), rating counts (u4 per player), ratings (i4). """
+
+import csv
+import hashlib
+import io
+import os
+import struct
+from statistics import median, stdev
+
+import numpy as np
+
+MAGIC = b'PRC1'
+# magic, number of mincounts, id width, report file offset, digest of report file head,
+# number of players, number of ratings
+HEADER = struct.Struct('<4sHHq20sIq')
+# Bytes at the start of the report file that must be unchanged to update incrementally
+HEAD_SIZE = 65536
+
+def best_rating(ratings, mincount):
+    """ Median and standard deviation of the slice of sorted ratings length {mincount}
+    with the lowest standard deviation (the highest such slice on ties). (None, None) if
+    there are fewer than mincount*1.5 ratings. """
+    if len(ratings) < mincount*1.5:
+        return None, None
+    sorted_ratings = sorted(ratings)
+    best_group = sorted_ratings[:mincount]
+    best_std = stdev(best_group)
+    for i in range(1, len(sorted_ratings) - mincount + 1):
+        test_group = sorted_ratings[i:i+mincount]
+        test_std = stdev(test_group)
+        if test_std <= best_std:
+            best_group = test_group
+            best_std = test_std
+    return median(best_group), best_std
+
+class RatingCache:
+    """ Contents of a cache file. ratings is a dict of player id to list of valid ratings,
+    best a dict of player id to dict of mincount to best rating (None if not rated). """
+    def __init__(self, mincounts=(), offset=0, head_digest=b'', ratings=None, best=None):
+        self.mincounts = sorted(mincounts)
+        self.offset = offset
+        self.head_digest = head_digest
+        self.ratings = ratings if ratings is not None else {}
+        self.best = best if best is not None else {}
+
+    def lookup(self, mincount):
+        """ dict of player id to best rating at mincount, leaving out unrated players. """
+        return { player_id: best[mincount] for player_id, best in self.best.items()
+                 if best.get(mincount) is not None }
+
+def _read_arrays(data_file):
+    """ One bulk read of a cache file into header values and numpy arrays. None if missing or invalid. """
+    if not os.path.exists(data_file):
+        return None
+    with open(data_file, 'rb') as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        return None
+    magic, n_mincounts, id_width, offset, head_digest, n_players, n_ratings = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        return None
+    pos = HEADER.size
+    mincounts = np.frombuffer(data, dtype='<u2', count=n_mincounts, offset=pos)
+    pos += mincounts.nbytes
+    ids = np.frombuffer(data, dtype='S{}'.format(max(id_width, 1)), count=n_players, offset=pos)
+    pos += ids.nbytes
+    best = np.frombuffer(data, dtype='<f8', count=n_players*n_mincounts, offset=pos).reshape(n_players, n_mincounts)
+    pos += best.nbytes
+    counts = np.frombuffer(data, dtype='<u4', count=n_players, offset=pos)
+    pos += counts.nbytes
+    ratings = np.frombuffer(data, dtype='<i4', count=n_ratings, offset=pos)
+    return mincounts.tolist(), offset, head_digest, ids, best, counts, ratings
+
+def _value(rating):
+    if np.isnan(rating):
+        return None
+    if rating.is_integer():
+        return int(rating)
+    return float(rating)
+
+def best_ratings(data_file):
+    """ dict of mincount to dict of player id to best rating, without unpacking per-player ratings. """
+    arrays = _read_arrays(data_file)
+    if not arrays:
+        return {}
+    mincounts, _, _, ids, best, _, _ = arrays
+    lookups = {}
+    for idx, mincount in enumerate(mincounts):
+        column = best[:, idx]
+        rated = np.flatnonzero(~np.isnan(column))
+        lookups[mincount] = { ids[i].decode('utf-8'): _value(column[i]) for i in rated }
+    return lookups
+
+def read(data_file):
+    """ The RatingCache stored in data_file, None if there is none. """
+    arrays = _read_arrays(data_file)
+    if not arrays:
+        return None
+    mincounts, offset, head_digest, ids, best, counts, ratings = arrays
+    ends = np.cumsum(counts, dtype=np.int64)
+    starts = ends - counts
+    all_ratings = ratings.tolist()
+    cache = RatingCache(mincounts, offset, head_digest)
+    for idx, player_id in enumerate(ids):
+        player_id = player_id.decode('utf-8')
+        cache.ratings[player_id] = all_ratings[starts[idx]:ends[idx]]
+        cache.best[player_id] = { mincount: _value(best[idx, m_idx]) for m_idx, mincount in enumerate(mincounts) }
+    return cache
+
+def write(data_file, cache):
+    """ Atomically writes cache to data_file. """
+    player_ids = sorted(cache.ratings)
+    encoded = [player_id.encode('utf-8') for player_id in player_ids]
+    id_width = max([len(i) for i in encoded] + [1])
+    best = np.full((len(player_ids), len(cache.mincounts)), np.nan, dtype='<f8')
+    for idx, player_id in enumerate(player_ids):
+        for m_idx, mincount in enumerate(cache.mincounts):
+            rating = cache.best[player_id].get(mincount)
+            if rating is not None:
+                best[idx, m_idx] = rating
+    counts = np.array([len(cache.ratings[player_id]) for player_id in player_ids], dtype='<u4')
+    ratings = np.array([r for player_id in player_ids for r in cache.ratings[player_id]], dtype='<i4')
+    tmp_file = '{}.tmp'.format(data_file)
+    with open(tmp_file, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(cache.mincounts), id_width, cache.offset, cache.head_digest,
+                            len(player_ids), len(ratings)))
+        f.write(np.array(cache.mincounts, dtype='<u2').tobytes())
+        f.write(np.array(encoded, dtype='S{}'.format(id_width)).tobytes())
+        f.write(best.tobytes())
+        f.write(counts.tobytes())
+        f.write(ratings.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, data_file)
+
+def head_digest(report_file, offset):
+    """ sha1 of the first HEAD_SIZE bytes (or up to offset) of report_file. """
+    with open(report_file, 'rb') as f:
+        return hashlib.sha1(f.read(min(offset, HEAD_SIZE))).digest()
+
+def new_reports(report_file, offset):
+    """ Complete report rows after offset in report_file, and the offset after them. """
+    with open(report_file, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b'\n') + 1
+    rows = list(csv.reader(io.StringIO(data[:end].decode('utf-8'))))
+    return rows, offset + end
+
+def update(data_file, report_file, mincounts):
+    """ Brings the cache in data_file up to date with report_file for mincounts (and any mincounts
+    already cached), recalculating only players with new reports. Returns the RatingCache. """
+    cache = read(data_file)
+    if (not cache or os.path.getsize(report_file) < cache.offset
+            or head_digest(report_file, cache.offset) != cache.head_digest):
+        cache = RatingCache()
+    new_mincounts = [m for m in mincounts if m not in cache.mincounts]
+    rows, offset = new_reports(report_file, cache.offset)
+    affected = set()
+    for row in rows:
+        for rating, player_id in zip(row[3].split(':'), row[4].split(':')):
+            player_ratings = cache.ratings.setdefault(player_id, [])
+            affected.add(player_id)
+            rating = int(rating)
+            if rating > 100:
+                player_ratings.append(rating)
+    cache.mincounts = sorted(set(cache.mincounts) | set(mincounts))
+    for player_id, player_ratings in cache.ratings.items():
+        recalculate = cache.mincounts if player_id in affected else new_mincounts
+        player_best = cache.best.setdefault(player_id, {})
+        for mincount in recalculate:
+            player_best[mincount] = best_rating(player_ratings, mincount)[0]
+    cache.offset = offset
+    cache.head_digest = head_digest(report_file, offset)
+    write(data_file, cache)
+    return cache
@@ -0,0 +1,164 @@
+""" Loads the ratings of many profiles at once into columnar arrays.
+
+Rating files are parsed in a process pool, and the result can be kept in a consolidated npz
+store next to them. The store records the size and modification time of every file it was
+built from, so a later load only parses files that are new or have changed. """
+
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import os
+import re
+
+import numpy as np
+
+import utils.models
+
+RATING_FILE_PATTERN = re.compile(r'ratings_for_([0-9]+)\.csv$')
+# Integer columns in file order after the profile id (Rating, Old Rating, Wins, Losses, Drops, Timestamp)
+COLUMNS = ('rating', 'old_rating', 'num_wins', 'num_losses', 'drops', 'timestamp',)
+WON_STATES = ('', 'won', 'lost',)
+WON_STATE_CODES = {state: code for code, state in enumerate(WON_STATES)}
+
+class RatingTable:
+    """ Ratings of many profiles, one array per column, grouped by profile (ordered by profile
+    id, then timestamp). won_state holds indexes into WON_STATES (-1 for anything else). """
+    def __init__(self, profile_ids, columns, won_state):
+        self.profile_ids = np.asarray(profile_ids, dtype=np.int64)
+        order = np.lexsort((columns['timestamp'], self.profile_ids))
+        self.profile_ids = self.profile_ids[order]
+        self.columns = {name: np.asarray(columns[name], dtype=np.int64)[order] for name in COLUMNS}
+        self.won_state = np.asarray(won_state, dtype=np.int8)[order]
+        for name, values in self.columns.items():
+            setattr(self, name, values)
+
+    def __len__(self):
+        return len(self.profile_ids)
+
+    def profiles(self):
+        """ Sorted unique profile ids. """
+        return np.unique(self.profile_ids)
+
+    def rows_for(self, profile_id):
+        """ slice of the rows of profile_id. """
+        start, end = np.searchsorted(self.profile_ids, [int(profile_id), int(profile_id) + 1])
+        return slice(start, end)
+
+    def subset(self, profile_ids):
+        """ RatingTable of only the rows of profile_ids. """
+        keep = np.isin(self.profile_ids, np.asarray([int(p) for p in profile_ids], dtype=np.int64))
+        return RatingTable(self.profile_ids[keep], {name: values[keep] for name, values in self.columns.items()},
+                           self.won_state[keep])
+
+    def drift(self):
+        """ Sorted unique profile ids and the change of each one's rating from its first to its last row. """
+        profiles, first = np.unique(self.profile_ids, return_index=True)
+        last = np.concatenate((first[1:], [len(self.profile_ids)])) - 1
+        return profiles, self.rating[last] - self.rating[first]
+
+def read_file(data_file):
+    """ Rows of a ratings file as lists of column values (skipping rows Rating.from_csv would). """
+    profile_ids = []
+    columns = {name: [] for name in COLUMNS}
+    won_state = []
+    row_count = 0
+    with open(data_file) as f:
+        for row in csv.reader(f):
+            row_count += 1
+            try:
+                values = [int(value) for value in row[1:7]]
+                profile_id = int(row[0])
+                state = row[7]
+            except (ValueError, IndexError):
+                continue
+            profile_ids.append(profile_id)
+            for name, value in zip(COLUMNS, values):
+                columns[name].append(value)
+            won_state.append(WON_STATE_CODES.get(state, -1))
+    utils.models.check_complete(data_file, row_count)
+    return profile_ids, columns, won_state
+
+def _read_files(data_files):
+    """ read_file of each of data_files, concatenated (run in a worker process). """
+    profile_ids = []
+    columns = {name: [] for name in COLUMNS}
+    won_state = []
+    for data_file in data_files:
+        file_profile_ids, file_columns, file_won_state = read_file(data_file)
+        profile_ids.extend(file_profile_ids)
+        for name in COLUMNS:
+            columns[name].extend(file_columns[name])
+        won_state.extend(file_won_state)
+    return (np.array(profile_ids, dtype=np.int64),
+            {name: np.array(values, dtype=np.int64) for name, values in columns.items()},
+            np.array(won_state, dtype=np.int8))
+
+def _concatenate(parts):
+    if not parts:
+        return RatingTable([], {name: [] for name in COLUMNS}, [])
+    return RatingTable(np.concatenate([part[0] for part in parts]),
+                       {name: np.concatenate([part[1][name] for part in parts]) for name in COLUMNS},
+                       np.concatenate([part[2] for part in parts]))
+
+def read_files(data_files, workers=None, chunk_size=200):
+    """ RatingTable of data_files, parsed in chunks by workers processes (in this process if workers is 1). """
+    data_files = list(data_files)
+    chunks = [data_files[i:i + chunk_size] for i in range(0, len(data_files), chunk_size)]
+    if workers == 1 or len(chunks) < 2:
+        parts = [_read_files(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(_read_files, chunks))
+    return _concatenate(parts)
+
+def rating_files(data_dir):
+    """ dict of profile id (str) to path of every ratings file in data_dir. """
+    files = {}
+    for filename in os.listdir(data_dir):
+        m = RATING_FILE_PATTERN.match(filename)
+        if m:
+            files[m.group(1)] = os.path.join(data_dir, filename)
+    return files
+
+def _stat(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+def store_file(data_dir):
+    return os.path.join(data_dir, 'ratings_store.npz')
+
+def read_store(path):
+    """ RatingTable in a store and a dict of profile id (int) to the (size, mtime) of its file. """
+    with np.load(path) as data:
+        table = RatingTable(data['profile_ids'], {name: data[name] for name in COLUMNS}, data['won_state'])
+        sources = {int(p): (int(size), int(mtime)) for p, size, mtime in data['sources']}
+    return table, sources
+
+def write_store(path, table, sources):
+    """ Writes table and the (size, mtime) of the file of each profile to path atomically. """
+    source_array = np.array([(p, size, mtime) for p, (size, mtime) in sorted(sources.items())], dtype=np.int64).reshape(-1, 3)
+    tmp_file = '{}.tmp.npz'.format(path[:-4])
+    np.savez(tmp_file, profile_ids=table.profile_ids, won_state=table.won_state, sources=source_array, **table.columns)
+    os.replace(tmp_file, path)
+
+def load(data_dir, profile_ids=None, workers=None, use_store=True):
+    """ RatingTable of the ratings of profile_ids (all profiles with a ratings file by default).
+    With use_store, unchanged files are taken from the consolidated store, which is then brought up to date. """
+    files = rating_files(data_dir)
+    stats = {int(p): _stat(path) for p, path in files.items()}
+    path = store_file(data_dir)
+    if use_store and os.path.exists(path):
+        stored, sources = read_store(path)
+    else:
+        stored, sources = _concatenate([]), {}
+    unchanged = [p for p, stat in stats.items() if sources.get(p) == stat]
+    changed = [p for p in stats if sources.get(p) != stats[p]]
+    table = stored.subset(unchanged) if len(unchanged) < len(sources) else stored
+    if changed:
+        fresh = read_files([files[str(p)] for p in sorted(changed)], workers)
+        table = _concatenate([(table.profile_ids, table.columns, table.won_state),
+                              (fresh.profile_ids, fresh.columns, fresh.won_state)])
+    if use_store and (changed or len(unchanged) < len(sources)):
+        write_store(path, table, stats)
+    if profile_ids is not None:
+        table = table.subset(profile_ids)
+    return table
@@ -0,0 +1,64 @@
+""" Content-addressed store of raw api pages so downloads can be reprocessed without the network. """
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+
+def raw_dir(module):
+    return '{}/raw'.format(module.DATA_DIR)
+
+def object_file(module, digest):
+    return '{}/objects/{}/{}.json.gz'.format(raw_dir(module), digest[:2], digest)
+
+def index_file(module, kind, profile_id):
+    return '{}/index/{}_for_{}.txt'.format(raw_dir(module), kind, profile_id)
+
+def digests(module, kind, profile_id):
+    """ Digests of every page saved for a profile, in the order they were downloaded. """
+    data_file = index_file(module, kind, profile_id)
+    if not os.path.exists(data_file):
+        return []
+    with open(data_file) as f:
+        return [l.strip() for l in f if l.strip()]
+
+def store(module, kind, profile_id, text):
+    """ Saves the compressed page under the sha256 of its contents and records it
+    in the profile's index. Returns the digest. """
+    data = text.encode('utf-8')
+    digest = hashlib.sha256(data).hexdigest()
+    path = object_file(module, digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Identical pages can be saved by several threads at once
+        tmp_file = '{}.{}.tmp'.format(path, threading.get_ident())
+        with gzip.open(tmp_file, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_file, path)
+    if digest not in digests(module, kind, profile_id):
+        data_file = index_file(module, kind, profile_id)
+        os.makedirs(os.path.dirname(data_file), exist_ok=True)
+        with open(data_file, 'a') as f:
+            f.write('{}\n'.format(digest))
+    return digest
+
+def pages(module, kind, profile_id):
+    """ Yields the decoded json of every page saved for a profile, oldest first. """
+    for digest in digests(module, kind, profile_id):
+        with gzip.open(object_file(module, digest), 'rb') as f:
+            yield json.loads(f.read().decode('utf-8'))
+
+def profiles(module, kind):
+    """ Profile ids with pages of kind ('matches' or 'ratings') in the store. """
+    profile_pattern = re.compile(r'{}_for_([0-9]+)\.txt$'.format(kind))
+    index_dir = '{}/index'.format(raw_dir(module))
+    if not os.path.exists(index_dir):
+        return []
+    found = []
+    for filename in os.listdir(index_dir):
+        m = profile_pattern.match(filename)
+        if m:
+            found.append(m.group(1))
+    return found
@@ -0,0 +1,81 @@
+""" Fields of two player (solo) match reports derived from the players, as typed columns.
+
+The player on team 1 comes first. score is the rating of the winner less that of the loser
+(positive when the higher rated player won, 0 if the winner is unknown), mirror is whether
+both players played the same civ and code packs the civ codes and map type into one integer.
+columns() calculates them for a whole packed data set at once (see utils.codec). """
+
+import os
+
+import numpy as np
+
+CIV_SHIFT = 24
+CIV_2_SHIFT = 16
+MAP_MASK = 0xFFFF
+CIV_MASK = 0xFF
+
+def pack_code(civ_1, civ_2, map_type):
+    """ civ codes and map type as one integer (ints or int64 arrays). """
+    return (civ_1 << CIV_SHIFT) | (civ_2 << CIV_2_SHIFT) | (map_type & MAP_MASK)
+
+def unpack_code(code):
+    """ (civ_1, civ_2, map type) of a packed code (an int or int64 array). """
+    return (code >> CIV_SHIFT) & CIV_MASK, (code >> CIV_2_SHIFT) & CIV_MASK, code & MAP_MASK
+
+def score(rating_1, rating_2, winner):
+    """ Rating of the winner less that of the loser (0 if winner, the winning team, is neither 1 nor 2). """
+    if winner == 1:
+        return rating_1 - rating_2
+    if winner == 2:
+        return rating_2 - rating_1
+    return 0
+
+def ordered_players(players):
+    """ The ids of the two players in a dict of id to {'team', ...}, team 1 first. """
+    if len(players) != 2:
+        raise ValueError('Expected 2 players, got {}'.format(len(players)))
+    player_1, player_2 = players
+    if int(players[player_1]['team']) != 1:
+        player_1, player_2 = player_2, player_1
+    return player_1, player_2
+
+def columns(records):
+    """ dict of column name to array of the derived fields of every two player record in a
+    structured array of utils.codec.DTYPE (records with another number of players are left out,
+    see 'index' for the positions of those included). """
+    index = np.flatnonzero(records['count'] == 2)
+    records = records[index]
+    # Slot of the team 1 player in each record
+    first = np.where(records['teams'][:, 0] == 1, 0, 1)
+    second = 1 - first
+    rows = np.arange(len(records))
+    rating_1 = records['ratings'][rows, first].astype(np.int64)
+    rating_2 = records['ratings'][rows, second].astype(np.int64)
+    civ_1 = records['civs'][rows, first].astype(np.int64)
+    civ_2 = records['civs'][rows, second].astype(np.int64)
+    winner = records['winner'].astype(np.int64)
+    return {
+        'index': index,
+        'started': records['started'],
+        'map_type': records['map_type'],
+        'winner': winner,
+        'player_1': records['ids'][rows, first],
+        'player_2': records['ids'][rows, second],
+        'rating_1': rating_1,
+        'rating_2': rating_2,
+        'civ_1': civ_1,
+        'civ_2': civ_2,
+        'score': np.where(winner == 1, rating_1 - rating_2, np.where(winner == 2, rating_2 - rating_1, 0)),
+        'mirror': civ_1 == civ_2,
+        'code': pack_code(civ_1, civ_2, records['map_type'].astype(np.int64)),
+    }
+
+def write(data_file, cols):
+    """ Atomically writes columns to an npz file. """
+    tmp_file = '{}.tmp.npz'.format(data_file[:-4])
+    np.savez(tmp_file, **cols)
+    os.replace(tmp_file, data_file)
+
+def read(data_file):
+    with np.load(data_file) as data:
+        return {name: data[name] for name in data.files}
@@ -2,71 +2,55 @@
 """ Build sample data sets. """
 
 import argparse
-import concurrent.futures
 import csv
 import pathlib
 import random
 import time
 import utils.solo_models
 import utils.team_models
+import utils.winners
 
 ROOT_DIR = str(pathlib.Path(__file__).parent.parent.absolute())
 
-def get_record(n):
-    return n.to_record()
+def match_winners(module, matches):
+    """ Winning team of each match, determined for all of them at once from every player's ratings (see utils.winners). """
+    profile_ids = set()
+    for match in matches:
+        profile_ids |= set(match.players)
+    table = module.Rating.table([p for p in profile_ids if p.isdigit()])
+    return utils.winners.match_winners(matches, table)
 
-def matches(module, chunksize=200):
+def write_data_set(module, data_set_type, matches, winners):
+    """ Writes the records of matches with a known winner to the data set's file, then packs it. """
+    print('{} matches for {}'.format(len(matches), data_set_type))
+    start = time.time()
+    match_records = [match.to_record(winner) for match, winner in zip(matches, winners)]
+    print('compiled {} match records for {}'.format(len(match_records), data_set_type))
+    with open(module.MatchReport.data_file(data_set_type), 'w') as f:
+        writer = csv.writer(f)
+        for record in match_records:
+            if record[6] > 0:
+                writer.writerow(record)
+    module.MatchReport.write_packed(data_set_type)
+    print('{} took {} seconds'.format(data_set_type.capitalize(), int(time.time() - start)))
+
+def matches(module):
     """ Splits matches into model, verification, and test data sets and writes to separate files. """
     matches = module.Match.all()
     print('{} matches'.format(len(matches)))
     random.shuffle(matches)
+    start = time.time()
+    winners = match_winners(module, matches)
+    print('Determined winners in {} seconds'.format(int(time.time() - start)))
 
     # First 80% go to model
     model_edge = int(len(matches)*.8)
     # Second 10% go to verification
     verification_edge = int(len(matches)*.9)
-    start = time.time()
-    # Test
-    print('{} matches for test'.format(len(matches[verification_edge:])))
-    match_records = []
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        for match_record in executor.map(get_record, matches[verification_edge:], chunksize=chunksize):
-            match_records.append(match_record)
-    print('compiled {} match records for test'.format(len(match_records)))
-    with open('{}/match_test_data.csv'.format(module.DATA_DIR), 'w') as f:
-        writer = csv.writer(f)
-        for record in match_records:
-            if record[6] > 0:
-                writer.writerow(record)
-    print('Test took {} seconds with chunksize {}'.format(int(time.time() - start), chunksize))
-    # Model
-    print('{} matches for model'.format(len(matches[:model_edge])))
-    start = time.time()
-    match_records = []
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        for match_record in executor.map(get_record, matches[:model_edge], chunksize=chunksize):
-            match_records.append(match_record)
-    print('compiled {} match_records for model'.format(len(match_records)))
-    with open('{}/match_model_data.csv'.format(module.DATA_DIR), 'w') as f:
-        writer = csv.writer(f)
-        for record in match_records:
-            if record[6] > 0:
-                writer.writerow(record)
-    print('Model took {} seconds with chunksize {}'.format(int(time.time() - start), chunksize))
-    # Verification
-    print('{} matches for verification'.format(len(matches[model_edge:verification_edge])))
-    start = time.time()
-    match_records = []
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        for match_record in executor.map(get_record, matches[model_edge:verification_edge], chunksize=chunksize):
-            match_records.append(match_record)
-    print('compiled {} match_records for verification'.format(len(match_records)))
-    with open('{}/match_verification_data.csv'.format(module.DATA_DIR), 'w') as f:
-        writer = csv.writer(f)
-        for record in match_records:
-            if record[6] > 0:
-                writer.writerow(record)
-    print('Verification took {} seconds with chunksize {}'.format(int(time.time() - start), chunksize))
+    write_data_set(module, 'test', matches[verification_edge:], winners[verification_edge:])
+    write_data_set(module, 'model', matches[:model_edge], winners[:model_edge])
+    write_data_set(module, 'verification', matches[model_edge:verification_edge], winners[model_edge:verification_edge])
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('klass', choices=('team', 'solo',), help="team or solo")
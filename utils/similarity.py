@@ -0,0 +1,62 @@
+""" Map similarity over a popularity cube of civ x map x rating key, by broadcasting. """
+
+import numpy as np
+
+def l1(cube):
+    """ civ x map x map sum of absolute differences between each pair of maps' popularity by rating. """
+    return np.abs(cube[:, :, None, :] - cube[:, None, :, :]).sum(axis=-1)
+
+def cosine(cube):
+    """ civ x map x map cosine distance (1 - cosine similarity); 1 where either map has no popularity. """
+    dots = np.einsum('cmk,cnk->cmn', cube, cube)
+    norms = np.linalg.norm(cube, axis=-1)
+    denominators = norms[:, :, None]*norms[:, None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        similarity = np.where(denominators > 0, dots/denominators, 0)
+    return 1 - similarity
+
+def jensen_shannon(cube):
+    """ civ x map x map Jensen-Shannon divergence (base 2) between each pair of maps' popularity
+    by rating, each normalized to sum to 1. 1 where either map has no popularity. """
+    totals = cube.sum(axis=-1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = np.where(totals > 0, cube/totals, 0)
+    a = p[:, :, None, :]
+    b = p[:, None, :, :]
+    m = (a + b)/2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kl_a = np.where(a > 0, a*np.log2(a/m), 0).sum(axis=-1)
+        kl_b = np.where(b > 0, b*np.log2(b/m), 0).sum(axis=-1)
+    divergence = (kl_a + kl_b)/2
+    empty = (totals[:, :, 0] == 0)
+    return np.where(empty[:, :, None] | empty[:, None, :], 1.0, divergence)
+
+METRICS = {
+    'l1': l1,
+    'cosine': cosine,
+    'js': jensen_shannon,
+}
+
+def distances(cube, metric='l1'):
+    """ civ x map x map distances between maps by metric (one of METRICS). """
+    if metric not in METRICS:
+        raise ValueError('Unknown metric {}; expected one of {}'.format(metric, ', '.join(METRICS)))
+    return METRICS[metric](np.asarray(cube, dtype=float))
+
+def most_similar(dists):
+    """ For each civ and map, the index of the closest other map (first on ties) and its distance. """
+    dists = np.array(dists, dtype=float)
+    n_maps = dists.shape[1]
+    dists[:, np.arange(n_maps), np.arange(n_maps)] = np.inf
+    closest = dists.argmin(axis=-1)
+    return closest, np.take_along_axis(dists, closest[:, :, None], axis=-1)[:, :, 0]
+
+def best_match_scores(dists):
+    """ map x map scores: for every civ for which the second map is the closest to the first, the
+    second map scores how much closer it is than the furthest closest match of any civ and map. """
+    closest, closest_dists = most_similar(dists)
+    max_similarity = closest_dists.max() if closest_dists.size else 0
+    n_civs, n_maps = closest.shape
+    scores = np.zeros((n_maps, n_maps))
+    np.add.at(scores, (np.tile(np.arange(n_maps), n_civs), closest.ravel()), (max_similarity - closest_dists).ravel())
+    return scores
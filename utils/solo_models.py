@@ -3,6 +3,7 @@
 import pathlib
 
 import utils.models
+import utils.report_columns
 
 leaderboard = 3
 
@@ -41,18 +42,49 @@ def num_player_check(num_players):
     num_players == 2
 
 class Player(utils.models.Player):
-    def rating_cache_file(data_set_type, mincount):
-        return '{}/player_rating_{}_{}_data.csv'.format(DATA_DIR, data_set_type, mincount)
+    def rating_cache_file(data_set_type):
+        return '{}/player_rating_{}_data.bin'.format(DATA_DIR, data_set_type)
     def cache_player_ratings(data_set_type, mincount=5):
         return utils.models.Player.cache_player_ratings(utils.solo_models, data_set_type, mincount)
     def player_values(matches, include_ratings=()):
         return utils.models.Player.player_values(utils.solo_models, matches, include_ratings)
 
 class MatchReport(utils.models.MatchReport):
+    def load(self, timestamp, map_type, players, winner, version):
+        """ Also sets the fields derived from the two players, team 1 first (see utils.report_columns).
+        They are None if there are not two players. """
+        super().load(timestamp, map_type, players, winner, version)
+        if len(players) != 2:
+            self.player_1 = self.player_2 = self.rating_1 = self.rating_2 = self.civ_1 = self.civ_2 = None
+            self.score = self.mirror = self.code = None
+            return
+        player_1, player_2 = utils.report_columns.ordered_players(players)
+        self.player_1 = str(player_1)
+        self.player_2 = str(player_2)
+        self.rating_1 = self.players[self.player_1]['rating']
+        self.rating_2 = self.players[self.player_2]['rating']
+        self.civ_1 = self.players[self.player_1]['civ']
+        self.civ_2 = self.players[self.player_2]['civ']
+        self.score = utils.report_columns.score(self.rating_1, self.rating_2, winner)
+        civ_code_1 = int(players[player_1]['civ'])
+        civ_code_2 = int(players[player_2]['civ'])
+        self.mirror = civ_code_1 == civ_code_2
+        self.code = utils.report_columns.pack_code(civ_code_1, civ_code_2, int(map_type))
     def data_file(data_set_type):
         return '{}/match_{}_data.csv'.format(DATA_DIR, data_set_type)
+    def packed_file(data_set_type):
+        return '{}/match_{}_data.bin'.format(DATA_DIR, data_set_type)
+    def columns_file(data_set_type):
+        return '{}/match_{}_columns.npz'.format(DATA_DIR, data_set_type)
     def all(data_set_type):
         return utils.models.MatchReport.all(MatchReport, data_set_type)
+    def write_packed(data_set_type):
+        utils.models.MatchReport.write_packed(MatchReport, data_set_type)
+        utils.models.MatchReport.write_columns(MatchReport, data_set_type)
+    def arrays(data_set_type):
+        return utils.models.MatchReport.arrays(MatchReport, data_set_type)
+    def columns(data_set_type):
+        return utils.models.MatchReport.columns(MatchReport, data_set_type)
     def by_rating(data_set_type, lower, upper):
         return utils.models.MatchReport.by_rating(MatchReport, data_set_type, lower, upper)
     def by_map(data_set_type, map_type):
@@ -113,8 +145,8 @@ class Match(utils.models.Match):
         match.winner = int(row[9])
         return match
 
-    def to_record(self):
-        return super().to_record(Match, Rating)
+    def to_record(self, winning_team=None):
+        return super().to_record(Match, Rating, winning_team)
 
     def all_for(profile_id):
         return utils.models.Match.all_for(Match, profile_id)
@@ -128,6 +160,8 @@ class Rating(utils.models.Rating):
         return utils.models.Rating.all_for(Rating, profile_id)
     def lookup_for(profile_id):
         return utils.models.Rating.lookup_for(Rating, profile_id)
+    def table(profile_ids=None, workers=None):
+        return utils.models.Rating.table(utils.solo_models, profile_ids, workers)
 class User(utils.models.User):
     def data_file():
         return '{}/users.csv'.format(DATA_DIR)
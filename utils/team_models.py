@@ -2,6 +2,7 @@
 
 import pathlib
 
+import utils.codec
 import utils.models
 
 leaderboard = 4
@@ -36,8 +37,8 @@ def num_player_check(num_players):
     num_players > 2
 
 class Player(utils.models.Player):
-    def rating_cache_file(data_set_type, mincount):
-        return '{}/player_rating_{}_{}_data.csv'.format(DATA_DIR, data_set_type, mincount)
+    def rating_cache_file(data_set_type):
+        return '{}/player_rating_{}_data.bin'.format(DATA_DIR, data_set_type)
     def cache_player_ratings(data_set_type, mincount=5):
         return utils.models.Player.cache_player_ratings(utils.team_models, data_set_type, mincount)
     def player_values(matches, include_ratings=()):
@@ -46,8 +47,14 @@ class Player(utils.models.Player):
 class MatchReport(utils.models.MatchReport):
     def data_file(data_set_type):
         return '{}/match_{}_data.csv'.format(DATA_DIR, data_set_type)
+    def packed_file(data_set_type):
+        return '{}/match_{}_data.bin'.format(DATA_DIR, data_set_type)
     def all(data_set_type):
         return utils.models.MatchReport.all(MatchReport, data_set_type)
+    def write_packed(data_set_type):
+        return utils.models.MatchReport.write_packed(MatchReport, data_set_type)
+    def arrays(data_set_type):
+        return utils.models.MatchReport.arrays(MatchReport, data_set_type)
     def by_rating(data_set_type, lower, upper):
         return utils.models.MatchReport.by_rating(MatchReport, data_set_type, lower, upper)
     def by_map(data_set_type, map_type):
@@ -103,8 +110,23 @@ class Match(utils.models.Match):
         match = Match(match_data)
         return match
 
-    def to_record(self):
-        return super().to_record(Match, Rating)
+    @property
+    def to_packed(self):
+        return utils.codec.encode(self.match_id, self.started, self.map_type, self.version, 0, self.players)
+
+    def from_packed(data):
+        match_id, started, map_type, version, _, players = utils.codec.decode(utils.codec.RECORD.unpack(data))
+        match_data = {
+            'match_id': match_id,
+            'started': started,
+            'map_type': map_type,
+            'players': [dict(profile_id=player_id, **player) for player_id, player in players.items()],
+            'version': version,
+            }
+        return Match(match_data)
+
+    def to_record(self, winning_team=None):
+        return super().to_record(Match, Rating, winning_team)
 
     def all_for(profile_id):
         return utils.models.Match.all_for(Match, profile_id)
@@ -118,6 +140,8 @@ class Rating(utils.models.Rating):
         return utils.models.Rating.all_for(Rating, profile_id)
     def lookup_for(profile_id):
         return utils.models.Rating.lookup_for(Rating, profile_id)
+    def table(profile_ids=None, workers=None):
+        return utils.models.Rating.table(utils.team_models, profile_ids, workers)
 
 class User(utils.models.User):
     def data_file():
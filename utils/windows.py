@@ -0,0 +1,37 @@
+""" Per-key sums over sliding windows of sorted records, maintained incrementally. """
+
+import numpy as np
+
+def stepped_windows(total, window, step, count):
+    """ (start, end) of count windows of length window, each step after the previous, within total records. """
+    starts = np.arange(count)*step
+    ends = np.minimum(starts + window, total)
+    starts = np.minimum(starts, total)
+    return list(zip(starts.tolist(), ends.tolist()))
+
+def sliding_sums(keys, values, n_keys, windows):
+    """ For each (start, end) window over the records, the sum of values and number of records per key.
+    Windows must move forward (neither start nor end decreasing). Each record is added once when it
+    enters a window and subtracted once when it leaves, so the cost does not grow with the window size.
+    Returns windows x n_keys arrays of sums and counts. """
+    keys = np.asarray(keys)
+    values = np.asarray(values, dtype=float)
+    sums = np.zeros((len(windows), n_keys))
+    counts = np.zeros((len(windows), n_keys), dtype=np.int64)
+    running_sums = np.zeros(n_keys)
+    running_counts = np.zeros(n_keys, dtype=np.int64)
+    start = end = 0
+    for idx, (new_start, new_end) in enumerate(windows):
+        if new_start < start or new_end < end:
+            raise ValueError('windows must move forward')
+        entering = slice(max(end, new_start), new_end)
+        np.add.at(running_sums, keys[entering], values[entering])
+        np.add.at(running_counts, keys[entering], 1)
+        leaving = slice(start, min(new_start, end))
+        np.subtract.at(running_sums, keys[leaving], values[leaving])
+        np.subtract.at(running_counts, keys[leaving], 1)
+        start = new_start
+        end = max(end, new_end)
+        sums[idx] = running_sums
+        counts[idx] = running_counts
+    return sums, counts
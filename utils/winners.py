@@ -0,0 +1,112 @@
+""" Determines the winners of many matches at once from a utils.rating_store.RatingTable.
+
+Match.determine_winner looks through each player's ratings file for a rating change from the
+rating the player had in the match, less than an hour after it started. Here the rating rows
+are sorted by profile, old rating and timestamp once, and every player of every match finds its
+window of candidate rows with two binary searches. The won states in each window then decide
+the player's state, and the players' states their team's, with the same rules. """
+
+import numpy as np
+
+import utils.rating_store
+
+UNKNOWN = 0
+WON = 1
+LOST = 2
+
+WINDOW = 3600
+# Bits of a sort key below the (profile, old rating) group
+TIMESTAMP_BITS = 36
+# Bits of a (profile, rating) key below the profile
+RATING_BITS = 20
+
+def profile_ints(profile_ids):
+    """ int64 array of profile ids (-1 for ids that are not numbers). """
+    values = []
+    for profile_id in profile_ids:
+        try:
+            values.append(int(profile_id))
+        except ValueError:
+            values.append(-1)
+    return np.array(values, dtype=np.int64)
+
+def _group_keys(profiles, ratings):
+    """ One int64 per (profile, rating) pair, ordered as the pairs. """
+    return np.asarray(profiles, dtype=np.int64)*(1 << RATING_BITS) + np.asarray(ratings, dtype=np.int64)
+
+def player_states(table, profiles, ratings, started, window=WINDOW):
+    """ WON, LOST or UNKNOWN for each player of a match (profile, rating in the match and when
+    the match started): the won state of the rating rows of that profile with that old rating and
+    a timestamp less than window seconds after started, if they all agree. """
+    profiles = np.asarray(profiles, dtype=np.int64)
+    ratings = np.asarray(ratings, dtype=np.int64)
+    started = np.asarray(started, dtype=np.int64)
+    states = np.full(len(profiles), UNKNOWN, dtype=np.int8)
+    if not len(table) or not len(profiles):
+        return states
+    # Number each (profile, old rating) group of rating rows, then sort rows by group and timestamp
+    groups, group_idx = np.unique(_group_keys(table.profile_ids, table.old_rating), return_inverse=True)
+    keys = (group_idx.ravel().astype(np.int64) << TIMESTAMP_BITS) | table.timestamp
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    won_state = table.won_state[order]
+    # Window of rows of each player's group
+    player_keys = _group_keys(profiles, ratings)
+    found = np.minimum(np.searchsorted(groups, player_keys), len(groups) - 1)
+    base = found.astype(np.int64) << TIMESTAMP_BITS
+    lo = np.searchsorted(keys, base | (started + 1), 'left')
+    hi = np.searchsorted(keys, base | (started + window - 1), 'right')
+    hi = np.where(groups[found] == player_keys, hi, lo)
+    # Which won states are in each window
+    present = {}
+    distinct = np.zeros(len(profiles), dtype=np.int64)
+    for code in np.unique(won_state).tolist():
+        counts = np.concatenate(([0], np.cumsum(won_state == code)))
+        present[code] = counts[hi] - counts[lo] > 0
+        distinct += present[code]
+    codes = utils.rating_store.WON_STATE_CODES
+    for code, state in ((codes['won'], WON,), (codes['lost'], LOST,)):
+        if code in present:
+            states[(distinct == 1) & present[code]] = state
+    return states
+
+def team_winners(match_idx, teams, states, n_matches):
+    """ Winning team of each of n_matches from the states of its players (match index, team and
+    state per player). A team with players that both won and lost makes the match undecided (0),
+    otherwise the winner is the only team with a player that won (0 if there is not exactly one). """
+    match_idx = np.asarray(match_idx, dtype=np.int64)
+    teams = np.asarray(teams, dtype=np.int64)
+    states = np.asarray(states)
+    winners = np.zeros(n_matches, dtype=np.int64)
+    if not len(match_idx):
+        return winners
+    pairs, pair_idx = np.unique(np.stack((match_idx, teams), axis=1), axis=0, return_inverse=True)
+    pair_idx = pair_idx.ravel()
+    won = np.bincount(pair_idx, weights=states == WON, minlength=len(pairs)) > 0
+    lost = np.bincount(pair_idx, weights=states == LOST, minlength=len(pairs)) > 0
+    pair_matches = pairs[:, 0]
+    contradicted = np.bincount(pair_matches, weights=won & lost, minlength=n_matches) > 0
+    won_teams = np.bincount(pair_matches, weights=won, minlength=n_matches)
+    # Team of the match's winning team, if there is exactly one
+    winning_team = np.zeros(n_matches, dtype=np.int64)
+    winning_team[pair_matches[won]] = pairs[won, 1]
+    decided = (won_teams == 1) & ~contradicted
+    winners[decided] = winning_team[decided]
+    return winners
+
+def match_winners(matches, table, window=WINDOW):
+    """ Winning team of each match (as Match.determine_winner) using the ratings in table. """
+    match_idx = []
+    profile_ids = []
+    ratings = []
+    started = []
+    teams = []
+    for idx, match in enumerate(matches):
+        for player_id, data in match.players.items():
+            match_idx.append(idx)
+            profile_ids.append(player_id)
+            ratings.append(int(data['rating']))
+            started.append(int(match.started))
+            teams.append(int(data['team']))
+    states = player_states(table, profile_ints(profile_ids), ratings, started, window)
+    return team_winners(match_idx, teams, states, len(matches)).tolist()
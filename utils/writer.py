@@ -0,0 +1,216 @@
+""" Atomic, batched writing of downloaded data files.
+
+Every file is written to a temporary file, fsynced and renamed into place, so a
+crash never leaves a truncated csv behind. The row count and checksum of each
+file written are appended to the manifest of its directory before the rename,
+which readers can use to check that a file is complete. A crash between the two
+leaves the file written before, so readers accept the previous entry as well.
+
+Several processes append to a manifest at once, so every append is a single
+write to the manifest under an exclusive flock. """
+
+import contextlib
+import csv
+import fcntl
+import hashlib
+import io
+import os
+import threading
+
+MANIFEST = 'manifest.csv'
+
+# Parsed manifests by directory, with the manifest mtime and size they were read at
+_manifest_cache = {}
+
+def manifest_file(data_dir):
+    return '{}/{}'.format(data_dir, MANIFEST)
+
+def render(header, rows):
+    """ Returns the bytes of a csv file with header (if any) and rows. """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if header:
+        writer.writerow(header)
+    writer.writerows(rows)
+    return buf.getvalue().encode('utf-8')
+
+def write_files(files):
+    """ Writes files, a dict of path to (header, rows), atomically and records them in the manifests.
+    All temporary files are written and synced before any is renamed, so a batch costs one
+    directory sync per directory rather than one per file. """
+    entries = {}
+    renames = []
+    for path, (header, rows) in files.items():
+        data = render(header, rows)
+        # The same file can be written by several processes at once
+        tmp_file = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        renames.append((tmp_file, path))
+        data_dir, filename = os.path.split(path)
+        entries.setdefault(data_dir, []).append((filename, len(rows), hashlib.sha1(data).hexdigest()))
+    for data_dir, dir_entries in entries.items():
+        with _locked_manifest(data_dir) as fd:
+            os.write(fd, render(None, dir_entries))
+            os.fsync(fd)
+    for tmp_file, path in renames:
+        os.replace(tmp_file, path)
+    for data_dir in entries:
+        _sync_dir(data_dir)
+
+def write_file(path, header, rows):
+    """ Writes a single file atomically. """
+    write_files({path: (header, rows)})
+
+@contextlib.contextmanager
+def _locked_manifest(data_dir):
+    """ Yields a file descriptor appending to the manifest of data_dir, holding an exclusive flock
+    on it. A manifest replaced by compact_manifest while waiting for the lock is opened again. """
+    data_file = manifest_file(data_dir)
+    while True:
+        fd = os.open(data_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            replaced = os.fstat(fd).st_ino != os.stat(data_file).st_ino
+        except FileNotFoundError:
+            replaced = True
+        if not replaced:
+            break
+        os.close(fd)
+    try:
+        yield fd
+    finally:
+        # Closing releases the lock
+        os.close(fd)
+
+def _sync_dir(data_dir):
+    try:
+        fd = os.open(data_dir or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _manifests(data_dir):
+    """ (latest, previous): dicts of filename to (row count, sha1 checksum) of the latest write of
+    each file and of the write before it. """
+    data_file = manifest_file(data_dir)
+    if not os.path.exists(data_file):
+        return {}, {}
+    stat = os.stat(data_file)
+    version = (stat.st_mtime_ns, stat.st_size,)
+    cached = _manifest_cache.get(data_dir)
+    if cached and cached[0] == version:
+        return cached[1]
+    entries = {}
+    previous = {}
+    with open(data_file) as f:
+        for row in csv.reader(f):
+            if len(row) == 3:
+                if row[0] in entries:
+                    previous[row[0]] = entries[row[0]]
+                entries[row[0]] = (int(row[1]), row[2])
+    _manifest_cache[data_dir] = (version, (entries, previous,))
+    return entries, previous
+
+def manifest(data_dir):
+    """ Returns dict of filename to (row count, sha1 checksum) of the latest write of each file. """
+    return _manifests(data_dir)[0]
+
+def compact_manifest(data_dir):
+    """ Rewrites the manifest keeping only the latest two entries of every file. """
+    with _locked_manifest(data_dir):
+        entries, previous = _manifests(data_dir)
+        if not entries:
+            return
+        rows = []
+        for filename, entry in sorted(entries.items()):
+            for rows_and_checksum in (previous.get(filename), entry):
+                if rows_and_checksum:
+                    rows.append((filename,) + rows_and_checksum)
+        data_file = manifest_file(data_dir)
+        tmp_file = '{}.{}.tmp'.format(data_file, os.getpid())
+        with open(tmp_file, 'w') as f:
+            csv.writer(f).writerows(rows)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, data_file)
+
+def expected_rows(path):
+    """ Number of data rows recorded for path in the manifest, None if it was not written by this module. """
+    data_dir, filename = os.path.split(path)
+    entry = manifest(data_dir).get(filename)
+    if entry:
+        return entry[0]
+
+def written_rows(path):
+    """ Row counts path can have: of its latest write and, as a crash can come between recording
+    a write and renaming the file into place, of the write before it. Empty if it was not written
+    by this module. """
+    data_dir, filename = os.path.split(path)
+    return set([entries[filename][0] for entries in _manifests(data_dir) if filename in entries])
+
+def verify(path):
+    """ Whether the file at path matches its manifest checksum. None if it is not in the manifest. """
+    data_dir, filename = os.path.split(path)
+    entry = manifest(data_dir).get(filename)
+    if not entry:
+        return None
+    if not os.path.exists(path):
+        return False
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest() == entry[1]
+
+class BatchWriter:
+    """ Collects files from many download threads and writes them batch_size at a time.
+    Use as a context manager, or call close(), so the last batch is written. """
+    def __init__(self, batch_size=200):
+        self.batch_size = batch_size
+        self.pending = {}
+        # Functions to call once the pending file of each path is written
+        self.after = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+
+    def add(self, path, header, rows, after=None):
+        """ Queues a file for writing, calling after() (if given) once it is written. A later add
+        for the same path replaces the earlier one. """
+        with self.lock:
+            self.pending[path] = (header, list(rows))
+            self.after.pop(path, None)
+            if after:
+                self.after[path] = after
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """ Writes all queued files. """
+        with self.flush_lock:
+            with self.lock:
+                pending = self.pending
+                after = self.after
+                self.pending = {}
+                self.after = {}
+            if pending:
+                write_files(pending)
+            for path in pending:
+                if path in after:
+                    after[path]()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()